@@ -9,23 +9,64 @@
 #
 # Usage
 #   python3 dotfiles.py [--link | -l]
+#   python3 -m dotfiles [options]     (faster startup, reuses cached bytecode)
 #
 # License
 #   MIT
 
 import os
 import sys
-import shutil
-import subprocess
+import time
+
+# Start of module execution, used by --startup-profile
+MODULE_START = time.perf_counter()
+
+import stat
+import marshal
 from pathlib import Path
-from datetime import datetime
 
-# Add local venv to path if it exists
+# Everything else (Rich, PyYAML and the heavier stdlib modules) is imported on
+# first use through lazy_import, so --help and cached runs stay fast
+MODULE_IMPORTS_DONE = time.perf_counter()
+
+# Seconds spent in deferred imports, keyed by module name
+IMPORT_TIMES = {}
+
+# Modules fully imported through lazy_import
+_LAZY_MODULES = {}
+
+def lazy_import(name):
+    """Import a module on first use, recording how long the import took
+
+    Safe to call from worker threads: until a module is known to be fully
+    imported, __import__ is used so a half-initialised module is never returned.
+    """
+    module = _LAZY_MODULES.get(name)
+    if module is None:
+        fresh = name not in sys.modules
+        started = time.perf_counter()
+        __import__(name)
+        module = sys.modules[name]
+        if fresh:
+            IMPORT_TIMES[name] = time.perf_counter() - started
+        _LAZY_MODULES[name] = module
+    return module
+
 SCRIPT_DIR = Path(__file__).parent.resolve()
 VENV_DIR = SCRIPT_DIR / ".venv"
+_venv_checked = False
+
+def add_venv_to_path():
+    """Add local venv to path if it exists, only once and only when a dependency is needed"""
+    global _venv_checked
+    if _venv_checked:
+        return
+    _venv_checked = True
+
+    if not VENV_DIR.exists():
+        return
 
-# Determine the site-packages path based on platform
-if VENV_DIR.exists():
+    # Determine the site-packages path based on platform
     if sys.platform == "win32":
         venv_site_packages = VENV_DIR / "Lib" / "site-packages"
     else:
@@ -33,94 +74,3621 @@ if VENV_DIR.exists():
         python_version = f"python{sys.version_info.major}.{sys.version_info.minor}"
         venv_site_packages = VENV_DIR / "lib" / python_version / "site-packages"
 
-    if venv_site_packages.exists() and str(venv_site_packages) not in sys.path:
-        sys.path.insert(0, str(venv_site_packages))
+    if venv_site_packages.exists() and str(venv_site_packages) not in sys.path:
+        sys.path.insert(0, str(venv_site_packages))
+
+# Rich is imported the first time the TUI needs it; None means not tried yet
+HAS_RICH = None
+console = None
+Confirm = Prompt = Table = Panel = box = None
+
+def has_rich():
+    """Import Rich on first use for the fancy TUI, returning whether it is available"""
+    global HAS_RICH, console, Confirm, Prompt, Table, Panel, box
+    if HAS_RICH is None:
+        add_venv_to_path()
+        try:
+            Console = lazy_import("rich.console").Console
+            Confirm = lazy_import("rich.prompt").Confirm
+            Prompt = lazy_import("rich.prompt").Prompt
+            Table = lazy_import("rich.table").Table
+            Panel = lazy_import("rich.panel").Panel
+            box = lazy_import("rich.box")
+            console = Console()
+            HAS_RICH = True
+        except ImportError:
+            HAS_RICH = False
+    return HAS_RICH
+
+# PyYAML is only imported when the manifest actually has to be parsed; a
+# valid compiled cache lets most runs skip it entirely
+HAS_YAML = None
+
+def has_yaml():
+    """Import PyYAML on first use, returning whether it is available"""
+    global HAS_YAML
+    if HAS_YAML is None:
+        add_venv_to_path()
+        try:
+            lazy_import("yaml")
+            HAS_YAML = True
+        except ImportError:
+            HAS_YAML = False
+    return HAS_YAML
+
+def print_startup_profile():
+    """Report time spent in imports versus real work for --startup-profile"""
+    total = time.perf_counter() - MODULE_START
+    eager = MODULE_IMPORTS_DONE - MODULE_START
+    deferred = sum(IMPORT_TIMES.values())
+    out = sys.stderr
+    print("Startup profile (since dotfiles.py started executing):", file=out)
+    print(f"  eager imports     {eager * 1000:8.2f} ms", file=out)
+    print(f"  deferred imports  {deferred * 1000:8.2f} ms", file=out)
+    for name, seconds in sorted(IMPORT_TIMES.items(), key=lambda item: -item[1]):
+        print(f"    {name:16}{seconds * 1000:8.2f} ms", file=out)
+    print(f"  work              {(total - eager - deferred) * 1000:8.2f} ms", file=out)
+    print(f"  total             {total * 1000:8.2f} ms", file=out)
+
+class Tracer:
+    """Records timed spans for --trace and writes them as Chrome trace events
+
+    The output loads in chrome://tracing or https://ui.perfetto.dev. Spans
+    from worker threads appear on their own track. Spans nest: apply_link
+    includes the backup_file, remove and symlink spans run inside it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+        self.pid = os.getpid()
+        self.get_ident = lazy_import("_thread").get_ident
+
+    def add(self, phase, started, ended, entry=None):
+        """Record a finished span; list.append keeps this safe across threads"""
+        self.events.append((phase, started, ended, self.get_ident(), entry))
+
+    def span(self, phase, entry=None):
+        """Context manager timing a block as one span"""
+        return _TraceSpan(self, phase, entry)
+
+    def write(self):
+        """Write all spans as a Chrome trace-event JSON file"""
+        json = lazy_import("json")
+        threads = {}
+        events = []
+        for phase, started, ended, tid, entry in self.events:
+            threads.setdefault(tid, len(threads))
+            event = {
+                'name': phase,
+                'cat': "dotfiles",
+                'ph': "X",
+                'ts': round((started - MODULE_START) * 1e6, 3),
+                'dur': round((ended - started) * 1e6, 3),
+                'pid': self.pid,
+                'tid': threads[tid],
+            }
+            if entry is not None:
+                event['args'] = {'entry': str(entry)}
+            events.append(event)
+        for tid, index in threads.items():
+            name = "main" if index == 0 else f"worker {index}"
+            events.append({'name': "thread_name", 'ph': "M", 'pid': self.pid, 'tid': index, 'args': {'name': name}})
+        events.append({'name': "process_name", 'ph': "M", 'pid': self.pid, 'args': {'name': "dotfiles.py"}})
+
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': "ms"}, f)
+
+    def print_summary(self, slowest=10):
+        """Per-phase totals and the slowest individual entries, on stderr"""
+        out = sys.stderr
+        phases = {}
+        for phase, started, ended, tid, entry in self.events:
+            count, total, worst = phases.get(phase, (0, 0.0, 0.0))
+            phases[phase] = (count + 1, total + ended - started, max(worst, ended - started))
+
+        print(f"Trace summary ({len(self.events)} spans, phases nest so totals overlap):", file=out)
+        print(f"  {'phase':20} {'count':>7} {'total ms':>10} {'mean ms':>9} {'max ms':>9}", file=out)
+        for phase, (count, total, worst) in sorted(phases.items(), key=lambda item: -item[1][1]):
+            print(f"  {phase:20} {count:7d} {total * 1000:10.2f} {total / count * 1000:9.3f} {worst * 1000:9.3f}", file=out)
+
+        spans = [event for event in self.events if event[4] is not None]
+        if spans:
+            print("Slowest entries:", file=out)
+            for phase, started, ended, tid, entry in sorted(spans, key=lambda event: -(event[2] - event[1]))[:slowest]:
+                print(f"  {(ended - started) * 1000:9.3f} ms  {phase:20} {entry}", file=out)
+        print(f"Trace written to {self.path}", file=out)
+
+class _TraceSpan:
+    __slots__ = ("tracer", "phase", "entry", "started")
+
+    def __init__(self, tracer, phase, entry):
+        self.tracer = tracer
+        self.phase = phase
+        self.entry = entry
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.add(self.phase, self.started, time.perf_counter(), self.entry)
+        return False
+
+class _NoSpan:
+    """Stand-in for _TraceSpan while tracing is off"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+# Active Tracer when running with --trace, otherwise None
+TRACER = None
+
+def trace_span(phase, entry=None):
+    """Time a block as a span when tracing, at the cost of a global lookup otherwise"""
+    if TRACER is None:
+        return _NO_SPAN
+    return TRACER.span(phase, entry)
+
+def traced(phase, entry=None):
+    """Decorator recording every call of a function as a span while tracing
+
+    Args:
+        phase: Span name shown in the trace and the summary
+        entry: Index of the positional argument naming the entry, if any
+    """
+    def decorate(func):
+        def wrapper(*args, **kwargs):
+            if TRACER is None:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                label = args[entry] if entry is not None and entry < len(args) else None
+                TRACER.add(phase, started, time.perf_counter(), label)
+        wrapper.__name__ = func.__name__
+        wrapper.__qualname__ = func.__qualname__
+        wrapper.__doc__ = func.__doc__
+        wrapper.__wrapped__ = func
+        return wrapper
+    return decorate
+
+# Manifest file path
+MANIFEST_FILE = SCRIPT_DIR / "manifest.yaml"
+
+# Compiled manifest cache, a marshal snapshot of the parsed entries keyed on
+# the manifest's mtime, size and content hash
+MANIFEST_CACHE_FILE = SCRIPT_DIR / ".manifest.cache"
+MANIFEST_CACHE_VERSION = 5
+
+# Directory listings used to expand pattern entries, keyed by directory mtime
+MANIFEST_INDEX_FILE = SCRIPT_DIR / ".manifest.index"
+
+# Names never picked up by pattern entries
+DEFAULT_IGNORES = (".git", "__pycache__", ".DS_Store")
+
+# How an entry reaches its destination: a symlink, a file written from the
+# source as-is or rendered with host variables, or (for directories) links
+# to individual files inside an existing directory, stow-style
+ENTRY_MODES = ("link", "copy", "template", "tree")
+RENDER_MODES = ("copy", "template")
+
+def _manifest_digest(data):
+    """Content hash used to validate the manifest cache"""
+    return lazy_import("hashlib").blake2b(data, digest_size=16).digest()
+
+def load_manifest_cache():
+    """Return cached (entries, settings), or None if the cache is stale or missing
+
+    A matching mtime and size is trusted as-is. If only those changed (e.g. the
+    file was touched or checked out again) the content hash decides, and the
+    cache header is refreshed so the next run takes the fast path again.
+    """
+    try:
+        with open(MANIFEST_CACHE_FILE, 'rb') as f:
+            version, mtime_ns, size, digest, entries, settings = marshal.load(f)
+        st = os.stat(MANIFEST_FILE)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+    if version != MANIFEST_CACHE_VERSION:
+        return None
+
+    if st.st_mtime_ns == mtime_ns and st.st_size == size:
+        return [tuple(entry) for entry in entries], settings
+
+    try:
+        with open(MANIFEST_FILE, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) != st.st_size or _manifest_digest(data) != digest:
+        return None
+
+    save_manifest_cache(entries, settings, st, digest)
+    return [tuple(entry) for entry in entries], settings
+
+def _atomic_write(path, data):
+    """Replace path with data in one step: write a temp file beside it, fsync, rename
+
+    Readers see the old file or the new one, never a partial write. The temp
+    name is unique per process and thread, and it is removed when anything fails.
+    """
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{lazy_import('threading').get_ident()}.tmp")
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        raise
+
+def save_manifest_cache(entries, settings, st, digest):
+    """Atomically write the compiled manifest cache, ignoring unwritable repos"""
+    snapshot = (MANIFEST_CACHE_VERSION, st.st_mtime_ns, st.st_size, digest, tuple(entries), settings)
+    try:
+        _atomic_write(MANIFEST_CACHE_FILE, marshal.dumps(snapshot))
+    except OSError:
+        pass
+
+class ManifestSyntaxError(ValueError):
+    """Error in manifest.yaml found by the built-in parser, with its line number"""
+
+    def __init__(self, lineno, message):
+        super().__init__(f"line {lineno}: {message}")
+        self.lineno = lineno
+
+class ManifestParser:
+    """Single-pass parser for the YAML subset manifest.yaml uses
+
+    Supported: nested block mappings and sequences (including '- key: value'
+    items and sequences at the same indentation as their key), plain, single-
+    and double-quoted scalars, flow lists like [a, "b"], comments, and the
+    null/bool/int/float scalars PyYAML resolves. Anchors, tags, flow mappings
+    and multi-line scalars are rejected with the offending line number.
+
+    Lines are consumed from an iterator with one line of lookahead, so the
+    manifest is never tokenized or held in memory as a whole.
+    """
+
+    BOOLS = {
+        "true": True, "True": True, "TRUE": True, "yes": True, "Yes": True, "YES": True,
+        "on": True, "On": True, "ON": True,
+        "false": False, "False": False, "FALSE": False, "no": False, "No": False, "NO": False,
+        "off": False, "Off": False, "OFF": False,
+    }
+    NULLS = {"", "~", "null", "Null", "NULL"}
+
+    def __init__(self, text):
+        self._lines = iter(text.splitlines())
+        self._lineno = 0
+        self._next = None
+        self._advance()
+
+    def _advance(self):
+        """Load the next meaningful line as (lineno, indent, text), or None at the end"""
+        for line in self._lines:
+            self._lineno += 1
+            stripped = line.lstrip(" ")
+            if not stripped or stripped.startswith("#"):
+                continue
+            if stripped.startswith("\t"):
+                raise ManifestSyntaxError(self._lineno, "tabs are not allowed for indentation")
+            if stripped.rstrip() in ("---", "..."):
+                continue
+            self._next = (self._lineno, len(line) - len(stripped), stripped.rstrip())
+            return
+        self._next = None
+
+    def parse(self):
+        """Parse the whole document and return the top-level value"""
+        if self._next is None:
+            return None
+        lineno, indent, text = self._next
+        if indent:
+            raise ManifestSyntaxError(lineno, "the document must start at column 1")
+        value = self._block(0)
+        if self._next is not None:
+            raise ManifestSyntaxError(self._next[0], "unexpected content after the top-level block")
+        return value
+
+    def _block(self, indent):
+        """Parse a mapping or sequence whose lines start at the given indent"""
+        lineno, _, text = self._next
+        if text == "-" or text.startswith("- "):
+            return self._sequence(indent)
+        return self._mapping(indent)
+
+    @staticmethod
+    def _split_key(text):
+        """Split 'key: rest' into (key, rest), or return None if text is not a key"""
+        if text[0] in "\"'":
+            end = text.find(text[0], 1)
+            if end < 0 or text[end + 1:end + 2] != ":":
+                return None
+            key, rest = text[1:end], text[end + 2:]
+        else:
+            colon = text.find(": ")
+            if colon < 0:
+                if not text.endswith(":"):
+                    return None
+                colon = len(text) - 1
+            key, rest = text[:colon].rstrip(), text[colon + 1:]
+            if not key or " #" in key:
+                return None
+        if rest and not rest.startswith(" "):
+            return None
+        return key, rest.strip()
+
+    def _mapping(self, indent):
+        result = {}
+        while self._next is not None:
+            lineno, line_indent, text = self._next
+            if line_indent < indent:
+                break
+            if line_indent > indent:
+                raise ManifestSyntaxError(lineno, "unexpected indentation")
+            if text == "-" or text.startswith("- "):
+                raise ManifestSyntaxError(lineno, "expected 'key: value', found a list item")
+
+            split = self._split_key(text)
+            if split is None:
+                raise ManifestSyntaxError(lineno, f"expected 'key: value', found {text!r}")
+            key, rest = split
+            if key in result:
+                raise ManifestSyntaxError(lineno, f"duplicate key {key!r}")
+            self._advance()
+
+            if rest and not rest.startswith("#"):
+                result[key] = self._scalar(rest, lineno)
+                continue
+
+            # The value is a nested block: deeper, or a sequence at the same indent
+            following = self._next
+            if following is not None and (following[1] > indent or (
+                    following[1] == indent and (following[2] == "-" or following[2].startswith("- ")))):
+                result[key] = self._block(following[1])
+            else:
+                result[key] = None
+        return result
+
+    def _sequence(self, indent):
+        result = []
+        while self._next is not None:
+            lineno, line_indent, text = self._next
+            if line_indent < indent:
+                break
+            if line_indent > indent:
+                raise ManifestSyntaxError(lineno, "unexpected indentation")
+            if not (text == "-" or text.startswith("- ")):
+                break
+
+            item = text[1:].lstrip(" ")
+            if not item or item.startswith("#"):
+                # '-' on its own: the item is the block below it
+                self._advance()
+                if self._next is None or self._next[1] <= indent:
+                    result.append(None)
+                else:
+                    result.append(self._block(self._next[1]))
+            elif self._split_key(item) is not None or item.startswith("- "):
+                # '- key: value': continue as a block at the column of 'key'
+                self._next = (lineno, line_indent + len(text) - len(item), item)
+                result.append(self._block(self._next[1]))
+            else:
+                self._advance()
+                result.append(self._scalar(item, lineno))
+        return result
+
+    def _strip_comment(self, text):
+        """Remove a trailing ' # comment' that is not inside quotes"""
+        quote = None
+        for pos, char in enumerate(text):
+            if quote:
+                if char == quote:
+                    quote = None
+            elif char in "\"'" and (pos == 0 or text[pos - 1] in " [,"):
+                quote = char
+            elif char == "#" and pos and text[pos - 1] == " ":
+                return text[:pos].rstrip()
+        return text
+
+    def _scalar(self, text, lineno):
+        text = self._strip_comment(text)
+        if text.startswith("["):
+            if not text.endswith("]"):
+                raise ManifestSyntaxError(lineno, "unterminated flow list")
+            return self._flow_list(text[1:-1], lineno)
+        if text[0] in "\"'":
+            value, end = self._quoted(text, 0, lineno)
+            if text[end:].strip():
+                raise ManifestSyntaxError(lineno, f"unexpected text after quoted string: {text[end:].strip()!r}")
+            return value
+        if text[0] in "{&*!|>%@`":
+            raise ManifestSyntaxError(lineno, f"unsupported YAML syntax {text[0]!r} (quote the value)")
+        return self._plain(text)
+
+    def _quoted(self, text, start, lineno):
+        """Parse a quoted string starting at text[start], returning (value, end position)"""
+        quote = text[start]
+        out = []
+        pos = start + 1
+        while pos < len(text):
+            char = text[pos]
+            if char == quote:
+                if quote == "'" and text[pos + 1:pos + 2] == "'":
+                    out.append("'")
+                    pos += 2
+                    continue
+                return "".join(out), pos + 1
+            if char == "\\" and quote == '"':
+                escape = text[pos + 1:pos + 2]
+                escapes = {"n": "\n", "t": "\t", "\\": "\\", '"': '"', "/": "/", "0": "\0", " ": " "}
+                if escape not in escapes:
+                    raise ManifestSyntaxError(lineno, f"unsupported escape \\{escape}")
+                out.append(escapes[escape])
+                pos += 2
+                continue
+            out.append(char)
+            pos += 1
+        raise ManifestSyntaxError(lineno, "unterminated quoted string")
+
+    def _flow_list(self, inner, lineno):
+        items = []
+        pos = 0
+        while pos < len(inner):
+            while pos < len(inner) and inner[pos] == " ":
+                pos += 1
+            if pos >= len(inner):
+                break
+            if inner[pos] in "\"'":
+                value, pos = self._quoted(inner, pos, lineno)
+                items.append(value)
+                rest = inner[pos:].lstrip(" ")
+                if rest and not rest.startswith(","):
+                    raise ManifestSyntaxError(lineno, "expected ',' in flow list")
+                pos = len(inner) - len(rest) + 1
+            else:
+                comma = inner.find(",", pos)
+                comma = len(inner) if comma < 0 else comma
+                token = inner[pos:comma].strip()
+                if token[:1] in "[{":
+                    raise ManifestSyntaxError(lineno, "nested flow collections are not supported")
+                items.append(self._plain(token))
+                pos = comma + 1
+        return items
+
+    def _plain(self, text):
+        """Resolve a plain scalar the way PyYAML's safe loader does for the common cases"""
+        if text in self.NULLS:
+            return None
+        if text in self.BOOLS:
+            return self.BOOLS[text]
+        digits = text.replace("_", "")
+        if digits.lstrip("+-").isdigit():
+            return int(digits)
+        if any(char.isdigit() for char in text) and "." in text and text.lower().lstrip("+-.")[:1].isdigit():
+            try:
+                return float(digits)
+            except ValueError:
+                pass
+        return text
+
+def parse_yaml_subset(text):
+    """Parse manifest-style YAML without PyYAML (see ManifestParser)"""
+    if isinstance(text, bytes):
+        text = text.decode("utf-8")
+    return ManifestParser(text).parse()
+
+@traced("parse_manifest")
+def parse_manifest(data):
+    """Parse manifest.yaml contents
+
+    Returns:
+        Tuple of (list of (source, dest, description) tuples, settings dict)
+    """
+    if has_yaml():
+        yaml = lazy_import("yaml")
+        try:
+            data = yaml.safe_load(data)
+        except yaml.YAMLError as e:
+            print(f"Error: Failed to parse manifest.yaml: {e}")
+            sys.exit(1)
+    else:
+        # No PyYAML: the built-in parser covers everything manifest.yaml needs
+        try:
+            data = parse_yaml_subset(data)
+        except (ManifestSyntaxError, UnicodeDecodeError) as e:
+            print(f"Error: Failed to parse manifest.yaml: {e}")
+            sys.exit(1)
+
+    if not isinstance(data, dict) or 'dotfiles' not in data:
+        print(f"Error: Invalid manifest format in {MANIFEST_FILE}")
+        print("Expected 'dotfiles' key with a list of entries.")
+        sys.exit(1)
+
+    # Convert to tuple format (source, dest, description), with a fourth
+    # options element for pattern entries that are expanded at load time
+    dotfiles = []
+    modes = {}
+    for entry in data['dotfiles']:
+        if not all(k in entry for k in ['source', 'dest', 'description']):
+            print(f"Warning: Skipping invalid entry: {entry}")
+            continue
+        mode = entry.get('mode') or 'link'
+        if mode not in ENTRY_MODES:
+            print(f"Warning: Unknown mode '{mode}' for {entry['dest']}, linking it instead")
+        elif mode != 'link':
+            if is_pattern_entry(entry['source']) or entry.get('expand'):
+                print(f"Warning: mode '{mode}' is not supported on pattern entries, linking {entry['source']} instead")
+            else:
+                modes[entry['dest']] = mode
+        if is_pattern_entry(entry['source']) or entry.get('expand'):
+            ignore = entry.get('ignore') or []
+            if isinstance(ignore, str):
+                ignore = [ignore]
+            options = {'expand': bool(entry.get('expand')), 'ignore': [str(rule) for rule in ignore]}
+            dotfiles.append((entry['source'], entry['dest'], entry['description'], options))
+        else:
+            dotfiles.append((entry['source'], entry['dest'], entry['description']))
+
+    settings = parse_settings(data)
+    if modes:
+        settings['modes'] = modes
+    return dotfiles, settings
+
+def parse_size(value):
+    """Bytes from an int or a string like '512K', '200M' or '2G'"""
+    if isinstance(value, int):
+        return value
+    text = str(value).strip().upper().rstrip("B")
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def parse_age(value):
+    """Seconds from a number of days or a string like '12h', '90d' or '8w'"""
+    if isinstance(value, (int, float)):
+        return float(value) * 86400
+    text = str(value).strip().lower()
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text) * 86400
+
+def parse_settings(data):
+    """Settings from the manifest's top-level keys other than 'dotfiles'
+
+    Only plain values are kept so the settings can live in the marshal cache.
+    """
+    settings = {}
+    backups = data.get('backups') or {}
+    if not isinstance(backups, dict):
+        print("Warning: Ignoring 'backups' in manifest.yaml, expected a mapping")
+        backups = {}
+
+    retention = {}
+    for key, parse in (('keep', int), ('max_size', parse_size), ('max_age', parse_age)):
+        if backups.get(key) is None:
+            continue
+        try:
+            retention[key] = parse(backups[key])
+        except (TypeError, ValueError):
+            print(f"Warning: Ignoring invalid backups.{key} in manifest.yaml: {backups[key]}")
+    if retention:
+        settings['retention'] = retention
+
+    # Template variables: defaults for every machine, then per-host overrides
+    variables = data.get('variables') or {}
+    hosts = data.get('hosts') or {}
+    if not isinstance(variables, dict) or not isinstance(hosts, dict) \
+            or not all(isinstance(values, dict) for values in hosts.values()):
+        print("Warning: Ignoring 'variables'/'hosts' in manifest.yaml, expected mappings")
+        variables, hosts = {}, {}
+    def plain(values):
+        # Scalars only, so the settings stay marshallable (e.g. no YAML dates)
+        return {str(key): value if value is None or isinstance(value, (str, int, float, bool)) else str(value)
+                for key, value in values.items()}
+
+    if variables:
+        settings['variables'] = plain(variables)
+    if hosts:
+        settings['hosts'] = {str(host): plain(values) for host, values in hosts.items()}
+
+    # Setup tasks as (name, run, description, needs, inputs, platform, interactive)
+    tasks = data.get('tasks') or []
+    if not isinstance(tasks, list):
+        print("Warning: Ignoring 'tasks' in manifest.yaml, expected a list")
+        tasks = []
+    def names(value):
+        # A single name or pattern may be given without a list
+        if value is None:
+            return []
+        return [str(item) for item in value] if isinstance(value, list) else [str(value)]
+
+    parsed = []
+    for task in tasks:
+        if not isinstance(task, dict) or not task.get('name') or not task.get('run'):
+            print(f"Warning: Ignoring task without a name and run command in manifest.yaml: {task}")
+            continue
+        name = str(task['name'])
+        if any(other[0] == name for other in parsed):
+            print(f"Warning: Ignoring duplicate task '{name}' in manifest.yaml")
+            continue
+        platform = task.get('platform')
+        parsed.append((name, str(task['run']), str(task.get('description') or ""),
+                       names(task.get('needs')), names(task.get('inputs')),
+                       str(platform) if platform else None, bool(task.get('interactive'))))
+    if parsed:
+        settings['tasks'] = parsed
+    return settings
+
+def is_pattern_entry(source):
+    """Whether a manifest source is a glob pattern rather than a single path"""
+    return any(char in source for char in "*?[")
+
+class ScandirIndex:
+    """Directory listings cached by directory mtime
+
+    Expanding a pattern entry needs the names in a few repo directories. A
+    directory's mtime changes whenever an entry is added, removed or renamed
+    in it, so a listing is reused as long as the mtime matches and re-read
+    with os.scandir otherwise. Listings taken within the filesystem's mtime
+    granularity of a change are not trusted, so a quick edit is never missed.
+    """
+
+    VERSION = 1
+    RACY_NS = 2 * 1000 ** 3
+
+    def __init__(self, path):
+        self.path = path
+        self.listings = None
+        self.dirty = False
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                version, listings = marshal.load(f)
+            self.listings = listings if version == self.VERSION else {}
+        except (OSError, EOFError, ValueError, TypeError):
+            self.listings = {}
+
+    def listdir(self, directory):
+        """Return [(name, is_dir)] for a directory, or [] if it does not exist"""
+        if self.listings is None:
+            self._load()
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            return []
+
+        cached = self.listings.get(directory)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+
+        try:
+            with os.scandir(directory) as it:
+                names = sorted((entry.name, entry.is_dir()) for entry in it)
+        except OSError:
+            return []
+
+        if time.time_ns() - mtime_ns > self.RACY_NS:
+            self.listings[directory] = (mtime_ns, names)
+            self.dirty = True
+        return names
+
+    def save(self):
+        """Write the index back if any listing changed, ignoring unwritable repos"""
+        if not self.dirty:
+            return
+        try:
+            _atomic_write(self.path, marshal.dumps((self.VERSION, self.listings)))
+            self.dirty = False
+        except OSError:
+            pass
+
+def _static_prefix(parts):
+    """Number of leading path segments without glob characters"""
+    count = 0
+    for part in parts:
+        if is_pattern_entry(part):
+            break
+        count += 1
+    return count
+
+def expand_pattern(repo_root, pattern, ignore, index):
+    """Match a glob pattern against the repo with the scandir index
+
+    Supports *, ?, [...] within a segment and ** for any number of directories.
+
+    Returns:
+        Sorted list of matched paths relative to the pattern's fixed prefix
+    """
+    fnmatch = lazy_import("fnmatch")
+    parts = [part for part in pattern.strip("/").split("/") if part and part != "."]
+    fixed = _static_prefix(parts)
+    base = os.path.join(repo_root, *parts[:fixed]) if fixed else repo_root
+    rules = list(DEFAULT_IGNORES) + list(ignore)
+
+    def ignored(rel):
+        name = rel.rsplit("/", 1)[-1]
+        return any(fnmatch.fnmatchcase(rel, rule) or fnmatch.fnmatchcase(name, rule) for rule in rules)
+
+    # Each candidate is (relative path from base, is_dir)
+    candidates = [("", True)]
+    for part in parts[fixed:]:
+        matched = []
+        for rel, is_dir in candidates:
+            if not is_dir:
+                continue
+            if part == "**":
+                # Zero or more directories
+                stack = [rel]
+                while stack:
+                    current = stack.pop()
+                    matched.append((current, True))
+                    for name, child_is_dir in index.listdir(os.path.join(base, current) if current else base):
+                        child = f"{current}/{name}" if current else name
+                        if child_is_dir and not ignored(child):
+                            stack.append(child)
+                continue
+            for name, child_is_dir in index.listdir(os.path.join(base, rel) if rel else base):
+                child = f"{rel}/{name}" if rel else name
+                if fnmatch.fnmatchcase(name, part) and not ignored(child):
+                    matched.append((child, child_is_dir))
+        candidates = matched
+
+    return sorted({rel for rel, is_dir in candidates if rel})
+
+@traced("expand_manifest")
+def expand_manifest(raw_entries, repo_root=None):
+    """Expand pattern entries into one (source, dest, description) per match
+
+    A pattern entry maps each match to the same relative path under its
+    destination, e.g. source '.config/*' with dest '.config' links every
+    directory in the repo's .config individually. 'expand: true' on a plain
+    directory entry is shorthand for '<source>/*'. Explicit entries win over
+    expansions with the same destination.
+    """
+    if not any(len(entry) > 3 for entry in raw_entries):
+        return [tuple(entry) for entry in raw_entries]
+
+    repo_root = str(repo_root or MANIFEST_FILE.parent)
+    index = ScandirIndex(MANIFEST_INDEX_FILE)
+    explicit = {entry[1] for entry in raw_entries if len(entry) == 3}
+    seen = set()
+    dotfiles = []
+
+    for entry in raw_entries:
+        if len(entry) == 3:
+            dotfiles.append(tuple(entry))
+            continue
+
+        source, dest, desc, options = entry
+        if options.get('expand') and not is_pattern_entry(source):
+            source = source.rstrip("/") + "/*"
+        source_parts = [part for part in source.strip("/").split("/") if part and part != "."]
+        source_base = "/".join(source_parts[:_static_prefix(source_parts)])
+        dest_parts = [part for part in dest.strip("/").split("/") if part and part != "."]
+        dest_base = "/".join(dest_parts[:_static_prefix(dest_parts)])
+
+        for rel in expand_pattern(repo_root, source, options.get('ignore', []), index):
+            match_source = f"{source_base}/{rel}" if source_base else rel
+            match_dest = f"{dest_base}/{rel}" if dest_base else rel
+            if match_dest in explicit or match_dest in seen:
+                continue
+            seen.add(match_dest)
+            match_desc = desc.replace("{name}", rel) if "{name}" in desc else f"{desc}: {rel}"
+            dotfiles.append((match_source, match_dest, match_desc))
+
+    index.save()
+    return dotfiles
+
+@traced("load_manifest")
+def load_dotfiles_manifest(rebuild_cache=False):
+    """Load dotfiles configuration from manifest.yaml
+
+    Args:
+        rebuild_cache: Ignore the compiled cache and parse the manifest again
+    """
+    if not MANIFEST_FILE.exists():
+        print(f"Error: Manifest file not found: {MANIFEST_FILE}")
+        print("Please create a manifest.yaml file or restore it from the repository.")
+        sys.exit(1)
+
+    global MANIFEST_SETTINGS
+    if not rebuild_cache:
+        cached = load_manifest_cache()
+        if cached and cached[0]:
+            dotfiles, MANIFEST_SETTINGS = cached
+            return expand_manifest(dotfiles)
+
+    try:
+        with open(MANIFEST_FILE, 'rb') as f:
+            st = os.fstat(f.fileno())
+            data = f.read()
+
+        dotfiles, settings = parse_manifest(data)
+
+        if not dotfiles:
+            print(f"Error: No valid dotfiles found in {MANIFEST_FILE}")
+            sys.exit(1)
+
+        save_manifest_cache(dotfiles, settings, st, _manifest_digest(data))
+        MANIFEST_SETTINGS = settings
+        return expand_manifest(dotfiles)
+
+    except Exception as e:
+        print(f"Error: Failed to load manifest: {e}")
+        sys.exit(1)
+
+# Lazy loading of dotfiles - only load when needed, not at import time
+DOTFILES = None
+
+# Top-level manifest settings (e.g. backup retention), loaded with DOTFILES
+MANIFEST_SETTINGS = {}
+
+def get_dotfiles(rebuild_cache=False):
+    """Get dotfiles list, loading from the manifest cache or manifest if needed"""
+    global DOTFILES
+    if DOTFILES is None or rebuild_cache:
+        DOTFILES = load_dotfiles_manifest(rebuild_cache=rebuild_cache)
+    return DOTFILES
+
+def get_manifest_settings():
+    """Get the manifest's top-level settings, loading the manifest if needed"""
+    get_dotfiles()
+    return MANIFEST_SETTINGS
+
+def entry_mode(dest_rel):
+    """One of ENTRY_MODES for a manifest destination"""
+    return get_manifest_settings().get('modes', {}).get(dest_rel, 'link')
+
+# Status codes for a manifest entry and the labels shown for them
+STATUS_MISSING = "missing"
+STATUS_NOT_LINKED = "not-linked"
+STATUS_LINKED = "linked"
+STATUS_ELSEWHERE = "elsewhere"
+STATUS_EXISTS = "exists"
+# Copy and template entries: the destination holds the current render, or
+# needs (re)rendering because it is missing or its template/variables changed
+STATUS_RENDERED = "rendered"
+STATUS_STALE = "stale"
+
+STATUS_LABELS = {
+    STATUS_MISSING: "✗ Missing in repo",
+    STATUS_NOT_LINKED: "✓ Not linked",
+    STATUS_LINKED: "→ Already linked",
+    STATUS_ELSEWHERE: "→ Links elsewhere",
+    STATUS_EXISTS: "⚠ File exists",
+    STATUS_RENDERED: "→ Rendered",
+    STATUS_STALE: "✓ Needs render",
+}
+
+# Reverse lookup, for filtering rows that only carry the label
+STATUS_CODES = {label: code for code, label in STATUS_LABELS.items()}
+
+# File kinds recorded in a status record (None means the path does not exist)
+KIND_FILE = "file"
+KIND_DIR = "dir"
+KIND_LINK = "link"
+KIND_OTHER = "other"
+
+def _kind_from_mode(mode):
+    """Map an lstat mode to one of the KIND_* constants"""
+    if stat.S_ISLNK(mode):
+        return KIND_LINK
+    if stat.S_ISDIR(mode):
+        return KIND_DIR
+    if stat.S_ISREG(mode):
+        return KIND_FILE
+    return KIND_OTHER
+
+def _kind_from_direntry(entry):
+    """Map an os.DirEntry to one of the KIND_* constants without following links"""
+    if entry.is_symlink():
+        return KIND_LINK
+    if entry.is_dir(follow_symlinks=False):
+        return KIND_DIR
+    if entry.is_file(follow_symlinks=False):
+        return KIND_FILE
+    return KIND_OTHER
+
+class EntryStatus:
+    """Compact status record for one manifest entry"""
+    __slots__ = ("source_rel", "dest_rel", "state", "source_kind", "dest_kind", "target")
+
+    def __init__(self, source_rel, dest_rel, state, source_kind, dest_kind, target=None):
+        self.source_rel = source_rel
+        self.dest_rel = dest_rel
+        self.state = state
+        self.source_kind = source_kind
+        self.dest_kind = dest_kind
+        self.target = target
+
+    @property
+    def label(self):
+        return STATUS_LABELS[self.state]
+
+    def __repr__(self):
+        return f"EntryStatus({self.dest_rel!r}, {self.state!r})"
+
+class StatusEngine:
+    """Classify manifest entries with as few filesystem calls as possible
+
+    Every source and destination is looked at with a single lstat, or for
+    free from os.scandir when several paths share a directory. Symlinks cost
+    one extra readlink; realpath is only needed when the link text does not
+    already name the source.
+    """
+
+    def __init__(self, repo_path, home_path, renderer=None, tree=None):
+        self.repo_path = repo_path
+        self.home_path = home_path
+        # Classifies copy and template entries, whose destinations are files
+        self.renderer = renderer
+        # Classifies tree entries whose destination is a real directory
+        self.tree = tree
+
+    def _kinds(self, paths):
+        """Return {path: kind} for the given paths, scanning shared directories once"""
+        by_parent = {}
+        for path in paths:
+            by_parent.setdefault(os.path.dirname(path), []).append(path)
+
+        kinds = {}
+        for parent, children in by_parent.items():
+            if len(children) > 1:
+                # One getdents pass answers every sibling; d_type avoids the stats
+                try:
+                    with os.scandir(parent) as it:
+                        found = {entry.name: _kind_from_direntry(entry) for entry in it}
+                except (FileNotFoundError, NotADirectoryError):
+                    found = {}
+                except OSError:
+                    found = None
+                if found is not None:
+                    for path in children:
+                        kinds[path] = found.get(os.path.basename(path))
+                    continue
+
+            for path in children:
+                try:
+                    kinds[path] = _kind_from_mode(os.lstat(path).st_mode)
+                except OSError:
+                    kinds[path] = None
+        return kinds
+
+    def _classify(self, source_rel, dest_rel, source, dest, source_kind, dest_kind):
+        """Turn the kinds of a source and destination into an EntryStatus"""
+        if source_kind is None:
+            return EntryStatus(source_rel, dest_rel, STATUS_MISSING, source_kind, dest_kind)
+
+        mode = entry_mode(dest_rel) if self.renderer is not None or self.tree is not None else 'link'
+        if mode in RENDER_MODES and self.renderer is not None:
+            return EntryStatus(source_rel, dest_rel, self.renderer.state(source_rel, dest_rel, source, dest, dest_kind),
+                               source_kind, dest_kind)
+        if mode == 'tree' and self.tree is not None and source_kind == KIND_DIR and dest_kind == KIND_DIR:
+            return EntryStatus(source_rel, dest_rel, self.tree.state(dest_rel, source, dest), source_kind, dest_kind)
+
+        if dest_kind is None:
+            return EntryStatus(source_rel, dest_rel, STATUS_NOT_LINKED, source_kind, dest_kind)
+
+        if dest_kind != KIND_LINK:
+            return EntryStatus(source_rel, dest_rel, STATUS_EXISTS, source_kind, dest_kind)
+
+        try:
+            target = os.readlink(dest)
+        except OSError:
+            return EntryStatus(source_rel, dest_rel, STATUS_NOT_LINKED, source_kind, None)
+
+        resolved = os.path.normpath(os.path.join(os.path.dirname(dest), target))
+        if resolved == source:
+            return EntryStatus(source_rel, dest_rel, STATUS_LINKED, source_kind, dest_kind, target)
+
+        # The link text differs; fall back to resolving it (rare, costs a walk)
+        if not os.path.exists(dest):
+            # Dangling links count as not linked, but still need replacing
+            return EntryStatus(source_rel, dest_rel, STATUS_NOT_LINKED, source_kind, dest_kind, target)
+        if os.path.realpath(dest) == source:
+            return EntryStatus(source_rel, dest_rel, STATUS_LINKED, source_kind, dest_kind, target)
+        return EntryStatus(source_rel, dest_rel, STATUS_ELSEWHERE, source_kind, dest_kind, target)
+
+    @traced("status_scan")
+    def scan(self, entries):
+        """Return an EntryStatus for every (source_rel, dest_rel) pair, in order"""
+        repo = str(self.repo_path)
+        home = str(self.home_path)
+        pairs = [(os.path.join(repo, source_rel), os.path.join(home, dest_rel))
+                 for source_rel, dest_rel in entries]
+
+        source_kinds = self._kinds([source for source, dest in pairs])
+        dest_kinds = self._kinds([dest for source, dest in pairs])
+
+        return [
+            self._classify(source_rel, dest_rel, source, dest, source_kinds[source], dest_kinds[dest])
+            for (source_rel, dest_rel), (source, dest) in zip(entries, pairs)
+        ]
+
+    def status(self, source_rel, dest_rel):
+        """Return the EntryStatus of a single entry"""
+        return self.scan([(source_rel, dest_rel)])[0]
+
+class ContentComparer:
+    """Decide whether an existing destination already holds the source's content
+
+    Files of different sizes are never equal. Otherwise they are compared
+    byte for byte through mmap, a chunk at a time so the first difference
+    ends the comparison; matching size and mtime is not taken as proof,
+    since an identical verdict lets the destination go without a backup.
+    Directory trees must have the same names, kinds and symlink targets;
+    their files are compared in a thread pool when there are many of them.
+    """
+
+    CHUNK = 1024 * 1024
+    PARALLEL_MIN_FILES = 16
+
+    def __init__(self, jobs=1):
+        self.jobs = max(1, jobs)
+
+    def same_file(self, a, b, st_a=None, st_b=None):
+        """Whether two regular files have identical contents"""
+        try:
+            st_a = st_a or os.stat(a)
+            st_b = st_b or os.stat(b)
+        except OSError:
+            return False
+        if st_a.st_size != st_b.st_size:
+            return False
+        if (st_a.st_dev, st_a.st_ino) == (st_b.st_dev, st_b.st_ino):
+            return True
+
+        mmap = lazy_import("mmap")
+        try:
+            with open(a, 'rb') as fa, open(b, 'rb') as fb:
+                if st_a.st_size == 0:
+                    # mmap cannot map empty files; make sure both still are
+                    return fa.read(1) == fb.read(1) == b''
+                with mmap.mmap(fa.fileno(), 0, access=mmap.ACCESS_READ) as ma, \
+                        mmap.mmap(fb.fileno(), 0, access=mmap.ACCESS_READ) as mb:
+                    for offset in range(0, st_a.st_size, self.CHUNK):
+                        if ma[offset:offset + self.CHUNK] != mb[offset:offset + self.CHUNK]:
+                            return False
+        except (OSError, ValueError):
+            # Unreadable, or changed size underneath us
+            return False
+        return True
+
+    def _walk_pairs(self, a, b, pairs):
+        """Check that two trees have the same shape, collecting file pairs to compare"""
+        try:
+            with os.scandir(a) as it:
+                left = {entry.name: entry for entry in it}
+            with os.scandir(b) as it:
+                right = {entry.name: entry for entry in it}
+        except OSError:
+            return False
+        if left.keys() != right.keys():
+            return False
+
+        for name, entry_a in left.items():
+            entry_b = right[name]
+            kind = _kind_from_direntry(entry_a)
+            if kind != _kind_from_direntry(entry_b):
+                return False
+            if kind == KIND_DIR:
+                if not self._walk_pairs(entry_a.path, entry_b.path, pairs):
+                    return False
+            elif kind == KIND_LINK:
+                try:
+                    if os.readlink(entry_a.path) != os.readlink(entry_b.path):
+                        return False
+                except OSError:
+                    return False
+            elif kind == KIND_FILE:
+                try:
+                    st_a = entry_a.stat(follow_symlinks=False)
+                    st_b = entry_b.stat(follow_symlinks=False)
+                except OSError:
+                    return False
+                if st_a.st_size != st_b.st_size:
+                    return False
+                pairs.append((entry_a.path, entry_b.path, st_a, st_b))
+            else:
+                return False
+        return True
+
+    def same_tree(self, a, b):
+        """Whether two directory trees have identical structure and contents"""
+        pairs = []
+        if not self._walk_pairs(a, b, pairs):
+            return False
+
+        if len(pairs) < self.PARALLEL_MIN_FILES or self.jobs == 1:
+            return all(self.same_file(*pair) for pair in pairs)
+
+        futures_mod = lazy_import("concurrent.futures")
+        with futures_mod.ThreadPoolExecutor(max_workers=min(self.jobs, len(pairs))) as pool:
+            futures = [pool.submit(self.same_file, *pair) for pair in pairs]
+            for future in futures_mod.as_completed(futures):
+                if not future.result():
+                    for pending in futures:
+                        pending.cancel()
+                    return False
+        return True
+
+    @traced("compare", entry=2)
+    def same(self, source, dest, kind):
+        """Whether dest holds exactly what source does, for a file or directory source"""
+        if kind == KIND_FILE:
+            return self.same_file(source, dest)
+        if kind == KIND_DIR:
+            return self.same_tree(source, dest)
+        return False
+
+class TreeDiff:
+    """What reconciling one tree entry's real destination directory needs
+
+    Paths are relative to the entry's destination ("" is the destination
+    itself). links are missing paths to link to their source counterpart,
+    identical are files holding exactly the source's content (replaced
+    without a backup), conflicts are (path, kind) of anything else in the
+    way, and folds are directories that hold nothing but our links and
+    identical copies, so they can become one directory link.
+    """
+    __slots__ = ("links", "identical", "conflicts", "folds", "linked")
+
+    def __init__(self):
+        self.links = []
+        self.identical = []
+        self.conflicts = []
+        self.folds = []
+        self.linked = 0
+
+    def state(self):
+        """STATUS_* for the entry this diff describes"""
+        if self.conflicts:
+            return STATUS_EXISTS
+        if self.links or self.identical or self.folds:
+            return STATUS_NOT_LINKED
+        return STATUS_LINKED
+
+class TreeLinker:
+    """Links directory entries file by file, stow-style
+
+    When a tree entry's destination does not exist it is linked as one
+    directory link (folded). When it is already a real directory, the
+    source and destination are walked together once with os.scandir:
+    missing files and directories are linked inside it, links that already
+    point at their source counterpart are left alone, and only the paths
+    in the way are reported. A directory whose contents would be nothing
+    but our links is folded back into a single link. Nothing that is
+    already right is copied, moved or deleted.
+    """
+
+    def __init__(self, comparer):
+        self.comparer = comparer
+        self._lock = lazy_import("threading").Lock()
+        # Diffs from the last classification, so applying them needs no second walk
+        self._diffs = {}
+
+    def diff(self, source, dest):
+        """Walk source and dest together and return a TreeDiff"""
+        diff = TreeDiff()
+        if self._walk(source, dest, "", diff):
+            diff.folds.append("")
+        # A fold replaces everything below it with one link; parents sort first
+        folds = []
+        for rel in sorted(diff.folds, key=len):
+            if not any(self.within(rel, top) for top in folds):
+                folds.append(rel)
+        diff.folds = folds
+        diff.links = [rel for rel in diff.links if not any(self.within(rel, top) for top in folds)]
+        return diff
+
+    @staticmethod
+    def within(rel, top):
+        """Whether relative path rel is top or lies inside it"""
+        return top == "" or rel == top or rel.startswith(top + "/")
+
+    def _walk(self, source, dest, rel, diff):
+        """Diff one directory level; True when dest could be folded into a link"""
+        try:
+            with os.scandir(source) as it:
+                sources = {entry.name: entry for entry in it}
+            with os.scandir(dest) as it:
+                dests = {entry.name: entry for entry in it}
+        except OSError:
+            diff.conflicts.append((rel, KIND_OTHER))
+            return False
+
+        foldable = dests.keys() <= sources.keys()
+        for name, source_entry in sources.items():
+            child = f"{rel}/{name}" if rel else name
+            dest_entry = dests.get(name)
+            if dest_entry is None:
+                diff.links.append(child)
+                continue
+
+            source_kind = _kind_from_direntry(source_entry)
+            dest_kind = _kind_from_direntry(dest_entry)
+            if dest_kind == KIND_LINK:
+                try:
+                    target = os.readlink(dest_entry.path)
+                except OSError:
+                    target = None
+                if target is not None and os.path.normpath(os.path.join(dest, target)) == source_entry.path:
+                    diff.linked += 1
+                else:
+                    diff.conflicts.append((child, dest_kind))
+                    foldable = False
+            elif source_kind == KIND_DIR and dest_kind == KIND_DIR:
+                if self._walk(source_entry.path, dest_entry.path, child, diff):
+                    diff.folds.append(child)
+                else:
+                    foldable = False
+            elif source_kind == KIND_FILE and dest_kind == KIND_FILE:
+                try:
+                    source_stat = source_entry.stat(follow_symlinks=False)
+                    dest_stat = dest_entry.stat(follow_symlinks=False)
+                except OSError:
+                    # Removed or made unreadable since the scandir; leave it to the user
+                    diff.conflicts.append((child, KIND_OTHER))
+                    foldable = False
+                    continue
+                if self.comparer.same_file(source_entry.path, dest_entry.path, source_stat, dest_stat):
+                    diff.identical.append(child)
+                else:
+                    diff.conflicts.append((child, dest_kind))
+                    foldable = False
+            else:
+                diff.conflicts.append((child, dest_kind))
+                foldable = False
+        return foldable
+
+    def state(self, dest_rel, source, dest):
+        """Classify a tree entry whose destination is a real directory"""
+        diff = self.diff(source, dest)
+        with self._lock:
+            if diff.state() == STATUS_LINKED:
+                self._diffs.pop(dest_rel, None)
+            else:
+                self._diffs[dest_rel] = diff
+        return diff.state()
+
+    def take(self, dest_rel, source, dest):
+        """The diff from the last classification of dest_rel, or a fresh one"""
+        with self._lock:
+            diff = self._diffs.pop(dest_rel, None)
+        return diff if diff is not None else self.diff(source, dest)
+
+    def unfold(self, source, dest, rel, identical):
+        """Empty a directory that is about to be folded, then remove it
+
+        Only links to the matching source path and files listed in identical
+        are removed; anything else that appeared since the diff raises.
+        """
+        with os.scandir(dest) as it:
+            entries = list(it)
+        for entry in entries:
+            child = f"{rel}/{entry.name}" if rel else entry.name
+            source_path = os.path.join(source, entry.name)
+            kind = _kind_from_direntry(entry)
+            if kind == KIND_LINK and os.path.normpath(os.path.join(dest, os.readlink(entry.path))) == source_path:
+                os.unlink(entry.path)
+            elif kind == KIND_FILE and child in identical:
+                os.unlink(entry.path)
+            elif kind == KIND_DIR:
+                self.unfold(source_path, entry.path, child, identical)
+            else:
+                raise OSError(f"{entry.path} changed while linking, not folding {dest}")
+        os.rmdir(dest)
+
+    def our_links(self, source, dest, rel=""):
+        """(path, rel) of every link inside dest that points at its source counterpart"""
+        found = []
+        try:
+            with os.scandir(dest) as it:
+                entries = list(it)
+        except OSError:
+            return found
+        for entry in entries:
+            child = f"{rel}/{entry.name}" if rel else entry.name
+            source_path = os.path.join(source, entry.name)
+            if entry.is_symlink():
+                try:
+                    if os.path.normpath(os.path.join(dest, os.readlink(entry.path))) == source_path:
+                        found.append((entry.path, child))
+                except OSError:
+                    pass
+            elif entry.is_dir(follow_symlinks=False):
+                found.extend(self.our_links(source_path, entry.path, child))
+        return found
+
+class BackupStore:
+    """Content-addressed, deduplicating store for backups of replaced dotfiles
+
+    Layout under the backup directory:
+        objects/ab/cdef...          file contents, named by their hash
+        trees/<name>.backup.<ts>.json
+                                    one small index per backup listing every
+                                    path with its kind, mode, mtime and blob
+        index.log                   append-only NDJSON log tying each backup
+                                    to its manifest entry, and noting restores
+
+    Unchanged content is stored once no matter how often it is backed up.
+    New content is copied into the store rather than hard-linked, so a
+    backup never shares an inode with a file that may still be edited.
+    Old full-copy backups (<name>.backup.<ts> in the backup directory itself)
+    are still listed and can be restored.
+    """
+
+    HASH_CHUNK = 1024 * 1024
+
+    def __init__(self, backup_dir):
+        self.backup_dir = backup_dir
+        self.objects_dir = backup_dir / "objects"
+        self.trees_dir = backup_dir / "trees"
+        self.index_path = backup_dir / "index.log"
+        self._lock = lazy_import("threading").Lock()
+        self._tmp_counter = 0
+
+    def _tmp_name(self, directory):
+        """Unique temporary name inside directory, safe across threads and processes"""
+        with self._lock:
+            self._tmp_counter += 1
+            counter = self._tmp_counter
+        return directory / f".tmp.{os.getpid()}.{lazy_import('threading').get_ident()}.{counter}"
+
+    def _hash_file(self, path):
+        """Hex blake2b digest of a file's contents"""
+        digest = lazy_import("hashlib").blake2b(digest_size=20)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.HASH_CHUNK), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def object_path(self, digest):
+        """Path of the blob holding the given digest"""
+        return self.objects_dir / digest[:2] / digest[2:]
+
+    def _store_file(self, path):
+        """Add a file's contents to the store and return its digest"""
+        digest = self._hash_file(path)
+        blob = self.object_path(digest)
+        if blob.exists():
+            # Identical content is already stored; nothing to write
+            return digest
+
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self._tmp_name(blob.parent)
+        try:
+            # Copied, never hard-linked: if removing the original fails, an
+            # object sharing its inode would change whenever it is edited
+            lazy_import("shutil").copyfile(path, tmp)
+            os.replace(tmp, blob)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        return digest
+
+    def _snapshot(self, path):
+        """Walk a path without following symlinks and store its contents
+
+        Returns:
+            Tuple of (entries, total_size) where each entry is
+            [relative path, kind, mode, blob digest or link target, size, mtime_ns]
+        """
+        entries = []
+        total = 0
+
+        def add(full, rel, st):
+            nonlocal total
+            mode = stat.S_IMODE(st.st_mode)
+            kind = _kind_from_mode(st.st_mode)
+            if kind == KIND_FILE:
+                digest = self._store_file(full)
+                entries.append([rel, kind, mode, digest, st.st_size, st.st_mtime_ns])
+                total += st.st_size
+            elif kind == KIND_LINK:
+                entries.append([rel, kind, mode, os.readlink(full), 0, st.st_mtime_ns])
+            elif kind == KIND_DIR:
+                entries.append([rel, kind, mode, None, 0, st.st_mtime_ns])
+                with os.scandir(full) as it:
+                    children = sorted(it, key=lambda entry: entry.name)
+                for child in children:
+                    add(child.path, f"{rel}/{child.name}" if rel else child.name,
+                        child.stat(follow_symlinks=False))
+            # Sockets, fifos and devices are not worth keeping
+
+        add(str(path), "", os.lstat(path))
+        return entries, total
+
+    def _append_index(self, record):
+        """Append one record to index.log with a single O_APPEND write"""
+        line = lazy_import("json").dumps(record, separators=(',', ':')) + "\n"
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            fd = os.open(self.index_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                os.write(fd, line.encode())
+            finally:
+                os.close(fd)
+
+    def read_index(self):
+        """Replay index.log into the backups still available per entry
+
+        Returns:
+            Dict of {entry: [record, ...]} oldest first, where each record has
+            entry, original, backup (id), path (tree index), created and size.
+            Backups that were restored (and so consumed) are left out.
+            Records with op 'identical' have no backup: the entry replaced an
+            exact copy of its source, which a restore copies back from the repo.
+        """
+        try:
+            with open(self.index_path) as f:
+                lines = f.readlines()
+        except OSError:
+            return {}
+
+        json = lazy_import("json")
+        records = {}
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Torn last line from an interrupted write
+                continue
+            if record.get('op') in ('restored', 'evicted'):
+                records.pop(record['backup'], None)
+            elif record.get('op') in ('backup', 'identical'):
+                # Re-insert so the dict stays in log order
+                records.pop(record['backup'], None)
+                records[record['backup']] = record
+
+        by_entry = {}
+        for record in records.values():
+            by_entry.setdefault(record['entry'], []).append(record)
+        return by_entry
+
+    def backup(self, path, entry=None):
+        """Back up a file, directory or symlink and return the path of its tree index
+
+        Args:
+            path: Path to back up (symlinks are recorded, not followed)
+            entry: Manifest destination the backup belongs to, for the index
+        """
+        json = lazy_import("json")
+        now = lazy_import("datetime").datetime.now()
+        self.trees_dir.mkdir(parents=True, exist_ok=True)
+
+        # Reserve a unique backup id so parallel backups never collide
+        base_id = f"{path.name}.backup.{now.strftime('%Y%m%d_%H%M%S')}"
+        backup_id = base_id
+        counter = 1
+        while True:
+            tree_path = self.trees_dir / f"{backup_id}.json"
+            try:
+                os.close(os.open(tree_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+                break
+            except FileExistsError:
+                backup_id = f"{base_id}.{counter}"
+                counter += 1
+
+        try:
+            entries, total = self._snapshot(path)
+            tree = {
+                'id': backup_id,
+                'name': path.name,
+                'original': str(path),
+                'created': now.isoformat(timespec='seconds'),
+                'kind': entries[0][1],
+                'size': total,
+                'entries': entries,
+            }
+            tmp = self._tmp_name(self.trees_dir)
+            with open(tmp, 'w') as f:
+                json.dump(tree, f, separators=(',', ':'))
+            os.replace(tmp, tree_path)
+        except BaseException:
+            tree_path.unlink()
+            raise
+
+        self._append_index({
+            'op': 'backup',
+            'entry': entry,
+            'original': str(path),
+            'backup': backup_id,
+            'path': str(tree_path),
+            'created': tree['created'],
+            'size': total,
+        })
+        return tree_path
+
+    def load_tree(self, backup_id):
+        """Return the tree index of a backup as a dict"""
+        with open(self.trees_dir / f"{backup_id}.json") as f:
+            return lazy_import("json").load(f)
+
+    def list_backups(self, name=None):
+        """List backups, oldest first, optionally only those of one file name
+
+        Returns:
+            List of dicts with id, name, original, created, kind, size and
+            legacy (True for old full-copy backups)
+        """
+        json = lazy_import("json")
+        backups = []
+
+        if self.trees_dir.is_dir():
+            with os.scandir(self.trees_dir) as it:
+                for entry in it:
+                    if not entry.name.endswith(".json"):
+                        continue
+                    try:
+                        with open(entry.path) as f:
+                            tree = json.load(f)
+                    except (OSError, ValueError):
+                        # Reserved but not yet written, or damaged
+                        continue
+                    if name is not None and tree['name'] != name:
+                        continue
+                    del tree['entries']
+                    tree['legacy'] = False
+                    backups.append(tree)
+
+        backups.extend(self.list_legacy(name))
+        backups.sort(key=lambda backup: (backup['created'], backup['id']))
+        return backups
+
+    def list_legacy(self, name=None):
+        """List old full-copy backups kept directly in the backup directory"""
+        backups = []
+        if not self.backup_dir.is_dir():
+            return backups
+        with os.scandir(self.backup_dir) as it:
+            for entry in it:
+                if ".backup." not in entry.name:
+                    continue
+                legacy_name, _, stamp = entry.name.partition(".backup.")
+                if name is not None and legacy_name != name:
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                backups.append({
+                    'id': entry.name,
+                    'name': legacy_name,
+                    'original': None,
+                    'created': lazy_import("datetime").datetime.fromtimestamp(st.st_mtime).isoformat(timespec='seconds'),
+                    'kind': _kind_from_mode(st.st_mode),
+                    'size': st.st_size,
+                    'legacy': True,
+                })
+        return backups
+
+    def note_identical(self, path, entry):
+        """Record that an exact copy of an entry's source was replaced without a backup"""
+        self._append_index({
+            'op': 'identical',
+            'entry': entry,
+            'original': str(path),
+            'backup': f"identical:{entry}",
+            'path': None,
+            'created': lazy_import("datetime").datetime.now().isoformat(timespec='seconds'),
+            'size': 0,
+        })
+
+    def blob_refcounts(self):
+        """Count how many backups reference each blob, in one pass over the trees"""
+        json = lazy_import("json")
+        refs = {}
+        if not self.trees_dir.is_dir():
+            return refs
+        with os.scandir(self.trees_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    with open(entry.path) as f:
+                        tree = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                for rel, kind, mode, data, size, mtime_ns in tree['entries']:
+                    if kind == KIND_FILE:
+                        refs[data] = refs.get(data, 0) + 1
+        return refs
+
+    def restore(self, backup_id, target=None, overwrite=False, move=False, refs=None):
+        """Recreate a backup on disk and return the restored path
+
+        The backup is rebuilt next to the target and renamed into place, so
+        the target is never left half restored.
+
+        Args:
+            backup_id: Id as returned by list_backups
+            target: Where to restore to, defaults to the original location
+            overwrite: Remove whatever is at target first instead of failing
+            move: Consume the backup: blobs no other backup shares are renamed
+                into place instead of copied when the store is on the same
+                filesystem, and the backup is removed from the store afterwards
+            refs: Blob reference counts from blob_refcounts, kept up to date
+                across calls when restoring many backups with move
+        """
+        shutil = lazy_import("shutil")
+        legacy_path = self.backup_dir / backup_id
+        tree_path = self.trees_dir / f"{backup_id}.json"
+        tree = self.load_tree(backup_id) if tree_path.exists() else None
+
+        if tree is None and not (legacy_path.exists() or legacy_path.is_symlink()):
+            raise FileNotFoundError(f"No such backup: {backup_id}")
+        if target is None:
+            if tree is None:
+                raise ValueError(f"Legacy backup {backup_id} has no recorded original path")
+            target = Path(tree['original'])
+        target = Path(target)
+
+        if (target.exists() or target.is_symlink()) and not overwrite:
+            raise FileExistsError(f"Restore target exists: {target}")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        same_fs = move and os.stat(self.backup_dir).st_dev == os.stat(target.parent).st_dev
+
+        staged = self._tmp_name(target.parent)
+        moved = []
+        try:
+            if tree is None:
+                if same_fs:
+                    os.rename(legacy_path, staged)
+                    moved.append((staged, legacy_path))
+                elif legacy_path.is_dir() and not legacy_path.is_symlink():
+                    shutil.copytree(legacy_path, staged, symlinks=True)
+                else:
+                    shutil.copy2(legacy_path, staged, follow_symlinks=False)
+            else:
+                if move and refs is None:
+                    refs = self.blob_refcounts()
+                dirs = []
+                for rel, kind, mode, data, size, mtime_ns in tree['entries']:
+                    full = staged / rel if rel else staged
+                    if kind == KIND_DIR:
+                        full.mkdir(exist_ok=True)
+                        dirs.append((full, mode, mtime_ns))
+                    elif kind == KIND_LINK:
+                        os.symlink(data, full)
+                    else:
+                        blob = self.object_path(data)
+                        if same_fs and refs.get(data, 0) <= 1 and blob.exists():
+                            # Nothing else needs this blob, so hand it over
+                            os.rename(blob, full)
+                            moved.append((full, blob))
+                        else:
+                            # Copy, never hard-link: editing the restored file
+                            # in place must not change the stored blob
+                            shutil.copyfile(blob, full)
+                        os.chmod(full, mode)
+                        os.utime(full, ns=(mtime_ns, mtime_ns))
+
+                # Directory modes and times last, once nothing more is written into them
+                for full, mode, mtime_ns in reversed(dirs):
+                    os.chmod(full, mode)
+                    os.utime(full, ns=(mtime_ns, mtime_ns))
+        except BaseException:
+            # Put handed-over blobs back so the backup stays complete
+            for current, original in reversed(moved):
+                try:
+                    os.rename(current, original)
+                except OSError:
+                    pass
+            if staged.is_dir() and not staged.is_symlink():
+                shutil.rmtree(staged, ignore_errors=True)
+            elif staged.exists() or staged.is_symlink():
+                staged.unlink()
+            raise
+
+        if target.is_dir() and not target.is_symlink():
+            shutil.rmtree(target)
+        elif target.exists() or target.is_symlink():
+            target.unlink()
+        os.rename(staged, target)
+
+        if move:
+            if tree is None and not same_fs:
+                # Copied across filesystems; the legacy copy is consumed too
+                if legacy_path.is_dir() and not legacy_path.is_symlink():
+                    shutil.rmtree(legacy_path)
+                else:
+                    legacy_path.unlink()
+            self.forget(backup_id, tree, refs)
+        return target
+
+    def forget(self, backup_id, tree=None, refs=None, op='restored'):
+        """Drop a restored or evicted backup: its tree, its unshared blobs, and its index entry"""
+        if tree is not None:
+            for rel, kind, mode, data, size, mtime_ns in tree['entries']:
+                if kind != KIND_FILE:
+                    continue
+                if refs is not None:
+                    refs[data] = refs.get(data, 1) - 1
+                    if refs[data] > 0:
+                        continue
+                    try:
+                        self.object_path(data).unlink()
+                    except FileNotFoundError:
+                        pass
+            try:
+                (self.trees_dir / f"{backup_id}.json").unlink()
+            except FileNotFoundError:
+                pass
+        self._append_index({'op': op, 'backup': backup_id})
+
+    CATALOG_VERSION = 1
+
+    def catalog(self):
+        """What every backup holds, for retention decisions, updated incrementally
+
+        catalog.bin caches {backup id: (group, created, [(digest, size), ...],
+        extra bytes)} where group is the original path (or name, for legacy
+        backups). Only trees that appeared since the last call are read, so
+        the cost of a garbage collection pass does not grow with the number
+        of backups already stored.
+        """
+        path = self.backup_dir / "catalog.bin"
+        try:
+            with open(path, 'rb') as f:
+                version, cached = marshal.load(f)
+            if version != self.CATALOG_VERSION:
+                cached = {}
+        except (OSError, EOFError, ValueError, TypeError):
+            cached = {}
+
+        json = lazy_import("json")
+        catalog = {}
+        changed = False
+        if self.trees_dir.is_dir():
+            with os.scandir(self.trees_dir) as it:
+                names = [entry.name[:-5] for entry in it if entry.name.endswith(".json")]
+            for backup_id in names:
+                if backup_id in cached:
+                    catalog[backup_id] = cached[backup_id]
+                    continue
+                try:
+                    tree = self.load_tree(backup_id)
+                except (OSError, ValueError):
+                    # Reserved but not yet written, or damaged
+                    continue
+                blobs = [(data, size) for rel, kind, mode, data, size, mtime_ns in tree['entries'] if kind == KIND_FILE]
+                catalog[backup_id] = (tree['original'], tree['created'], blobs, 0)
+                changed = True
+
+        # Old full-copy backups count with their whole size and share nothing
+        for backup in self.list_legacy():
+            if backup['id'] in cached:
+                catalog[backup['id']] = cached[backup['id']]
+                continue
+            catalog[backup['id']] = (backup['name'], backup['created'], [], self._legacy_size(backup['id']))
+            changed = True
+
+        if changed or len(catalog) != len(cached):
+            self.backup_dir.mkdir(parents=True, exist_ok=True)
+            _atomic_write(path, marshal.dumps((self.CATALOG_VERSION, catalog)))
+        return catalog
+
+    def _legacy_size(self, backup_id):
+        """Bytes used by an old full-copy backup"""
+        path = self.backup_dir / backup_id
+        st = os.lstat(path)
+        if not stat.S_ISDIR(st.st_mode):
+            return st.st_size
+        total = 0
+        for root, dirs, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    pass
+        return total
+
+    def plan_gc(self, retention, now=None):
+        """Decide which backups the retention policy evicts, least recently used first
+
+        Backups are written once and never modified, so their creation time
+        is their last use. The newest backup of every original path is never
+        evicted by age or size, only by keep, so a file's last known version
+        survives even a tight size cap.
+
+        Args:
+            retention: Dict with any of keep (backups per original path),
+                max_size (total bytes) and max_age (seconds)
+
+        Returns:
+            Tuple of (evictions, bytes before, bytes after), where each
+            eviction is a dict with id, original, created, reason and freed
+            bytes, in eviction order
+        """
+        datetime = lazy_import("datetime").datetime
+        now = now or datetime.now()
+        catalog = self.catalog()
+        oldest_first = sorted(catalog.items(), key=lambda item: (item[1][1], item[0]))
+
+        # Bytes are counted once per blob, however many backups share it
+        refs = {}
+        sizes = {}
+        for backup_id, (group, created, blobs, extra) in oldest_first:
+            for digest, size in blobs:
+                refs[digest] = refs.get(digest, 0) + 1
+                sizes[digest] = size
+        before = sum(sizes.values()) + sum(item[3] for item in catalog.values())
+        total = before
+
+        groups = {}
+        for backup_id, (group, created, blobs, extra) in oldest_first:
+            groups.setdefault(group, []).append(backup_id)
+        newest = {ids[-1] for ids in groups.values()}
+
+        evictions = []
+        evicted = set()
+
+        def evict(backup_id, reason):
+            nonlocal total
+            group, created, blobs, extra = catalog[backup_id]
+            freed = extra
+            for digest, size in blobs:
+                refs[digest] -= 1
+                if refs[digest] == 0:
+                    freed += size
+            total -= freed
+            evicted.add(backup_id)
+            evictions.append({'id': backup_id, 'original': group, 'created': created,
+                              'reason': reason, 'freed': freed})
+
+        keep = retention.get('keep')
+        if keep is not None:
+            for ids in groups.values():
+                for backup_id in ids[:max(0, len(ids) - max(keep, 1))]:
+                    evict(backup_id, f"keep {keep}")
+
+        max_age = retention.get('max_age')
+        if max_age is not None:
+            cutoff = (now - lazy_import("datetime").timedelta(seconds=max_age)).isoformat(timespec='seconds')
+            for backup_id, (group, created, blobs, extra) in oldest_first:
+                if created < cutoff and backup_id not in evicted and backup_id not in newest:
+                    evict(backup_id, "max_age")
+
+        max_size = retention.get('max_size')
+        if max_size is not None:
+            for backup_id, item in oldest_first:
+                if total <= max_size:
+                    break
+                if backup_id not in evicted and backup_id not in newest:
+                    evict(backup_id, "max_size")
+
+        return evictions, before, total
+
+    def gc(self, retention, dry_run=False):
+        """Evict backups according to a retention policy
+
+        Returns:
+            Same as plan_gc; with dry_run nothing is removed
+        """
+        evictions, before, after = self.plan_gc(retention)
+        if dry_run or not evictions:
+            return evictions, before, after
+
+        shutil = lazy_import("shutil")
+        refs = self.blob_refcounts()
+        for eviction in evictions:
+            backup_id = eviction['id']
+            tree_path = self.trees_dir / f"{backup_id}.json"
+            if tree_path.exists():
+                self.forget(backup_id, self.load_tree(backup_id), refs, op='evicted')
+                continue
+            legacy_path = self.backup_dir / backup_id
+            if legacy_path.is_dir() and not legacy_path.is_symlink():
+                shutil.rmtree(legacy_path)
+            elif legacy_path.exists() or legacy_path.is_symlink():
+                legacy_path.unlink()
+            self._append_index({'op': 'evicted', 'backup': backup_id})
+
+        self.compact_index()
+        return evictions, before, after
+
+    def compact_index(self):
+        """Rewrite index.log with only the records that still refer to something"""
+        json = lazy_import("json")
+        live = [record for records in self.read_index().values() for record in records]
+        live.sort(key=lambda record: record['created'])
+        tmp = self._tmp_name(self.backup_dir)
+        with self._lock:
+            with open(tmp, 'w') as f:
+                for record in live:
+                    f.write(json.dumps(record, separators=(',', ':')) + "\n")
+            os.replace(tmp, self.index_path)
+
+class StateJournal:
+    """Persisted record of what the last apply left on disk
+
+    journal.bin is a marshal snapshot written at the end of every apply:
+        repo      repository path the links point into
+        entries   {dest_rel: (source_rel, link target, dest inode, dest mtime_ns, source kind)}
+        dirs      {directory: mtime_ns} for every parent of a source or destination
+
+    journal.log is appended to while an apply runs (one JSON object per line),
+    so an interrupted apply can tell what it finished and what was still pending.
+    The next successful apply folds the log into a fresh snapshot.
+    """
+
+    VERSION = 1
+
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        self.snapshot_path = state_dir / "journal.bin"
+        self.log_path = state_dir / "journal.log"
+        self._log = None
+
+    def load(self, repo_path):
+        """Return (entries, dirs, pending) from the snapshot with the log replayed
+
+        pending lists destinations of an apply that was interrupted before
+        finishing; empty when the last apply completed.
+        """
+        entries, dirs = {}, {}
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                version, repo, entries, dirs = marshal.load(f)
+            if version != self.VERSION or repo != str(repo_path):
+                entries, dirs = {}, {}
+        except (OSError, EOFError, ValueError, TypeError):
+            entries, dirs = {}, {}
+
+        pending = []
+        try:
+            with open(self.log_path) as f:
+                lines = f.readlines()
+        except OSError:
+            lines = []
+
+        json = lazy_import("json") if lines else None
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Torn last line from an interrupted write
+                break
+            op = record.get('op')
+            if op == 'begin':
+                pending = list(record['pending'])
+            elif op == 'entry':
+                entries[record['dest']] = tuple(record['fp'])
+                if record['dest'] in pending:
+                    pending.remove(record['dest'])
+            elif op == 'drop':
+                entries.pop(record['dest'], None)
+            elif op == 'end':
+                pending = []
+
+        return entries, dirs, pending
+
+    def _append(self, record):
+        if self._log is None:
+            self.state_dir.mkdir(parents=True, exist_ok=True)
+            self._log = open(self.log_path, 'a')
+        self._log.write(lazy_import("json").dumps(record, separators=(',', ':')) + "\n")
+        self._log.flush()
+
+    def begin(self, pending):
+        """Note the destinations an apply is about to touch"""
+        self._append({'op': 'begin', 'pending': list(pending)})
+
+    def record(self, dest_rel, fingerprint):
+        """Note that an entry now matches the manifest"""
+        self._append({'op': 'entry', 'dest': dest_rel, 'fp': list(fingerprint)})
+
+    def drop(self, dest_rel):
+        """Forget an entry, e.g. because it left the manifest or failed"""
+        self._append({'op': 'drop', 'dest': dest_rel})
+
+    @traced("journal_commit")
+    def commit(self, repo_path, entries, dirs):
+        """Write a fresh snapshot atomically and start a new, empty log"""
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        if self._log is not None:
+            os.fsync(self._log.fileno())
+            self._log.close()
+            self._log = None
+
+        _atomic_write(self.snapshot_path, marshal.dumps((self.VERSION, str(repo_path), entries, dirs)))
+        try:
+            self.log_path.unlink()
+        except FileNotFoundError:
+            pass
+
+class TemplateRenderer:
+    """Writes copy and template entries and remembers what it wrote
+
+    Templates substitute {{ name }} with host variables: the manifest's
+    'variables', overridden by its 'hosts' section for this machine, on top
+    of the built-ins host, user and home. Output is written to a temporary
+    sibling and renamed over the destination, so it is never half-written.
+
+    render.bin in the state directory maps each destination to the key of its
+    last render (a hash of the mode, variables and template content) and the
+    stat of the source and of the file written. When neither stat moved and
+    the variables are the same, the destination is current without reading
+    anything; when only the source's stat moved, its content is hashed and
+    compared with the key, and nothing is rendered unless the key changed.
+    A destination whose stat no longer matches was edited or replaced by
+    someone else and is treated like any other existing file.
+    """
+
+    VERSION = 1
+    VARIABLE = None
+    # Sources modified this close to their render may have changed within the
+    # same mtime tick, so their stat alone is not trusted
+    RACY_NS = 2 * 10**9
+
+    def __init__(self, state_dir, home_path, host=None):
+        self.cache_path = state_dir / "render.bin"
+        self.home_path = home_path
+        self._host = host
+        self._lock = lazy_import("threading").Lock()
+        self._cache = None
+        self._dirty = False
+        self._variables = None
+        self._digest = None
+
+    @property
+    def host(self):
+        """Short hostname, looked up on first use so runs without templates skip it"""
+        if self._host is None:
+            self._host = lazy_import("socket").gethostname().split(".")[0]
+        return self._host
+
+    @property
+    def variables(self):
+        """Template variables for this machine"""
+        if self._variables is None:
+            settings = get_manifest_settings()
+            variables = {'host': self.host, 'user': os.environ.get('USER', ''), 'home': str(self.home_path)}
+            variables.update(settings.get('variables', {}))
+            variables.update(settings.get('hosts', {}).get(self.host, {}))
+            self._variables = variables
+        return self._variables
+
+    def variables_digest(self, mode):
+        if mode != 'template':
+            return b""
+        if self._digest is None:
+            blob = lazy_import("json").dumps(self.variables, sort_keys=True, default=str).encode()
+            self._digest = lazy_import("hashlib").blake2b(blob, digest_size=16).digest()
+        return self._digest
+
+    def key(self, mode, data):
+        """Render cache key for a source's content"""
+        hasher = lazy_import("hashlib").blake2b(digest_size=16)
+        hasher.update(mode.encode() + b"\0" + self.variables_digest(mode))
+        hasher.update(data)
+        return hasher.digest()
+
+    def render(self, source_rel, mode, data):
+        """Output bytes for a source's content"""
+        if mode != 'template':
+            return data
+        if TemplateRenderer.VARIABLE is None:
+            TemplateRenderer.VARIABLE = lazy_import("re").compile(rb"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}")
+        variables = self.variables
+
+        def substitute(match):
+            name = match.group(1).decode()
+            if name not in variables:
+                raise ValueError(f"{source_rel}: undefined template variable '{name}' for host {self.host}")
+            value = variables[name]
+            if isinstance(value, bool):
+                value = "true" if value else "false"
+            return ("" if value is None else str(value)).encode()
+
+        return TemplateRenderer.VARIABLE.sub(substitute, data)
+
+    def _load(self):
+        if self._cache is None:
+            try:
+                with open(self.cache_path, 'rb') as f:
+                    version, cache = marshal.load(f)
+                self._cache = cache if version == self.VERSION else {}
+            except (OSError, EOFError, ValueError, TypeError):
+                self._cache = {}
+        return self._cache
+
+    def save(self):
+        """Write the render cache if anything changed"""
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+                _atomic_write(self.cache_path, marshal.dumps((self.VERSION, self._cache)))
+                self._dirty = False
+            except OSError:
+                pass
+
+    def check(self, source_rel, dest_rel, source, dest):
+        """True if dest holds the current render, False if it is ours but
+        outdated, None if it is not (or no longer) a file this class wrote"""
+        mode = entry_mode(dest_rel)
+        with self._lock:
+            record = self._load().get(dest_rel)
+        if record is None or record[0] != source_rel:
+            return None
+        try:
+            dest_st = os.lstat(dest)
+            source_st = os.stat(source)
+        except OSError:
+            return None
+        rendered_source, source_mtime, source_size, digest, key, dest_ino, dest_mtime, dest_size, verified_at = record
+        if (dest_st.st_ino, dest_st.st_mtime_ns, dest_st.st_size) != (dest_ino, dest_mtime, dest_size):
+            return None
+        if (digest == self.variables_digest(mode)
+                and (source_st.st_mtime_ns, source_st.st_size) == (source_mtime, source_size)
+                and source_mtime < verified_at - self.RACY_NS):
+            return True
+
+        # The source was touched or the variables changed: only the content decides
+        try:
+            with open(source, 'rb') as f:
+                current = self.key(mode, f.read())
+        except OSError:
+            return None
+        if current != key:
+            return False
+        with self._lock:
+            self._cache[dest_rel] = (source_rel, source_st.st_mtime_ns, source_st.st_size,
+                                     self.variables_digest(mode), key, dest_ino, dest_mtime, dest_size, time.time_ns())
+            self._dirty = True
+        return True
+
+    def state(self, source_rel, dest_rel, source, dest, dest_kind):
+        """STATUS_* of a copy or template entry whose source exists"""
+        if dest_kind is None:
+            return STATUS_STALE
+        current = self.check(source_rel, dest_rel, source, dest) if dest_kind == KIND_FILE else None
+        if current is None:
+            return STATUS_EXISTS
+        return STATUS_RENDERED if current else STATUS_STALE
+
+    def matches(self, source_rel, dest_rel, source, dest):
+        """Whether an existing file already holds exactly what would be rendered"""
+        mode = entry_mode(dest_rel)
+        try:
+            with open(source, 'rb') as f:
+                output = self.render(source_rel, mode, f.read())
+            if os.path.getsize(dest) != len(output):
+                return False
+            with open(dest, 'rb') as f:
+                return f.read() == output
+        except (OSError, ValueError):
+            return False
+
+    def write(self, source_rel, dest_rel, source, dest):
+        """Render source and atomically put the result at dest"""
+        mode = entry_mode(dest_rel)
+        with open(source, 'rb') as f:
+            source_st = os.fstat(f.fileno())
+            if not stat.S_ISREG(source_st.st_mode):
+                raise ValueError(f"{source_rel}: only files can be used with mode '{mode}'")
+            data = f.read()
+        key = self.key(mode, data)
+        output = self.render(source_rel, mode, data)
+
+        tmp = os.path.join(os.path.dirname(dest), f".{os.path.basename(dest)}.{os.getpid()}.{lazy_import('threading').get_ident()}.tmp")
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, stat.S_IMODE(source_st.st_mode))
+        try:
+            view = memoryview(output)
+            while view:
+                view = view[os.write(fd, view):]
+            os.fsync(fd)
+            dest_st = os.fstat(fd)
+        except BaseException:
+            os.close(fd)
+            os.unlink(tmp)
+            raise
+        os.close(fd)
+        try:
+            os.replace(tmp, dest)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        with self._lock:
+            self._load()[dest_rel] = (source_rel, source_st.st_mtime_ns, source_st.st_size,
+                                      self.variables_digest(mode), key,
+                                      dest_st.st_ino, dest_st.st_mtime_ns, dest_st.st_size, time.time_ns())
+            self._dirty = True
+
+    def forget(self, dest_rel):
+        """Drop a destination from the cache, e.g. after it was rolled back"""
+        with self._lock:
+            if self._load().pop(dest_rel, None) is not None:
+                self._dirty = True
+
+class TaskRunner:
+    """Runs the manifest's setup tasks as a dependency graph, skipping unchanged ones
+
+    A task's key hashes its command, the contents of its inputs (repo files
+    named in the command plus its 'inputs' patterns) and the keys of the
+    tasks it needs, so editing a script re-runs that task and everything
+    after it. tasks.bin in the state directory holds the key of each task's
+    last successful run, and a task whose key still matches is skipped.
+
+    Tasks whose needs are met run concurrently in a thread pool, each in its
+    own shell with output going to tasks/<name>.log. Interactive tasks
+    (sudo prompts, installers asking questions) keep the terminal and run
+    with nothing else going on.
+
+    Tasks are (name, run, description, needs, inputs, platform, interactive)
+    tuples as parse_settings stores them.
+    """
+
+    VERSION = 1
+    # Manifest platform names that differ from sys.platform prefixes
+    PLATFORMS = {'macos': 'darwin'}
+    HASH_CHUNK = 1 << 20
+
+    def __init__(self, state_dir, repo_path, home_path, jobs):
+        self.path = state_dir / "tasks.bin"
+        self.log_dir = state_dir / "tasks"
+        self.repo_path = repo_path
+        self.home_path = home_path
+        self.jobs = jobs
+        self.runs = None
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                version, runs = marshal.load(f)
+            self.runs = runs if version == self.VERSION else {}
+        except (OSError, EOFError, ValueError, TypeError):
+            self.runs = {}
+
+    def _save(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            _atomic_write(self.path, marshal.dumps((self.VERSION, self.runs)))
+        except OSError:
+            pass
+
+    def order(self, tasks, names=None):
+        """Tasks for this platform in dependency order, manifest order otherwise
+
+        Args:
+            tasks: Task tuples from the manifest settings
+            names: Only these tasks and the ones they need, if given
+
+        Raises:
+            ValueError: A task needs one that does not exist, a named task
+                does not exist or is for another platform, or the needs
+                form a cycle
+        """
+        known = {task[0] for task in tasks}
+        local = {}
+        for task in tasks:
+            for need in task[3]:
+                if need not in known:
+                    raise ValueError(f"Task '{task[0]}' needs unknown task '{need}'")
+            platform = task[5]
+            if platform is None or sys.platform.startswith(self.PLATFORMS.get(platform, platform)):
+                local[task[0]] = task
+
+        if names:
+            wanted = set()
+            stack = list(names)
+            for name in names:
+                if name not in known:
+                    raise ValueError(f"No task named '{name}' in manifest.yaml")
+                if name not in local:
+                    raise ValueError(f"Task '{name}' does not run on {sys.platform}")
+            while stack:
+                name = stack.pop()
+                if name in wanted or name not in local:
+                    continue
+                wanted.add(name)
+                stack.extend(local[name][3])
+            local = {name: task for name, task in local.items() if name in wanted}
+
+        # Needs on tasks for another platform are met by definition
+        ordered = []
+        placed = set()
+        remaining = list(local.values())
+        while remaining:
+            ready = [task for task in remaining if all(need in placed or need not in local for need in task[3])]
+            if not ready:
+                raise ValueError("Tasks need each other in a cycle: " + ", ".join(task[0] for task in remaining))
+            ordered.extend(ready)
+            placed.update(task[0] for task in ready)
+            remaining = [task for task in remaining if task[0] not in placed]
+        return ordered
+
+    def inputs(self, task):
+        """Repo files a task depends on, in a stable order"""
+        repo = str(self.repo_path)
+        found = {}
+        try:
+            words = lazy_import("shlex").split(task[1])
+        except ValueError:
+            words = task[1].split()
+        for word in words:
+            path = os.path.join(repo, word)
+            if os.path.isfile(path):
+                found[path] = None
+
+        glob = lazy_import("glob")
+        for pattern in task[4]:
+            for path in sorted(glob.glob(os.path.join(glob.escape(repo), pattern), recursive=True)):
+                if os.path.isdir(path):
+                    for root, dirs, files in os.walk(path):
+                        dirs.sort()
+                        for name in sorted(files):
+                            found[os.path.join(root, name)] = None
+                elif os.path.isfile(path):
+                    found[path] = None
+        return list(found)
+
+    def key(self, task, need_keys):
+        """Hex key of a task's command, input contents and the keys of what it needs"""
+        hashlib = lazy_import("hashlib")
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((task[1], task[4], sorted(need_keys.items()))).encode())
+        for path in self.inputs(task):
+            file_digest = hashlib.blake2b(digest_size=16)
+            try:
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(self.HASH_CHUNK), b''):
+                        file_digest.update(chunk)
+            except OSError:
+                # Unreadable now; whatever it holds once readable again differs
+                file_digest.update(b"\0unreadable")
+            digest.update(os.path.relpath(path, str(self.repo_path)).encode() + b"\0" + file_digest.digest())
+        return digest.hexdigest()
+
+    def execute(self, task):
+        """Run a task's command from the repo root
+
+        HOME is the target home, and DOTFILES_REPO and DOTFILES_HOME are set
+        for scripts that want them.
+
+        Returns:
+            Tuple of (exit code, elapsed seconds, log path or None for
+            interactive tasks)
+        """
+        subprocess = lazy_import("subprocess")
+        env = dict(os.environ, HOME=str(self.home_path),
+                   DOTFILES_REPO=str(self.repo_path), DOTFILES_HOME=str(self.home_path))
+        started = time.perf_counter()
+        log = None
+        with trace_span("task", task[0]):
+            try:
+                if task[6]:
+                    code = subprocess.run(task[1], shell=True, cwd=str(self.repo_path), env=env).returncode
+                else:
+                    self.log_dir.mkdir(parents=True, exist_ok=True)
+                    log = self.log_dir / f"{task[0]}.log"
+                    with open(log, 'wb') as f:
+                        code = subprocess.run(task[1], shell=True, cwd=str(self.repo_path), env=env,
+                                              stdin=subprocess.DEVNULL, stdout=f, stderr=subprocess.STDOUT).returncode
+            except OSError as e:
+                if log is not None:
+                    with open(log, 'a') as f:
+                        f.write(f"{e}\n")
+                code = 127
+        return code, time.perf_counter() - started, log
+
+    def _finish(self, task, key, outcome, state, keys):
+        """Record a finished task and return its TaskEvent"""
+        code, elapsed, log = outcome
+        name = task[0]
+        if code == 0:
+            state[name] = 'ok'
+            keys[name] = key
+            self.runs[name] = (key, time.time_ns(), elapsed)
+            event = TaskEvent(name, 'done', task[2], elapsed, code, log)
+        else:
+            state[name] = 'failed'
+            self.runs.pop(name, None)
+            event = TaskEvent(name, 'failed', task[2], elapsed, code, log)
+        # Saved after every task, so an interrupted run keeps what finished
+        self._save()
+        return event
+
+    def run(self, tasks, names=None, rerun=False, dry_run=False):
+        """Run tasks in dependency order, yielding a TaskEvent as each changes state
+
+        Args:
+            tasks: Task tuples from the manifest settings
+            names: Only run these tasks and the ones they need
+            rerun: Run tasks even if their inputs are unchanged
+            dry_run: Only report which tasks would run
+        """
+        ordered = self.order(tasks, names)
+        in_graph = {task[0] for task in ordered}
+        if self.runs is None:
+            self._load()
+
+        state = {}     # name -> 'ok' or 'failed' once settled
+        keys = {}      # name -> key of tasks that ran or were unchanged
+        running = {}   # future -> (task, key)
+        started = set()
+        futures_mod = lazy_import("concurrent.futures")
+        pool = futures_mod.ThreadPoolExecutor(max_workers=self.jobs)
+        try:
+            while True:
+                # One pass in dependency order settles every task that can be
+                # settled without waiting, including chains of them
+                rescan = False
+                for task in ordered:
+                    name = task[0]
+                    if name in state or name in started:
+                        continue
+                    needs = [need for need in task[3] if need in in_graph]
+                    if any(state.get(need) == 'failed' for need in needs):
+                        state[name] = 'failed'
+                        yield TaskEvent(name, 'blocked', task[2])
+                        continue
+                    if not all(state.get(need) == 'ok' for need in needs):
+                        continue
+
+                    key = self.key(task, {need: keys[need] for need in needs})
+                    record = self.runs.get(name)
+                    if not rerun and record is not None and record[0] == key:
+                        state[name] = 'ok'
+                        keys[name] = key
+                        yield TaskEvent(name, 'unchanged', task[2])
+                        continue
+                    if dry_run:
+                        state[name] = 'ok'
+                        keys[name] = key
+                        yield TaskEvent(name, 'pending', task[2])
+                        continue
+
+                    if task[6]:
+                        # Interactive: wait until nothing else runs, then own the terminal
+                        rescan = True
+                        if running:
+                            break
+                        started.add(name)
+                        yield TaskEvent(name, 'started', task[2])
+                        yield self._finish(task, key, self.execute(task), state, keys)
+                        break
+
+                    started.add(name)
+                    running[pool.submit(self.execute, task)] = (task, key)
+                    yield TaskEvent(name, 'started', task[2])
+
+                if not running:
+                    if rescan:
+                        continue
+                    break
+                done, _ = futures_mod.wait(running, return_when=futures_mod.FIRST_COMPLETED)
+                for future in done:
+                    task, key = running.pop(future)
+                    yield self._finish(task, key, future.result(), state, keys)
+        finally:
+            pool.shutdown(wait=True)
+
+# inotify(7) constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Changes to the names in a directory, plus the directory itself going away
+IN_DIR_EVENTS = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_CLOSE_WRITE
+                 | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+class InotifyWatcher:
+    """Minimal inotify binding through ctypes
+
+    Directories are watched rather than the destinations themselves, since a
+    link being replaced by a real file or directory shows up as names being
+    created, deleted or moved in its parent.
+    """
+
+    EVENT_HEADER = "iIII"
+
+    def __init__(self):
+        ctypes = lazy_import("ctypes")
+        ctypes_util = lazy_import("ctypes.util")
+        self.struct = lazy_import("struct")
+        self.select = lazy_import("select")
+        self.header_size = self.struct.calcsize(self.EVENT_HEADER)
+
+        try:
+            self.libc = ctypes.CDLL(ctypes_util.find_library("c") or "libc.so.6", use_errno=True)
+            self.libc.inotify_init1.argtypes = [ctypes.c_int]
+            self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            self.libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        except (OSError, AttributeError):
+            raise OSError("inotify is not available on this system")
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.ctypes = ctypes
+
+    def add(self, path, mask=IN_DIR_EVENTS):
+        """Watch a directory and return its watch descriptor"""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = self.ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(path))
+        return wd
+
+    def remove(self, wd):
+        """Stop watching a descriptor, ignoring ones the kernel already dropped"""
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout=None):
+        """Wait up to timeout seconds (forever if None) for events
+
+        Returns:
+            List of (wd, mask, name) tuples, empty if the timeout expired
+        """
+        ready, _, _ = self.select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + self.header_size <= len(data):
+            wd, mask, cookie, length = self.struct.unpack_from(self.EVENT_HEADER, data, offset)
+            offset += self.header_size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class TableView:
+    """Paginated, filterable window over the dotfiles table for the TUI
+
+    Only the rows on the current page are rendered. Rows keep their manifest
+    numbers, so selections work the same on every page and under any filter.
+    When neither the page nor the filters changed since the last render, only
+    rows whose status changed since then are printed.
+    """
+
+    # Lines taken by the header, prompt help and table borders
+    CHROME_LINES = 16
+
+    def __init__(self, page_size=None):
+        self.page = 0
+        self.page_size = page_size
+        self.text_filter = None
+        self.status_filter = None
+        self._shown = None
+        self._shown_key = None
+
+    def effective_page_size(self, lines_per_row=1):
+        """Rows per page: fixed if configured, otherwise what fits in the terminal"""
+        if self.page_size:
+            return self.page_size
+        lines = lazy_import("shutil").get_terminal_size((80, 40)).lines
+        return max(5, (lines - self.CHROME_LINES) // lines_per_row)
+
+    def matches(self, row):
+        """Whether a row passes the current text and status filters"""
+        source, dest, status, desc = row
+        if self.status_filter and STATUS_CODES.get(status) != self.status_filter:
+            return False
+        if self.text_filter:
+            needle = self.text_filter
+            return needle in source.lower() or needle in dest.lower() or needle in desc.lower()
+        return True
+
+    def window(self, data, lines_per_row=1):
+        """Return (visible (index, row) pairs, matching row count, page count)"""
+        if self.text_filter or self.status_filter:
+            matching = [(idx, row) for idx, row in enumerate(data, 1) if self.matches(row)]
+        else:
+            matching = list(enumerate(data, 1))
+
+        size = self.effective_page_size(lines_per_row)
+        pages = max(1, -(-len(matching) // size))
+        self.page = min(self.page, pages - 1)
+        start = self.page * size
+        return matching[start:start + size], len(matching), pages
+
+    def describe(self, matching, total, pages):
+        """Caption with the page position and active filters"""
+        parts = [f"page {self.page + 1}/{pages}"]
+        if matching != total:
+            parts.append(f"{matching} of {total} shown")
+        if self.text_filter:
+            parts.append(f"filter '{self.text_filter}'")
+        if self.status_filter:
+            parts.append(f"status {self.status_filter}")
+        return ", ".join(parts)
+
+    def is_paged(self, data):
+        """Whether navigation hints are worth showing"""
+        return bool(self.text_filter or self.status_filter) or len(data) > self.effective_page_size()
+
+    def render(self, manager, data, force=False):
+        """Render the visible window, or only the changed rows when nothing else moved"""
+        rows, matching, pages = self.window(data, 1 if has_rich() else 2)
+        key = (self.page, self.text_filter, self.status_filter)
+        statuses = [row[2] for row in data]
+
+        if not force and self._shown is not None and key == self._shown_key:
+            # Changed rows anywhere in the filtered set, e.g. ones linked from another page
+            changed = [(idx, row) for idx, row in enumerate(data, 1)
+                       if idx - 1 < len(self._shown) and self._shown[idx - 1] != row[2]
+                       and self.matches(row)]
+            self._shown = statuses
+            if changed:
+                manager.print_table([row for idx, row in changed], [idx for idx, row in changed],
+                                    title="Updated Dotfiles",
+                                    caption=f"{len(changed)} changed; 'r' redraws the full page")
+            else:
+                manager.print_info("No status changes ('r' redraws the page)", "info")
+            return
+
+        caption = self.describe(matching, len(data), pages) if self.is_paged(data) else None
+        manager.print_table([row for idx, row in rows], [idx for idx, row in rows], caption=caption)
+        self._shown = statuses
+        self._shown_key = key
+
+    def handle(self, command):
+        """Apply a navigation or filter command
+
+        Returns:
+            None if command is not a view command, otherwise True if the
+            view should be redrawn in full
+        """
+        if command in ('n', 'next'):
+            self.page += 1
+        elif command in ('p', 'prev'):
+            self.page = max(0, self.page - 1)
+        elif command in ('r', 'redraw'):
+            pass
+        elif command.startswith('/'):
+            self.text_filter = command[1:].strip().lower() or None
+            if not self.text_filter:
+                self.status_filter = None
+            self.page = 0
+        elif command.startswith('s ') or command == 's':
+            wanted = command[1:].strip() or None
+            if wanted is not None and wanted not in STATUS_LABELS:
+                raise ValueError(f"Unknown status '{wanted}'. Use one of: {', '.join(STATUS_LABELS)}")
+            self.status_filter = wanted
+            self.page = 0
+        else:
+            return None
+        return True
+
+class StatusModel:
+    """In-memory status of every manifest entry for the TUI
+
+    The whole manifest is scanned once. After that, results from link calls
+    update the entries they name directly, and only entries whose state the
+    filesystem has to confirm (failures, and entries nested inside a
+    replaced destination) are scanned again. rescan() starts over.
+    """
+
+    def __init__(self, status_engine, repo_path):
+        self.status_engine = status_engine
+        self.repo_path = repo_path
+        self.dotfiles = []
+        self.statuses = []
+        self.positions = {}
+
+    def rescan(self):
+        """Scan every entry of the manifest"""
+        self.dotfiles = get_dotfiles()
+        self.statuses = self.status_engine.scan([(source_rel, dest_rel) for source_rel, dest_rel, desc in self.dotfiles])
+        self.positions = {}
+        for pos, (source_rel, dest_rel, desc) in enumerate(self.dotfiles):
+            self.positions.setdefault(dest_rel, []).append(pos)
+        return len(self.dotfiles)
+
+    def rows(self):
+        """Rows in the (source, dest, label, description) form print_table takes"""
+        return [(source_rel, dest_rel, status.label, desc)
+                for (source_rel, dest_rel, desc), status in zip(self.dotfiles, self.statuses)]
+
+    def refresh(self, positions):
+        """Re-scan only the given entries"""
+        positions = sorted(set(positions))
+        if not positions:
+            return
+        entries = [self.dotfiles[pos][:2] for pos in positions]
+        for pos, status in zip(positions, self.status_engine.scan(entries)):
+            self.statuses[pos] = status
+
+    def _nested(self, dest_rel):
+        """Positions of entries whose destination lies inside dest_rel"""
+        prefix = dest_rel.rstrip("/") + "/"
+        return [pos for other, positions in self.positions.items() if other.startswith(prefix) for pos in positions]
+
+    def update(self, results):
+        """Fold LinkEvents into the model, scanning as little as possible
+
+        Returns:
+            Number of entries that had to be scanned again
+        """
+        stale = []
+        for result in results:
+            positions = self.positions.get(result.dest, [])
+            if result.action in ('missing', 'linked', 'rendered', 'skip'):
+                # Nothing on disk was touched
+                continue
+            if result.success and result.mode == 'link':
+                source = os.path.join(str(self.repo_path), result.source)
+                for pos in positions:
+                    old = self.statuses[pos]
+                    if self.dotfiles[pos][0] == result.source:
+                        self.statuses[pos] = EntryStatus(result.source, result.dest, STATUS_LINKED,
+                                                         old.source_kind, KIND_LINK, source)
+                    else:
+                        stale.append(pos)
+            else:
+                stale.extend(positions)
+            # Entries inside the destination now resolve through the new link,
+            # or vanished with whatever was there before
+            stale.extend(self._nested(result.dest))
+        self.refresh(stale)
+        return len(set(stale))
+
+# Default number of worker threads used when linking many dotfiles at once
+DEFAULT_JOBS = min(32, (os.cpu_count() or 1) + 4)
+
+# Events yielded by the Dotfiles library layer. Each knows its NDJSON form,
+# which is what --format ndjson writes for it
+
+class StatusEvent:
+    """Status of one manifest entry, from Dotfiles.status()"""
+
+    __slots__ = ("index", "status", "description")
+    event = "status"
+
+    def __init__(self, index, status, description):
+        self.index = index
+        self.status = status
+        self.description = description
+
+    def to_record(self):
+        status = self.status
+        return {
+            'event': self.event,
+            'index': self.index,
+            'source': status.source_rel,
+            'dest': status.dest_rel,
+            'status': status.state,
+            'label': status.label,
+            'source_kind': status.source_kind,
+            'dest_kind': status.dest_kind,
+            'target': status.target,
+            'description': self.description,
+        }
+
+class PlanEvent:
+    """What linking one entry takes, from Dotfiles.plan()
+
+    action is one of 'missing', 'linked', 'skip', 'link', 'identical' or
+    'replace', or for copy and template entries 'rendered' or 'render', or
+    for tree entries whose destination is a real directory 'merge'
+    (conflicts left alone) or 'merge-replace' (conflicts backed up and
+    replaced).
+    """
+
+    __slots__ = ("source", "dest", "action", "status")
+    event = "plan"
+
+    def __init__(self, source, dest, action, status):
+        self.source = source
+        self.dest = dest
+        self.action = action
+        self.status = status
+
+    def to_record(self):
+        return {'event': self.event, 'source': self.source, 'dest': self.dest,
+                'action': self.action, 'status': self.status.state}
+
+class LinkEvent:
+    """Outcome of carrying out one PlanEvent, from Dotfiles.link() and apply()"""
+
+    __slots__ = ("source", "dest", "action", "mode", "success", "backup", "error", "elapsed", "tree")
+    event = "link"
+
+    def __init__(self, source, dest, action, mode):
+        self.source = source
+        self.dest = dest
+        self.action = action
+        self.mode = mode
+        self.success = action in ('linked', 'rendered')
+        self.backup = None
+        self.error = None
+        self.elapsed = 0.0
+        # Counts from Dotfiles.apply_tree for merged tree entries
+        self.tree = None
+
+    def to_record(self):
+        return {
+            'event': self.event,
+            'source': self.source,
+            'dest': self.dest,
+            'action': self.action,
+            'mode': self.mode,
+            'tree': self.tree,
+            'success': self.success,
+            'backup': str(self.backup) if self.backup else None,
+            'error': str(self.error) if self.error is not None else None,
+            'elapsed_ms': round(self.elapsed * 1000, 3),
+        }
+
+class ApplyEvent:
+    """First event of Dotfiles.apply(): how much of the manifest changed"""
+
+    __slots__ = ("changed", "unchanged", "removed", "resumed")
+    event = "apply"
+
+    def __init__(self, changed, unchanged, removed, resumed):
+        self.changed = changed
+        self.unchanged = unchanged
+        self.removed = removed
+        self.resumed = resumed
+
+    def to_record(self):
+        return {'event': self.event, 'changed': self.changed, 'unchanged': self.unchanged,
+                'removed': self.removed, 'resumed': self.resumed}
+
+class RemovedEvent:
+    """A destination the journal knows but the manifest no longer lists (left in place)"""
+
+    __slots__ = ("dest",)
+    event = "removed"
+
+    def __init__(self, dest):
+        self.dest = dest
+
+    def to_record(self):
+        return {'event': self.event, 'dest': self.dest}
+
+class GcEvent:
+    """Backups evicted by the retention policy after an apply made new ones"""
+
+    __slots__ = ("evictions", "bytes_before", "bytes_after")
+    event = "gc"
+
+    def __init__(self, evictions, bytes_before, bytes_after):
+        self.evictions = evictions
+        self.bytes_before = bytes_before
+        self.bytes_after = bytes_after
+
+    def to_record(self):
+        return {'event': self.event, 'dry_run': False, 'evicted': len(self.evictions),
+                'bytes_before': self.bytes_before, 'bytes_after': self.bytes_after}
+
+class SummaryEvent:
+    """Last event of Dotfiles.apply()"""
+
+    __slots__ = ("changed", "unchanged", "removed", "linked", "failed", "skipped", "elapsed")
+    event = "summary"
+
+    def __init__(self, changed, unchanged, removed, linked, failed, skipped, elapsed):
+        self.changed = changed
+        self.unchanged = unchanged
+        self.removed = removed
+        self.linked = linked
+        self.failed = failed
+        self.skipped = skipped
+        self.elapsed = elapsed
+
+    def to_record(self):
+        return {
+            'event': self.event,
+            'changed': self.changed,
+            'unchanged': self.unchanged,
+            'removed': self.removed,
+            'linked': self.linked,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'elapsed_ms': round(self.elapsed * 1000, 3),
+        }
+
+class TaskEvent:
+    """A setup task changing state, from Dotfiles.run_tasks()
+
+    state is 'unchanged' (inputs as of its last successful run, skipped),
+    'pending' (would run; dry runs only), 'started', 'done', 'failed' or
+    'blocked' (a task it needs failed).
+    """
+
+    __slots__ = ("name", "state", "description", "elapsed", "returncode", "log")
+    event = "task"
+
+    def __init__(self, name, state, description, elapsed=0.0, returncode=None, log=None):
+        self.name = name
+        self.state = state
+        self.description = description
+        self.elapsed = elapsed
+        self.returncode = returncode
+        # tasks/<name>.log in the state directory, None for interactive tasks
+        self.log = log
+
+    def to_record(self):
+        return {
+            'event': self.event,
+            'name': self.name,
+            'state': self.state,
+            'description': self.description,
+            'returncode': self.returncode,
+            'log': str(self.log) if self.log else None,
+            'elapsed_ms': round(self.elapsed * 1000, 3),
+        }
+
+class LinkPolicy:
+    """Answers, in place of a prompt, whether something in the way is backed up and replaced
+
+    replace is either a bool for every entry or a callable that takes the
+    entry's EntryStatus and returns one. Subclasses can override replace()
+    instead (the TUI's PromptPolicy asks on the terminal).
+    """
+
+    __slots__ = ("_replace",)
+
+    def __init__(self, replace=False):
+        self._replace = replace
+
+    def replace(self, status):
+        """Whether to back up and replace what lies at status.dest_rel
+
+        For tree entries over a real directory this covers the files in the
+        way inside it; files that are exact copies never get here.
+        """
+        if callable(self._replace):
+            return bool(self._replace(status))
+        return bool(self._replace)
+
+class Dotfiles:
+    """Library layer: status, planning and linking without any terminal I/O
+
+    Operations are generators of the event objects above, and the one
+    question linking raises is answered by a LinkPolicy, so provisioning
+    code can apply thousands of entries without rendering anything:
+
+        engine = Dotfiles(home_path="/home/ci")
+        for event in engine.apply(LinkPolicy(replace=True)):
+            if isinstance(event, LinkEvent) and event.error is not None:
+                print(event.dest, event.error)
+
+    DotfilesManager, the TUI, is a consumer of this class.
+    """
+
+    def __init__(self, jobs=None, repo_path=None, home_path=None):
+        self.repo_path = Path(repo_path).resolve() if repo_path else Path(__file__).parent.resolve()
+        self.home_path = Path(home_path) if home_path else Path.home()
+        self.backup_dir = self.home_path / ".dotfiles-backup"
+        self.jobs = max(1, jobs or DEFAULT_JOBS)
+        self.journal = StateJournal(self.home_path / ".dotfiles-state")
+        self.renderer = TemplateRenderer(self.journal.state_dir, self.home_path)
+        self.comparer = ContentComparer(self.jobs)
+        self.tree = TreeLinker(self.comparer)
+        self.status_engine = StatusEngine(self.repo_path, self.home_path, self.renderer, self.tree)
+        self.backups = BackupStore(self.backup_dir)
+        self.tasks = TaskRunner(self.journal.state_dir, self.repo_path, self.home_path, self.jobs)
+
+    def status(self, batch_size=256):
+        """Yield a StatusEvent per manifest entry as soon as it is classified
+
+        Entries are classified in manifest-order batches, so sibling
+        destinations still share a scandir pass while events start right away.
+        """
+        dotfiles = get_dotfiles()
+        for start in range(0, len(dotfiles), batch_size):
+            chunk = dotfiles[start:start + batch_size]
+            statuses = self.status_engine.scan([(source_rel, dest_rel) for source_rel, dest_rel, desc in chunk])
+            for offset, ((source_rel, dest_rel, desc), status) in enumerate(zip(chunk, statuses)):
+                yield StatusEvent(start + offset + 1, status, desc)
+
+    @traced("backup_file", entry=1)
+    def backup_file(self, path, kind=None, entry=None):
+        """Backup an existing file or directory into the backup store
+
+        Args:
+            path: Path to back up
+            kind: KIND_* of the path if already known, saves a stat
+            entry: Manifest destination the file is replaced for, recorded in
+                the backup index so --restore can find it
+
+        Returns:
+            Path of the backup's tree index, or None if there was nothing to keep
+        """
+        if kind is None:
+            if not path.exists():
+                return None
+        elif kind == KIND_LINK and not path.exists():
+            # Dangling symlinks have nothing worth keeping
+            return None
+
+        return self.backups.backup(path, entry=entry)
+
+    def is_identical(self, status):
+        """Whether an existing destination already has exactly the source's content"""
+        if status.state != STATUS_EXISTS or status.dest_kind != status.source_kind:
+            return False
+        if entry_mode(status.dest_rel) == 'tree' and status.dest_kind == KIND_DIR:
+            # Reconciled file by file, identical files included
+            return False
+        if entry_mode(status.dest_rel) in RENDER_MODES:
+            return self.renderer.matches(status.source_rel, status.dest_rel,
+                                         os.path.join(str(self.repo_path), status.source_rel),
+                                         os.path.join(str(self.home_path), status.dest_rel))
+        return self.comparer.same(
+            os.path.join(str(self.repo_path), status.source_rel),
+            os.path.join(str(self.home_path), status.dest_rel),
+            status.source_kind,
+        )
+
+    def plan_entry(self, status, policy, identical=None):
+        """Decide what linking one classified entry takes
+
+        Args:
+            status: EntryStatus from the status engine
+            policy: LinkPolicy asked before anything is replaced
+            identical: Whether the destination matches the source byte for
+                byte, compared here if omitted
+
+        Returns:
+            Action string (see PlanEvent)
+        """
+        # Check if source exists in repo
+        if status.state == STATUS_MISSING:
+            return 'missing'
+
+        if status.state == STATUS_LINKED:
+            return 'linked'
+
+        # Tree entries over an existing directory are linked file by file
+        if status.dest_kind == KIND_DIR and status.source_kind == KIND_DIR and entry_mode(status.dest_rel) == 'tree':
+            if status.state != STATUS_EXISTS or not policy.replace(status):
+                return 'merge'
+            return 'merge-replace'
+
+        # Copy and template entries: up to date, or ours to overwrite
+        if status.state == STATUS_RENDERED:
+            return 'rendered'
+        if status.state == STATUS_STALE:
+            return 'render'
+
+        # A copy of the source can be swapped for the link without asking or a backup
+        if status.state == STATUS_EXISTS:
+            if identical is None:
+                identical = self.is_identical(status)
+            if identical:
+                return 'identical'
+
+        # Check if destination already exists (including dangling symlinks)
+        if status.dest_kind is not None:
+            return 'replace' if policy.replace(status) else 'skip'
+
+        return 'link'
+
+    def plan(self, entries, policy=None):
+        """Yield a PlanEvent per entry, in the order given
+
+        Entries are classified in one scan and existing destinations are
+        compared with their sources in parallel before the first event, so
+        copies of the repo are relinked without a backup or a question. The
+        policy is asked in entry order.
+
+        Args:
+            entries: List of (source_rel, dest_rel) tuples
+            policy: LinkPolicy for existing destinations, never replaces if omitted
+        """
+        if policy is None:
+            policy = LinkPolicy()
+        statuses = self.status_engine.scan(entries)
+
+        identical = [False] * len(entries)
+        candidates = [pos for pos, status in enumerate(statuses)
+                      if status.state == STATUS_EXISTS and status.dest_kind == status.source_kind]
+        if candidates:
+            futures_mod = lazy_import("concurrent.futures")
+            with futures_mod.ThreadPoolExecutor(max_workers=min(self.jobs, len(candidates))) as pool:
+                for pos, same in zip(candidates, pool.map(lambda pos: self.is_identical(statuses[pos]), candidates)):
+                    identical[pos] = same
+
+        for (source_rel, dest_rel), status, same in zip(entries, statuses, identical):
+            yield PlanEvent(source_rel, dest_rel, self.plan_entry(status, policy, same), status)
+
+    @traced("apply_link", entry=2)
+    def apply_link(self, source_rel, dest_rel, action, dest_kind=None, make_parents=True):
+        """Carry out a planned link without any prompting or output
+
+        Safe to call from worker threads as long as entries whose destinations
+        nest inside one another are applied in order.
+
+        Args:
+            dest_kind: KIND_* of the destination from the status engine, saves
+                re-checking it before backup and removal
+            make_parents: Create missing parent directories (execute creates
+                them up front and turns this off)
+
+        Returns:
+            LinkEvent with success, backup path, error and elapsed seconds
+        """
+        started = time.perf_counter()
+        source = self.repo_path / source_rel
+        dest = self.home_path / dest_rel
+        mode = entry_mode(dest_rel)
+        result = LinkEvent(source_rel, dest_rel, action, mode)
+
+        if action in ('merge', 'merge-replace'):
+            try:
+                tree = self.apply_tree(source_rel, dest_rel, replace=action == 'merge-replace')
+                result.backup = tree.pop('backup')
+                result.tree = tree
+                result.success = True
+            except Exception as e:
+                result.error = e
+        elif action in ('link', 'replace', 'identical', 'render'):
+            try:
+                if action == 'identical':
+                    # Compared again right before the destination goes without a
+                    # backup; if it changed since planning, back it up after all
+                    status = self.status_engine.status(source_rel, dest_rel)
+                    dest_kind = status.dest_kind
+                    if not self.is_identical(status):
+                        action = result.action = 'replace'
+                elif action == 'replace' and dest_kind is None:
+                    dest_kind = self.status_engine.status(source_rel, dest_rel).dest_kind
+
+                if action in ('replace', 'identical'):
+
+                    if dest_kind is not None:
+                        # Backup existing file, unless it is just a copy of the source
+                        if action == 'replace':
+                            result.backup = self.backup_file(dest, kind=dest_kind, entry=dest_rel)
+                        else:
+                            self.backups.note_identical(dest, dest_rel)
+
+                        # Remove existing file/symlink
+                        if dest_kind == KIND_DIR:
+                            with trace_span("rmtree", dest_rel):
+                                lazy_import("shutil").rmtree(dest)
+                        else:
+                            with trace_span("unlink", dest_rel):
+                                dest.unlink()
+
+                # Create parent directories if needed
+                if make_parents:
+                    dest.parent.mkdir(parents=True, exist_ok=True)
+
+                if mode in RENDER_MODES:
+                    with trace_span("render", dest_rel):
+                        self.renderer.write(source_rel, dest_rel, str(source), str(dest))
+                else:
+                    # Create symlink
+                    with trace_span("symlink", dest_rel):
+                        dest.symlink_to(source)
+                result.success = True
+            except Exception as e:
+                result.error = e
+
+        result.elapsed = time.perf_counter() - started
+        return result
+
+    def apply_tree(self, source_rel, dest_rel, replace=False):
+        """Reconcile a tree entry's existing destination directory with its source
+
+        Uses the diff from the entry's last classification, so the trees are
+        walked once. Files that are exact copies are swapped for links
+        without a backup, directories holding only our links are folded into
+        one link, and conflicts are backed up and replaced only if replace
+        is set. Backups and identical records are indexed under each file's
+        own destination path, so --restore can put them back one by one.
+
+        Returns:
+            Dict with counts of links, folds, replaced and remaining conflicts,
+            plus the last backup made (or None)
+        """
+        source = os.path.join(str(self.repo_path), source_rel)
+        dest = os.path.join(str(self.home_path), dest_rel)
+        diff = self.tree.take(dest_rel, source, dest)
+        counts = {'links': 0, 'folds': 0, 'replaced': 0, 'conflicts': 0, 'backup': None}
+
+        def paths(rel):
+            if not rel:
+                return source, dest, dest_rel
+            return os.path.join(source, rel), os.path.join(dest, rel), f"{dest_rel}/{rel}"
+
+        for rel, kind in diff.conflicts:
+            if not replace:
+                counts['conflicts'] += 1
+                continue
+            source_path, dest_path, entry = paths(rel)
+            counts['backup'] = self.backup_file(Path(dest_path), kind=kind, entry=entry) or counts['backup']
+            if kind == KIND_DIR:
+                with trace_span("rmtree", entry):
+                    lazy_import("shutil").rmtree(dest_path)
+            else:
+                os.unlink(dest_path)
+            os.symlink(source_path, dest_path)
+            counts['replaced'] += 1
+
+        identical = set(diff.identical)
+        for rel in diff.identical:
+            source_path, dest_path, entry = paths(rel)
+            # Compared again right before it goes; a file edited since the
+            # walk is backed up instead
+            if self.comparer.same_file(source_path, dest_path):
+                self.backups.note_identical(Path(dest_path), entry)
+            else:
+                counts['backup'] = self.backup_file(Path(dest_path), kind=KIND_FILE, entry=entry) or counts['backup']
+            if not any(self.tree.within(rel, top) for top in diff.folds):
+                os.unlink(dest_path)
+                os.symlink(source_path, dest_path)
+                counts['links'] += 1
+
+        with trace_span("symlink", dest_rel):
+            for rel in diff.links:
+                source_path, dest_path, entry = paths(rel)
+                os.symlink(source_path, dest_path)
+                counts['links'] += 1
+
+        for rel in diff.folds:
+            source_path, dest_path, entry = paths(rel)
+            with trace_span("fold", entry):
+                self.tree.unfold(source_path, dest_path, rel, identical)
+                os.symlink(source_path, dest_path)
+            counts['folds'] += 1
+        return counts
+
+    def _link_groups(self, planned):
+        """Partition planned entries into groups that can be applied concurrently
+
+        An entry whose destination is, or lies inside, another entry's
+        destination (e.g. .config and .config/i3) joins that entry's group so
+        the two are applied in manifest order. Everything else gets a group
+        of its own.
+        """
+        groups = {}
+        owner = {}
+        # Shallowest destinations first so ancestors claim their group before descendants
+        for pos in sorted(range(len(planned)), key=lambda i: len(Path(planned[i][1]).parts)):
+            dest_rel = Path(planned[pos][1])
+            key = owner.get(dest_rel, pos)
+            if key == pos:
+                for parent in dest_rel.parents:
+                    if parent in owner:
+                        key = owner[parent]
+                        break
+            owner.setdefault(dest_rel, key)
+            groups.setdefault(key, []).append(pos)
+
+        # Keep manifest order inside each group
+        return [sorted(positions) for positions in groups.values()]
+
+    def execute(self, planned):
+        """Carry out PlanEvents, yielding a LinkEvent for each in the order given
+
+        Parent directories shared by several entries are created once before
+        fanning out to a thread pool, and entries nested inside one another
+        are applied in order by the same worker. Each event is yielded as
+        soon as it and everything before it is done.
+
+        Args:
+            planned: List of PlanEvents from plan()
+        """
+        # Create shared parent directories once, in manifest order
+        parents = {}
+        for step in planned:
+            if step.action in ('link', 'replace', 'identical', 'render'):
+                parents.setdefault(os.path.dirname(os.path.join(str(self.home_path), step.dest)), None)
+        for parent in parents:
+            try:
+                os.makedirs(parent, exist_ok=True)
+            except OSError:
+                # Surface the error from the entry itself
+                pass
+
+        def run_group(positions):
+            done = []
+            for n, pos in enumerate(positions):
+                step = planned[pos]
+                source_rel, dest_rel, action, dest_kind = step.source, step.dest, step.action, step.status.dest_kind
+                if n and action in ('link', 'replace', 'identical', 'render', 'merge', 'merge-replace'):
+                    # An earlier entry of this group may have changed what lies at dest
+                    status = self.status_engine.status(source_rel, dest_rel)
+                    dest_kind = status.dest_kind
+                    if status.state == STATUS_LINKED:
+                        action = 'linked'
+                    elif status.state == STATUS_RENDERED:
+                        action = 'rendered'
+                    elif action == 'render' and status.state != STATUS_STALE:
+                        action = 'skip'
+                    elif action in ('merge', 'merge-replace') and dest_kind != KIND_DIR:
+                        action = 'skip'
+                    elif action == 'link' and dest_kind is not None:
+                        # Never replace something the policy was not asked about
+                        action = 'skip'
+                    elif action == 'identical' and dest_kind is None:
+                        action = 'link'
+                done.append((pos, self.apply_link(source_rel, dest_rel, action, dest_kind, make_parents=False)))
+            return done
+
+        results = [None] * len(planned)
+        next_to_yield = 0
+        groups = self._link_groups([(step.source, step.dest) for step in planned])
+
+        futures_mod = lazy_import("concurrent.futures")
+        try:
+            with futures_mod.ThreadPoolExecutor(max_workers=min(self.jobs, len(groups) or 1)) as pool:
+                futures = [pool.submit(run_group, positions) for positions in groups]
+                for future in futures_mod.as_completed(futures):
+                    for pos, result in future.result():
+                        results[pos] = result
+
+                    # Hand out everything that is ready, without breaking manifest order
+                    while next_to_yield < len(results) and results[next_to_yield] is not None:
+                        yield results[next_to_yield]
+                        next_to_yield += 1
+        finally:
+            self.renderer.save()
+
+    def link(self, entries, policy=None):
+        """Plan and link entries, yielding a LinkEvent for each in the order given
+
+        The policy is asked about every entry before the first link is made.
+
+        Args:
+            entries: List of (source_rel, dest_rel) tuples
+            policy: LinkPolicy for existing destinations, never replaces if omitted
+        """
+        yield from self.execute(list(self.plan(entries, policy)))
+
+    def _fingerprint(self, source_rel, dest_rel):
+        """Journal fingerprint of a linked entry, or None if it is not linked"""
+        dest = os.path.join(str(self.home_path), dest_rel)
+        source = os.path.join(str(self.repo_path), source_rel)
+        try:
+            dest_st = os.lstat(dest)
+            source_st = os.lstat(source)
+        except OSError:
+            return None
+        if not stat.S_ISLNK(dest_st.st_mode):
+            return None
+        return (source_rel, source, dest_st.st_ino, dest_st.st_mtime_ns, _kind_from_mode(source_st.st_mode))
+
+    def _journal_dirs(self, dotfiles):
+        """Parent directories whose mtimes vouch for the entries inside them"""
+        home = str(self.home_path)
+        repo = str(self.repo_path)
+        dirs = set()
+        for source_rel, dest_rel, desc in dotfiles:
+            dirs.add(os.path.dirname(os.path.join(home, dest_rel)))
+            dirs.add(os.path.dirname(os.path.join(repo, source_rel)))
+        return dirs
+
+    def plan_apply(self, dotfiles, state=None):
+        """Work out which manifest entries changed since the last apply
+
+        An entry is unchanged when the journal has it linked to the same
+        source and the directories holding its source and destination have
+        the same mtime as when the journal was written (creating, removing or
+        replacing a link changes its directory's mtime). If a directory did
+        change, the entry's own lstat fingerprint is compared instead, so only
+        entries that really changed reach the status engine. Copy and template
+        entries are checked against the render cache instead of the journal.
+
+        Args:
+            dotfiles: Manifest entries
+            state: (entries, dirs, pending) from StateJournal.load, loaded if omitted
+
+        Returns:
+            Tuple of (changed entries as (source_rel, dest_rel), number of
+            unchanged entries, destinations that left the manifest, number of
+            entries resumed from an interrupted apply)
+        """
+        journal, dirs, pending = state or self.journal.load(self.repo_path)
+        pending = set(pending)
+        home = str(self.home_path)
+        repo = str(self.repo_path)
+
+        dir_ok = {}
+        def unchanged_dir(path):
+            ok = dir_ok.get(path)
+            if ok is None:
+                try:
+                    ok = os.stat(path).st_mtime_ns == dirs.get(path)
+                except OSError:
+                    ok = False
+                dir_ok[path] = ok
+            return ok
+
+        changed = []
+        unchanged = 0
+        for source_rel, dest_rel, desc in dotfiles:
+            mode = entry_mode(dest_rel)
+            if mode in RENDER_MODES:
+                # Template edits do not show in directory mtimes; the render cache decides
+                if self.renderer.check(source_rel, dest_rel, os.path.join(repo, source_rel),
+                                       os.path.join(home, dest_rel)):
+                    unchanged += 1
+                else:
+                    changed.append((source_rel, dest_rel))
+                continue
+            fingerprint = journal.get(dest_rel)
+            if fingerprint is not None and fingerprint[0] == source_rel and dest_rel not in pending:
+                dest = os.path.join(home, dest_rel)
+                source = os.path.join(repo, source_rel)
+                if unchanged_dir(os.path.dirname(dest)) and unchanged_dir(os.path.dirname(source)):
+                    unchanged += 1
+                    continue
+                if self._fingerprint(source_rel, dest_rel) == tuple(fingerprint):
+                    unchanged += 1
+                    continue
+            if mode == 'tree' and self.status_engine.status(source_rel, dest_rel).state == STATUS_LINKED:
+                # Linked file by file inside a real directory: one walk of the
+                # tree tells, and the journal has nothing to fingerprint
+                unchanged += 1
+                continue
+            changed.append((source_rel, dest_rel))
+
+        in_manifest = {dest_rel for source_rel, dest_rel, desc in dotfiles}
+        removed = sorted(dest_rel for dest_rel in journal if dest_rel not in in_manifest)
+        return changed, unchanged, removed, len(pending)
+
+    def apply(self, policy=None):
+        """Incrementally apply the manifest, touching only entries that changed
+
+        Yields an ApplyEvent, a RemovedEvent per destination that left the
+        manifest, a LinkEvent per changed entry, a GcEvent if new backups
+        pushed the store past its retention policy, and a closing
+        SummaryEvent. Every entry that ends up linked is written to the
+        state journal before its event is yielded, so an apply that is
+        interrupted (or a generator that is abandoned) picks up where it
+        stopped next time.
+
+        Args:
+            policy: LinkPolicy for existing destinations, never replaces if omitted
+        """
+        started = time.perf_counter()
+        dotfiles = get_dotfiles()
+        journal, dirs, pending = self.journal.load(self.repo_path)
+        changed, unchanged, removed, resumed = self.plan_apply(dotfiles, (journal, dirs, pending))
+        yield ApplyEvent(len(changed), unchanged, len(removed), resumed)
+
+        for dest_rel in removed:
+            journal.pop(dest_rel, None)
+            yield RemovedEvent(dest_rel)
 
-# Try to import Rich for fancy TUI, fall back to basic interface if not available
-try:
-    from rich.console import Console
-    from rich.prompt import Confirm, Prompt
-    from rich.table import Table
-    from rich.panel import Panel
-    from rich.text import Text
-    from rich import box
-    HAS_RICH = True
-    console = Console()
-except ImportError:
-    HAS_RICH = False
-    console = None
-
-# Try to import YAML for manifest support
-try:
-    import yaml
-    HAS_YAML = True
-except ImportError:
-    HAS_YAML = False
+        linked = failed = skipped = 0
+        backed_up = False
+        if changed:
+            self.journal.begin([dest_rel for source_rel, dest_rel in changed])
+            for result in self.link(changed, policy):
+                fingerprint = self._fingerprint(result.source, result.dest) if result.success else None
+                if fingerprint is None:
+                    journal.pop(result.dest, None)
+                    self.journal.drop(result.dest)
+                else:
+                    journal[result.dest] = fingerprint
+                    self.journal.record(result.dest, fingerprint)
+                linked += result.success
+                failed += result.error is not None
+                skipped += result.action == 'skip'
+                backed_up = backed_up or bool(result.backup)
+                yield result
 
-# Manifest file path
-MANIFEST_FILE = SCRIPT_DIR / "manifest.yaml"
+        # Keep the backup store within its retention policy as backups are added
+        retention = get_manifest_settings().get('retention')
+        if backed_up and retention:
+            yield GcEvent(*self.backups.gc(retention))
 
-def load_dotfiles_manifest():
-    """Load dotfiles configuration from manifest.yaml"""
-    if not MANIFEST_FILE.exists():
-        print(f"Error: Manifest file not found: {MANIFEST_FILE}")
-        print("Please create a manifest.yaml file or restore it from the repository.")
-        sys.exit(1)
+        self.renderer.save()
 
-    if not HAS_YAML:
-        print("Error: PyYAML library not found.")
-        print("Install it with: python3 dotfiles.py --install-deps")
-        sys.exit(1)
+        if changed or removed or pending or not dirs:
+            # Snapshot the directory mtimes as they are after this apply; the
+            # state directory must exist first or creating it would change ~
+            self.journal.state_dir.mkdir(parents=True, exist_ok=True)
+            dirs = {}
+            for path in self._journal_dirs(dotfiles):
+                try:
+                    dirs[path] = os.stat(path).st_mtime_ns
+                except OSError:
+                    pass
+            self.journal.commit(self.repo_path, journal, dirs)
 
-    try:
-        with open(MANIFEST_FILE, 'r') as f:
-            data = yaml.safe_load(f)
+        yield SummaryEvent(len(changed), unchanged, len(removed), linked, failed, skipped,
+                           time.perf_counter() - started)
 
-        if not data or 'dotfiles' not in data:
-            print(f"Error: Invalid manifest format in {MANIFEST_FILE}")
-            print("Expected 'dotfiles' key with a list of entries.")
-            sys.exit(1)
+    def run_tasks(self, names=None, rerun=False, dry_run=False):
+        """Run the manifest's setup tasks, yielding a TaskEvent as each changes state
 
-        # Convert to tuple format (source, dest, description)
-        dotfiles = []
-        for entry in data['dotfiles']:
-            if not all(k in entry for k in ['source', 'dest', 'description']):
-                print(f"Warning: Skipping invalid entry: {entry}")
-                continue
-            dotfiles.append((entry['source'], entry['dest'], entry['description']))
+        Tasks run as a dependency graph, independent ones in parallel, and a
+        task whose inputs are unchanged since its last successful run is
+        skipped (see TaskRunner). A ValueError for unknown tasks or a cycle
+        is raised before the first event.
 
-        if not dotfiles:
-            print(f"Error: No valid dotfiles found in {MANIFEST_FILE}")
-            sys.exit(1)
+        Args:
+            names: Only run these tasks and the ones they need
+            rerun: Run tasks even if their inputs are unchanged
+            dry_run: Only report which tasks would run
+        """
+        return self.tasks.run(get_manifest_settings().get('tasks', []), names, rerun=rerun, dry_run=dry_run)
 
-        return dotfiles
+class PromptPolicy(LinkPolicy):
+    """LinkPolicy that asks on the terminal, remembering an 'a' (yes to all) answer"""
 
-    except yaml.YAMLError as e:
-        print(f"Error: Failed to parse manifest.yaml: {e}")
-        sys.exit(1)
-    except Exception as e:
-        print(f"Error: Failed to load manifest: {e}")
-        sys.exit(1)
+    __slots__ = ("manager", "all")
 
-# Lazy loading of dotfiles - only load when needed, not at import time
-DOTFILES = None
+    def __init__(self, manager, force=False, yes_to_all=False):
+        super().__init__(force)
+        self.manager = manager
+        self.all = yes_to_all
 
-def get_dotfiles():
-    """Get dotfiles list, loading from manifest if needed"""
-    global DOTFILES
-    if DOTFILES is None:
-        DOTFILES = load_dotfiles_manifest()
-    return DOTFILES
+    def replace(self, status):
+        if self._replace or self.all:
+            return True
+        if status.dest_kind == KIND_DIR and entry_mode(status.dest_rel) == 'tree':
+            self.manager.print_info(f"⚠ Files in the way inside: {status.dest_rel}", "warning")
+            response = self.manager.confirm("  Backup and replace them?", default=False, allow_all=True)
+        else:
+            self.manager.print_info(f"⚠ Destination exists: {status.dest_rel}", "warning")
+            response = self.manager.confirm("  Backup and replace?", default=False, allow_all=True)
+        if response == 'all':
+            self.all = True
+            return True
+        return bool(response)
 
 class DotfilesManager:
-    def __init__(self):
-        self.repo_path = Path(__file__).parent.resolve()
-        self.home_path = Path.home()
-        self.backup_dir = self.home_path / ".dotfiles-backup"
+    """Terminal front end: prints and prompts around a Dotfiles engine"""
+
+    def __init__(self, jobs=None, repo_path=None, home_path=None):
+        self.engine = Dotfiles(jobs=jobs, repo_path=repo_path, home_path=home_path)
+        # Rollback, watch and the menu work on the engine's state directly
+        self.repo_path = self.engine.repo_path
+        self.home_path = self.engine.home_path
+        self.backup_dir = self.engine.backup_dir
+        self.jobs = self.engine.jobs
+        self.journal = self.engine.journal
+        self.renderer = self.engine.renderer
+        self.tree = self.engine.tree
+        self.status_engine = self.engine.status_engine
+        self.backups = self.engine.backups
+        self.non_interactive = False
+        # "table" for the Rich/plain TUI, "ndjson" for one JSON record per line
+        self.output_format = "table"
 
     def print_header(self):
         """Print a fancy header or simple text depending on Rich availability"""
-        if HAS_RICH:
+        if has_rich():
             console.print(Panel.fit(
                 "[bold cyan]Konstantin's Dotfiles Manager[/bold cyan]\n"
                 "[dim]Interactive symlink management for configuration files[/dim]",
@@ -136,7 +3704,13 @@ class DotfilesManager:
 
     def print_info(self, message, style="info"):
         """Print info message with optional styling"""
-        if HAS_RICH:
+        if self.output_format == "ndjson":
+            # stdout carries only records; progress goes to stderr, unstyled
+            if message.strip():
+                print(message.strip("\n"), file=sys.stderr)
+            return
+
+        if has_rich():
             style_map = {
                 "info": "cyan",
                 "success": "green",
@@ -153,17 +3727,33 @@ class DotfilesManager:
             }
             print(f"{prefix.get(style, '')} {message}")
 
-    def print_table(self, data):
-        """Print a table of dotfiles or simple list"""
-        if HAS_RICH:
-            table = Table(title="Available Dotfiles", box=box.ROUNDED)
+    def emit(self, record, flush=True):
+        """Write one NDJSON record to stdout"""
+        sys.stdout.write(lazy_import("json").dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n")
+        if flush:
+            sys.stdout.flush()
+
+    def print_table(self, data, indexes=None, title="Available Dotfiles", caption=None):
+        """Print a table of dotfiles or simple list
+
+        Args:
+            data: Rows of (source, dest, status, description)
+            indexes: Manifest numbers to show for each row, defaults to 1..n
+            title: Table title
+            caption: Optional line shown under the table (e.g. page position)
+        """
+        if indexes is None:
+            indexes = range(1, len(data) + 1)
+
+        if has_rich():
+            table = Table(title=title, caption=caption, box=box.ROUNDED)
             table.add_column("No.", style="cyan", justify="right")
             table.add_column("Source", style="magenta")
             table.add_column("Destination", style="yellow")
             table.add_column("Status", style="white")
             table.add_column("Description", style="dim")
 
-            for idx, (source, dest, status, desc) in enumerate(data, 1):
+            for idx, (source, dest, status, desc) in zip(indexes, data):
                 status_style = "green" if status == "✓ Not linked" else "yellow" if status.startswith("→") else "red"
                 table.add_row(
                     str(idx),
@@ -175,42 +3765,29 @@ class DotfilesManager:
 
             console.print(table)
         else:
-            print("\nAvailable Dotfiles:")
+            print(f"\n{title}:")
             print("-" * 80)
-            for idx, (source, dest, status, desc) in enumerate(data, 1):
+            for idx, (source, dest, status, desc) in zip(indexes, data):
                 print(f"{idx:2}. {source:30} -> {dest:30} [{status}]")
                 print(f"    {desc}")
             print("-" * 80)
+            if caption:
+                print(caption)
 
+    @traced("get_status", entry=2)
     def get_status(self, source_rel, dest_rel):
         """Get the current status of a dotfile"""
-        source = self.repo_path / source_rel
-        dest = self.home_path / dest_rel
-
-        if not source.exists():
-            return "✗ Missing in repo"
-
-        if not dest.exists():
-            return "✓ Not linked"
-
-        if dest.is_symlink():
-            target = dest.resolve()
-            if target == source:
-                return "→ Already linked"
-            else:
-                return f"→ Links elsewhere"
-
-        return "⚠ File exists"
+        return self.status_engine.status(source_rel, dest_rel).label
 
-    def list_dotfiles(self):
+    def list_dotfiles(self, show=True):
         """List all dotfiles with their current status"""
-        data = []
         dotfiles = get_dotfiles()
-        for source_rel, dest_rel, desc in dotfiles:
-            status = self.get_status(source_rel, dest_rel)
-            data.append((source_rel, dest_rel, status, desc))
+        statuses = self.status_engine.scan([(source_rel, dest_rel) for source_rel, dest_rel, desc in dotfiles])
+        data = [(source_rel, dest_rel, status.label, desc)
+                for (source_rel, dest_rel, desc), status in zip(dotfiles, statuses)]
 
-        self.print_table(data)
+        if show:
+            self.print_table(data)
         return data
 
     def confirm(self, message, default=False, allow_all=False):
@@ -224,7 +3801,10 @@ class DotfilesManager:
         Returns:
             True for yes, False for no, 'all' for yes to all (when allow_all=True)
         """
-        if HAS_RICH and not allow_all:
+        if self.non_interactive:
+            return default
+
+        if has_rich() and not allow_all:
             return Confirm.ask(message, default=default)
         else:
             if allow_all:
@@ -244,31 +3824,146 @@ class DotfilesManager:
 
     def prompt(self, message, default=""):
         """Prompt for input"""
-        if HAS_RICH:
+        if has_rich():
             return Prompt.ask(message, default=default)
         else:
             return input(f"{message} [{default}]: ").strip() or default
 
-    def backup_file(self, path):
-        """Backup an existing file or directory"""
-        if not path.exists():
-            return None
+    def list_backups(self, name=None):
+        """Print the backups in the backup store, oldest first"""
+        backups = self.backups.list_backups(name)
+        if not backups:
+            self.print_info("No backups found", "info")
+            return backups
+
+        if has_rich():
+            table = Table(title="Backups", box=box.ROUNDED)
+            table.add_column("Backup", style="cyan")
+            table.add_column("Kind", style="white")
+            table.add_column("Size", style="magenta", justify="right")
+            table.add_column("Created", style="yellow")
+            table.add_column("Original", style="dim")
+            for backup in backups:
+                table.add_row(backup['id'], backup['kind'] + (" (legacy)" if backup['legacy'] else ""),
+                              str(backup['size']), backup['created'], backup['original'] or "")
+            console.print(table)
+        else:
+            print("\nBackups:")
+            print("-" * 80)
+            for backup in backups:
+                legacy = " (legacy)" if backup['legacy'] else ""
+                print(f"{backup['id']:45} {backup['kind'] + legacy:14} {backup['size']:>10} {backup['created']}")
+                if backup['original']:
+                    print(f"    {backup['original']}")
+            print("-" * 80)
+        return backups
+
+    def gc_backups(self, dry_run=False, verbose=True):
+        """Evict backups according to the retention policy in manifest.yaml
+
+        Args:
+            dry_run: Only report what would be evicted
+            verbose: List every eviction, not just the totals
+
+        Returns:
+            List of eviction dicts (see BackupStore.plan_gc)
+        """
+        retention = get_manifest_settings().get('retention')
+        if not retention:
+            self.print_info("No backup retention policy in manifest.yaml (see 'backups:' in the README)", "info")
+            return []
 
-        # Create backup directory if it doesn't exist
-        self.backup_dir.mkdir(exist_ok=True)
+        evictions, before, after = self.backups.gc(retention, dry_run=dry_run)
+        return self.report_gc(evictions, before, after, retention, dry_run=dry_run, verbose=verbose)
 
-        # Create timestamped backup
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_name = f"{path.name}.backup.{timestamp}"
-        backup_path = self.backup_dir / backup_name
+    def report_gc(self, evictions, before, after, retention, dry_run=False, verbose=True):
+        """Print the outcome of BackupStore.gc as a table, or as NDJSON records"""
+        verb = "Would evict" if dry_run else "Evicted"
 
-        if path.is_dir():
-            shutil.copytree(path, backup_path, symlinks=True)
+        if self.output_format == "ndjson":
+            for eviction in evictions:
+                self.emit(dict(eviction, event='evict', dry_run=dry_run), flush=False)
+            self.emit({'event': 'gc', 'dry_run': dry_run, 'evicted': len(evictions),
+                       'bytes_before': before, 'bytes_after': after})
+            return evictions
+
+        if verbose and evictions:
+            if has_rich():
+                table = Table(title=f"{verb} Backups", box=box.ROUNDED)
+                table.add_column("Backup", style="cyan")
+                table.add_column("Reason", style="yellow")
+                table.add_column("Freed", style="magenta", justify="right")
+                table.add_column("Created", style="white")
+                for eviction in evictions:
+                    table.add_row(eviction['id'], eviction['reason'], str(eviction['freed']), eviction['created'])
+                console.print(table)
+            else:
+                print(f"\n{verb}:")
+                print("-" * 80)
+                for eviction in evictions:
+                    print(f"{eviction['id']:45} {eviction['reason']:10} {eviction['freed']:>10} {eviction['created']}")
+                print("-" * 80)
+
+        if evictions or verbose:
+            self.print_info(f"{verb} {len(evictions)} backup(s): {before} → {after} bytes", "info")
+        if after > retention.get('max_size', after):
+            self.print_info("  Still over max_size: the newest backup of each file is always kept", "warning")
+        return evictions
+
+    def report_link(self, result):
+        """Print a LinkEvent the same way for single links, batches and applies"""
+        if self.output_format == "ndjson":
+            self.emit(result.to_record())
+            return
+
+        source_rel = result.source
+        dest_rel = result.dest
+        action = result.action
+        timing = f" [dim]({result.elapsed * 1000:.1f} ms)[/dim]" if has_rich() else f" ({result.elapsed * 1000:.1f} ms)"
+
+        if action == 'missing':
+            self.print_info(f"✗ Source not found: {self.repo_path / source_rel}", "error")
+        elif action == 'linked':
+            self.print_info(f"→ Already linked: {dest_rel}", "info")
+        elif action == 'rendered':
+            self.print_info(f"→ Already rendered: {dest_rel}", "info")
+        elif action == 'skip':
+            self.print_info(f"⊘ Skipped: {dest_rel}", "warning")
+        elif result.error is not None:
+            verb = "render" if result.mode in RENDER_MODES else "link"
+            self.print_info(f"✗ Failed to {verb} {dest_rel}: {result.error}", "error")
         else:
-            shutil.copy2(path, backup_path)
+            if result.backup:
+                self.print_info(f"  Backed up to: {result.backup.relative_to(self.home_path)}", "info")
+            elif action == 'identical':
+                self.print_info(f"  Replaced identical copy of {source_rel} (no backup needed)", "info")
+            if result.tree is not None:
+                tree = result.tree
+                if tree['links'] == tree['folds'] == tree['replaced'] == 0:
+                    self.print_info(f"→ Already linked: {dest_rel}", "info")
+                else:
+                    self.print_info(f"✓ Linked into {dest_rel}: {tree['links']} link(s), {tree['folds']} folded, "
+                                    f"{tree['replaced']} replaced{timing}", "success")
+                if tree['conflicts']:
+                    self.print_info(f"  {tree['conflicts']} path(s) in the way were left alone", "warning")
+            elif result.mode in RENDER_MODES:
+                self.print_info(f"✓ Rendered: {dest_rel} from {source_rel} ({result.mode}){timing}", "success")
+            else:
+                self.print_info(f"✓ Linked: {dest_rel} → {source_rel}{timing}", "success")
 
-        return backup_path
+    def report_timing(self, results, elapsed):
+        """Print how long a batch of links took and which one was slowest"""
+        applied = [r for r in results if r.action in ('link', 'replace', 'identical', 'render', 'merge', 'merge-replace')]
+        if applied:
+            slowest = max(applied, key=lambda r: r.elapsed)
+            self.print_info(
+                f"Applied {len(applied)} link(s) in {elapsed * 1000:.1f} ms "
+                f"using up to {self.jobs} worker(s); "
+                f"slowest: {slowest.dest} ({slowest.elapsed * 1000:.1f} ms)",
+                "info"
+            )
 
+    @traced("create_symlink", entry=2)
     def create_symlink(self, source_rel, dest_rel, force=False, yes_to_all=False):
         """Create a symlink from repo to home directory
 
@@ -281,93 +3976,551 @@ class DotfilesManager:
         Returns:
             Tuple of (success: bool, apply_to_all: bool)
         """
-        source = self.repo_path / source_rel
-        dest = self.home_path / dest_rel
+        policy = PromptPolicy(self, force, yes_to_all)
+        status = self.status_engine.status(source_rel, dest_rel)
+        action = self.engine.plan_entry(status, policy)
+        result = self.engine.apply_link(source_rel, dest_rel, action, dest_kind=status.dest_kind)
+        self.report_link(result)
+        return (result.success, policy.all)
 
-        # Check if source exists in repo
-        if not source.exists():
-            self.print_info(f"✗ Source not found: {source}", "error")
-            return (False, yes_to_all)
-
-        # Check if destination already exists
-        if dest.exists() or dest.is_symlink():
-            if dest.is_symlink() and dest.resolve() == source:
-                self.print_info(f"→ Already linked: {dest_rel}", "info")
-                return (True, yes_to_all)
-
-            if not force and not yes_to_all:
-                self.print_info(f"⚠ Destination exists: {dest_rel}", "warning")
-                response = self.confirm("  Backup and replace?", default=False, allow_all=True)
-                if response == 'all':
-                    yes_to_all = True
-                elif not response:
-                    self.print_info(f"⊘ Skipped: {dest_rel}", "warning")
-                    return (False, yes_to_all)
-
-            # Backup existing file
-            backup_path = self.backup_file(dest)
-            if backup_path:
-                self.print_info(f"  Backed up to: {backup_path.relative_to(self.home_path)}", "info")
-
-            # Remove existing file/symlink
-            if dest.is_dir() and not dest.is_symlink():
-                shutil.rmtree(dest)
-            else:
-                dest.unlink()
+    @traced("link_entries")
+    def link_entries(self, entries, force=False):
+        """Link many dotfiles, printing each result in manifest order
+
+        Confirmation prompts are asked up front in manifest order, then the
+        engine applies the confirmed entries concurrently (see Dotfiles.execute).
+
+        Args:
+            entries: List of (source_rel, dest_rel) tuples
+            force: Replace existing files without asking
+
+        Returns:
+            List of LinkEvents, in the order given
+        """
+        started = time.perf_counter()
+        results = []
+        for result in self.engine.link(entries, PromptPolicy(self, force)):
+            self.report_link(result)
+            if self.output_format != "ndjson":
+                print()  # Empty line between items
+            results.append(result)
+        self.report_timing(results, time.perf_counter() - started)
+        return results
+
+    @traced("apply")
+    def apply(self, force=False):
+        """Incrementally apply the manifest, printing the engine's events as they arrive
+
+        Args:
+            force: Replace existing files without asking
+
+        Returns:
+            Summary dict with counts of changed, unchanged, removed, linked,
+            failed and skipped entries
+        """
+        results = []
+        linking = None
+        changed = 0
+        summary = None
+
+        for event in self.engine.apply(PromptPolicy(self, force)):
+            if isinstance(event, LinkEvent):
+                self.report_link(event)
+                if self.output_format != "ndjson":
+                    print()  # Empty line between items
+                results.append(event)
+                continue
+
+            if linking is not None and results:
+                # The links are done; report them before whatever follows
+                self.report_timing(results, time.perf_counter() - linking)
+                self.print_info(f"✓ {sum(1 for r in results if r.success)}/{changed} changed dotfiles now linked", "success")
+                if self.non_interactive and any(r.action == 'skip' for r in results):
+                    self.print_info("  Existing files were left alone; rerun with --yes to back up and replace them", "info")
+                linking = None
+
+            if isinstance(event, ApplyEvent):
+                changed = event.changed
+                if self.output_format == "ndjson":
+                    self.emit(event.to_record())
+                if event.resumed:
+                    self.print_info(f"Resuming interrupted apply ({event.resumed} entries were still pending)", "warning")
+                self.print_info(f"{event.changed} changed, {event.unchanged} unchanged, "
+                                f"{event.removed} no longer in manifest", "info")
+                if event.changed:
+                    linking = time.perf_counter()
+                    if self.output_format != "ndjson":
+                        print()
+            elif isinstance(event, RemovedEvent):
+                if self.output_format == "ndjson":
+                    self.emit(event.to_record())
+                self.print_info(f"⊘ No longer in manifest: {event.dest} (left in place)", "warning")
+            elif isinstance(event, GcEvent):
+                self.report_gc(event.evictions, event.bytes_before, event.bytes_after,
+                               get_manifest_settings().get('retention'), verbose=False)
+            elif isinstance(event, SummaryEvent):
+                summary = event.to_record()
+                if self.output_format == "ndjson":
+                    self.emit(summary)
+                self.print_info(f"Apply finished in {event.elapsed * 1000:.1f} ms", "info")
+        return summary
+
+    def stream_status(self, batch_size=256):
+        """Write one NDJSON status record per manifest entry as soon as it is classified"""
+        for event in self.engine.status(batch_size):
+            self.emit(event.to_record(), flush=False)
+            if event.index % batch_size == 0:
+                sys.stdout.flush()
+        sys.stdout.flush()
+
+    def run_tasks(self, names=None, rerun=False, dry_run=False):
+        """Run the setup tasks from manifest.yaml, printing each as it starts and settles
+
+        Args:
+            names: Only run these tasks and the ones they need
+            rerun: Run tasks even if their inputs are unchanged
+            dry_run: Only report which tasks would run
+
+        Returns:
+            List of TaskEvents for the settled tasks (no 'started' ones)
+        """
+        if not get_manifest_settings().get('tasks'):
+            self.print_info("No tasks in manifest.yaml (see 'tasks:' in the README)", "info")
+            return []
+
+        started = time.perf_counter()
+        results = []
+        try:
+            for event in self.engine.run_tasks(names, rerun=rerun, dry_run=dry_run):
+                if event.state != 'started':
+                    results.append(event)
+                if self.output_format == "ndjson":
+                    self.emit(event.to_record())
+                    continue
+                timing = f"{event.elapsed:.1f} s"
+                if event.state == 'started':
+                    self.print_info(f"▶ Running: {event.name}" + (f" - {event.description}" if event.description else ""), "info")
+                elif event.state == 'done':
+                    self.print_info(f"✓ Done: {event.name} ({timing})", "success")
+                elif event.state == 'unchanged':
+                    self.print_info(f"→ Unchanged: {event.name}", "info")
+                elif event.state == 'pending':
+                    self.print_info(f"• Would run: {event.name}", "info")
+                elif event.state == 'blocked':
+                    self.print_info(f"⊘ Blocked: {event.name} (a task it needs failed)", "warning")
+                else:
+                    self.print_info(f"✗ Failed: {event.name} with exit code {event.returncode} ({timing})", "error")
+                    if event.log is not None:
+                        try:
+                            with open(event.log, errors="replace") as f:
+                                tail = f.readlines()[-10:]
+                        except OSError:
+                            tail = []
+                        for line in tail:
+                            print(f"    {line.rstrip()}")
+                        self.print_info(f"  Full output: {event.log}", "info")
+        except ValueError as e:
+            self.print_info(f"✗ {e}", "error")
+            sys.exit(1)
+
+        counts = {}
+        for event in results:
+            counts[event.state] = counts.get(event.state, 0) + 1
+        self.print_info(
+            f"Tasks: {counts.get('done', 0)} ran, {counts.get('unchanged', 0)} unchanged, "
+            + (f"{counts.get('pending', 0)} would run, " if dry_run else "")
+            + f"{counts.get('failed', 0)} failed, {counts.get('blocked', 0)} blocked "
+            f"in {time.perf_counter() - started:.1f} s",
+            "info"
+        )
+        return results
+
+    def _watch_targets(self, dotfiles):
+        """Directories to watch and the names in them that affect each entry
+
+        A destination is watched through its parent directory. When the parent
+        does not exist yet, the nearest existing ancestor inside home is
+        watched instead, keyed by the name of the missing directory.
+
+        Returns:
+            Dict of {directory: {name: [dest_rel, ...]}}
+        """
+        home = str(self.home_path)
+        targets = {}
+        for source_rel, dest_rel, desc in dotfiles:
+            dest = os.path.normpath(os.path.join(home, dest_rel))
+            directory, name = os.path.split(dest)
+            while directory != home and len(directory) > len(home) and not os.path.isdir(directory):
+                directory, name = os.path.split(directory)
+            targets.setdefault(directory, {}).setdefault(name, []).append(dest_rel)
+        return targets
+
+    def repair(self, entries, force=False):
+        """Re-check entries and relink the ones that drifted from the manifest
+
+        Entries whose destination is simply missing are relinked. Replaced
+        files and links pointing elsewhere are reported, and only backed up and
+        replaced when force is set.
+        """
+        drifted = []
+        for (source_rel, dest_rel), status in zip(entries, self.status_engine.scan(entries)):
+            if status.state == STATUS_LINKED:
+                continue
+            if self.output_format == "ndjson":
+                self.emit({'event': 'drift', 'source': source_rel, 'dest': dest_rel, 'status': status.state})
+            if status.state == STATUS_MISSING:
+                self.print_info(f"✗ Source not found: {self.repo_path / source_rel}", "error")
+                continue
+            self.print_info(f"⚠ Drift detected: {dest_rel} ({status.label})", "warning")
+            drifted.append((source_rel, dest_rel))
+
+        if drifted:
+            return self.link_entries(drifted, force=force)
+        return []
+
+    def watch(self, force=False, debounce=0.2, max_delay=2.0):
+        """Watch destinations and manifest.yaml with inotify and repair link drift
+
+        Blocks in the kernel until something changes; there is no polling.
+        Events are coalesced until debounce seconds pass without a new one (or
+        max_delay since the first), so a burst of writes costs one re-check of
+        only the entries it touched.
+
+        Args:
+            force: Back up and replace files that took a link's place
+            debounce: Quiet period that ends a burst of events, in seconds
+            max_delay: Longest a burst may delay the re-check, in seconds
+        """
+        global DOTFILES
+
+        try:
+            watcher = InotifyWatcher()
+        except OSError as e:
+            self.print_info(f"✗ Cannot watch for changes: {e}", "error")
+            sys.exit(1)
 
-        # Create parent directories if needed
-        dest.parent.mkdir(parents=True, exist_ok=True)
+        manifest_dir, manifest_name = os.path.split(str(MANIFEST_FILE))
+        dotfiles = get_dotfiles()
+        targets = {}
+        watches = {}  # directory -> watch descriptor
+        paths = {}    # watch descriptor -> directory
+
+        def arm():
+            nonlocal targets
+            targets = self._watch_targets(dotfiles)
+            wanted = set(targets)
+            wanted.add(manifest_dir)
+            for directory in [d for d in watches if d not in wanted]:
+                wd = watches.pop(directory)
+                paths.pop(wd, None)
+                watcher.remove(wd)
+            for directory in wanted:
+                if directory in watches:
+                    continue
+                try:
+                    wd = watcher.add(directory)
+                except OSError as e:
+                    self.print_info(f"⚠ Cannot watch {directory}: {e.strerror}", "warning")
+                    continue
+                watches[directory] = wd
+                paths[wd] = directory
+
+        def entries_for(dests):
+            return [(source_rel, dest_rel) for source_rel, dest_rel, desc in dotfiles if dest_rel in dests]
 
-        # Create symlink
         try:
-            dest.symlink_to(source)
-            self.print_info(f"✓ Linked: {dest_rel} → {source_rel}", "success")
-            return (True, yes_to_all)
-        except Exception as e:
-            self.print_info(f"✗ Failed to link {dest_rel}: {e}", "error")
-            return (False, yes_to_all)
+            arm()
+            self.repair([(source_rel, dest_rel) for source_rel, dest_rel, desc in dotfiles], force=force)
+            self.print_info(f"Watching {len(dotfiles)} dotfiles in {len(watches)} directories (Ctrl+C to stop)", "info")
+
+            while True:
+                events = watcher.read()
+                deadline = time.monotonic() + max_delay
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    more = watcher.read(min(debounce, remaining))
+                    if not more:
+                        break
+                    events.extend(more)
+
+                affected = set()
+                rearm = reload = overflow = False
+                for wd, mask, name in events:
+                    if mask & IN_Q_OVERFLOW:
+                        overflow = True
+                        continue
+                    directory = paths.get(wd)
+                    if directory is None:
+                        continue
+                    if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                        # The directory itself went away; everything under it needs a look
+                        if mask & IN_IGNORED:
+                            paths.pop(wd, None)
+                            if watches.get(directory) == wd:
+                                del watches[directory]
+                        for dests in targets.get(directory, {}).values():
+                            affected.update(dests)
+                        rearm = True
+                        continue
+                    if directory == manifest_dir and name == manifest_name:
+                        reload = True
+                    dests = targets.get(directory, {}).get(name)
+                    if dests:
+                        affected.update(dests)
+                        # A missing parent appeared or vanished; watch at the right level again
+                        if any(os.path.dirname(os.path.normpath(os.path.join(str(self.home_path), d))) != directory for d in dests):
+                            rearm = True
+
+                if reload:
+                    try:
+                        dotfiles = DOTFILES = load_dotfiles_manifest()
+                    except SystemExit:
+                        # Keep watching with the previous manifest until it parses again
+                        self.print_info("⚠ manifest.yaml could not be loaded; keeping the previous manifest", "warning")
+                    else:
+                        self.print_info(f"Reloaded manifest.yaml ({len(dotfiles)} dotfiles)", "info")
+                        overflow = True
+                    rearm = True
+
+                if rearm:
+                    arm()
+
+                if overflow:
+                    entries = [(source_rel, dest_rel) for source_rel, dest_rel, desc in dotfiles]
+                else:
+                    entries = entries_for(affected)
+                if entries:
+                    self.repair(entries, force=force)
+        finally:
+            watcher.close()
+
+    @traced("rollback")
+    def rollback(self, dests=None, restore=True):
+        """Undo links made from the manifest, putting back what they replaced
+
+        Only destinations that are links into the repo, files written by the
+        renderer that were not edited since, or empty are touched. Everything
+        is decided in one pass: one status scan for the entries and one read
+        of the backup index. The newest backup of each entry is consumed by
+        the restore, renaming its blobs into place when the backup directory
+        is on the same filesystem.
+
+        Args:
+            dests: Destinations to roll back, every manifest entry if empty
+            restore: Restore backups after removing the links; False only unlinks
+
+        Returns:
+            List of result dicts with dest, action ('unlinked', 'restored',
+            'skip' or 'none'), backup id and error
+        """
+        dotfiles = get_dotfiles()
+        if dests:
+            known = {dest_rel: source_rel for source_rel, dest_rel, desc in dotfiles}
+            entries = []
+            for dest_rel in dests:
+                dest_rel = os.path.normpath(dest_rel)
+                if dest_rel in known:
+                    entries.append((known[dest_rel], dest_rel))
+                else:
+                    self.print_info(f"✗ Not in manifest: {dest_rel}", "error")
+        else:
+            entries = [(source_rel, dest_rel) for source_rel, dest_rel, desc in dotfiles]
+
+        index = self.backups.read_index() if restore else {}
+        by_original = None
+        refs = None
+        results = []
+
+        for (source_rel, dest_rel), status in zip(entries, self.status_engine.scan(entries)):
+            dest = self.home_path / dest_rel
+            result = {'dest': dest_rel, 'action': 'none', 'backup': None, 'error': None}
+            results.append(result)
+
+            tree = entry_mode(dest_rel) == 'tree'
+            if tree and status.dest_kind == KIND_DIR:
+                # Linked file by file: remove our links inside, keep the directory
+                try:
+                    for path, rel in self.tree.our_links(str(self.repo_path / source_rel), str(dest)):
+                        os.unlink(path)
+                        result['action'] = 'unlinked'
+                    if restore and self.restore_tree_backups(source_rel, dest_rel, index):
+                        result['action'] = 'restored'
+                except Exception as e:
+                    result['error'] = e
+                self.report_rollback(result, status)
+                continue
+
+            rendered = entry_mode(dest_rel) in RENDER_MODES
+            if rendered:
+                # Files written by the renderer that nobody has edited since
+                ours = status.state in (STATUS_RENDERED, STATUS_STALE) and status.dest_kind == KIND_FILE
+            else:
+                ours = status.state == STATUS_LINKED and status.dest_kind == KIND_LINK
+            if not ours and status.dest_kind is not None:
+                # A real file, or a link somewhere else: not ours to remove
+                result['action'] = 'skip'
+                self.report_rollback(result, status)
+                continue
+
+            backup_id = None
+            identical = False
+            if restore:
+                records = index.get(dest_rel)
+                if records:
+                    backup_id = records[-1]['backup']
+                    identical = records[-1]['op'] == 'identical'
+                else:
+                    # Backups made before the index existed, matched by original path
+                    if by_original is None:
+                        by_original = {}
+                        for backup in self.backups.list_backups():
+                            if backup['original']:
+                                by_original[backup['original']] = backup['id']
+                    backup_id = by_original.get(str(dest))
+
+            try:
+                if rendered and identical:
+                    # What was there before had exactly the rendered content, so
+                    # the render stands in for it (written again if deleted since)
+                    if not ours:
+                        self.renderer.write(source_rel, dest_rel, str(self.repo_path / source_rel), str(dest))
+                    self.backups.forget(backup_id)
+                    self.renderer.forget(dest_rel)
+                    result['action'] = 'restored'
+                    result['backup'] = backup_id
+                    self.report_rollback(result, status)
+                    continue
+                if ours:
+                    dest.unlink()
+                    result['action'] = 'unlinked'
+                    if rendered:
+                        self.renderer.forget(dest_rel)
+                if identical:
+                    # The replaced file was a copy of the source; copy it back
+                    shutil = lazy_import("shutil")
+                    source = self.repo_path / source_rel
+                    if source.is_dir():
+                        shutil.copytree(source, dest, symlinks=True)
+                    else:
+                        shutil.copy2(source, dest)
+                    self.backups.forget(backup_id)
+                    result['action'] = 'restored'
+                    result['backup'] = backup_id
+                elif backup_id is not None:
+                    if refs is None:
+                        refs = self.backups.blob_refcounts()
+                    self.backups.restore(backup_id, dest, move=True, refs=refs)
+                    result['action'] = 'restored'
+                    result['backup'] = backup_id
+                if tree and restore and self.restore_tree_backups(source_rel, dest_rel, index):
+                    # Files replaced inside the directory before it was folded
+                    result['action'] = 'restored'
+            except Exception as e:
+                result['error'] = e
+            if result['action'] != 'none' or result['error'] is not None:
+                self.journal.drop(dest_rel)
+            self.report_rollback(result, status)
+
+        self.renderer.save()
+        restored = sum(1 for r in results if r['action'] == 'restored')
+        unlinked = sum(1 for r in results if r['action'] == 'unlinked')
+        failed = sum(1 for r in results if r['error'] is not None)
+        if self.output_format == "ndjson":
+            self.emit({'event': 'summary', 'restored': restored, 'unlinked': unlinked,
+                       'skipped': sum(1 for r in results if r['action'] == 'skip'), 'failed': failed})
+        else:
+            skipped = sum(1 for r in results if r['action'] == 'skip')
+            self.print_info(f"\n✓ {restored} restored, {unlinked} unlinked, {skipped} left alone, {failed} failed", "success")
+        return results
+
+    def restore_tree_backups(self, source_rel, dest_rel, index):
+        """Restore what apply_tree replaced inside a tree entry, where the path is free again
+
+        Returns:
+            Number of paths restored
+        """
+        prefix = dest_rel + "/"
+        refs = None
+        restored = 0
+        # Parents first, so a restored directory wins over files inside it
+        for entry in sorted((entry for entry in index if entry.startswith(prefix)), key=len):
+            record = index[entry][-1]
+            path = self.home_path / entry
+            if os.path.lexists(path):
+                continue
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if record['op'] == 'identical':
+                lazy_import("shutil").copy2(self.repo_path / source_rel / entry[len(prefix):], path)
+                self.backups.forget(record['backup'])
+            else:
+                if refs is None:
+                    refs = self.backups.blob_refcounts()
+                self.backups.restore(record['backup'], path, move=True, refs=refs)
+            restored += 1
+        return restored
+
+    def report_rollback(self, result, status):
+        """Print the outcome of rolling back one entry"""
+        if self.output_format == "ndjson":
+            self.emit({
+                'event': 'restore',
+                'dest': result['dest'],
+                'action': result['action'],
+                'backup': result['backup'],
+                'error': str(result['error']) if result['error'] is not None else None,
+            })
+            return
+
+        dest_rel = result['dest']
+        if result['error'] is not None:
+            self.print_info(f"✗ Failed to roll back {dest_rel}: {result['error']}", "error")
+        elif result['action'] == 'restored' and result['backup'] is None:
+            # Tree entries restore several backups, one per replaced path
+            self.print_info(f"✓ Restored: {dest_rel}", "success")
+        elif result['action'] == 'restored':
+            self.print_info(f"✓ Restored: {dest_rel} from {result['backup']}", "success")
+        elif result['action'] == 'unlinked':
+            self.print_info(f"✓ Unlinked: {dest_rel}", "success")
+        elif result['action'] == 'skip':
+            self.print_info(f"⊘ Left alone: {dest_rel} ({status.label})", "warning")
 
     def link_selected(self, selections):
-        """Link selected dotfiles"""
+        """Link selected dotfiles, returning the link results"""
         if not selections:
             self.print_info("No dotfiles selected", "warning")
-            return
+            return []
 
         self.print_info(f"\nLinking {len(selections)} dotfile(s)...\n", "info")
 
         dotfiles = get_dotfiles()
-        success_count = 0
-        yes_to_all = False
-
+        entries = []
         for idx in selections:
             if 1 <= idx <= len(dotfiles):
                 source_rel, dest_rel, desc = dotfiles[idx - 1]
-                success, yes_to_all = self.create_symlink(source_rel, dest_rel, yes_to_all=yes_to_all)
-                if success:
-                    success_count += 1
-                print()  # Empty line between items
+                entries.append((source_rel, dest_rel))
+
+        results = self.link_entries(entries)
+        success_count = sum(1 for r in results if r.success)
 
         self.print_info(f"\n✓ Successfully linked {success_count}/{len(selections)} dotfiles", "success")
         if self.backup_dir.exists():
             self.print_info(f"  Backups saved to: {self.backup_dir.relative_to(self.home_path)}", "info")
+        return results
 
-    def link_all(self):
-        """Link all dotfiles"""
+    def link_all(self, force=False):
+        """Link all dotfiles, returning the link results"""
         self.print_info("\nLinking all dotfiles...\n", "info")
 
         dotfiles = get_dotfiles()
-        success_count = 0
-        yes_to_all = False
-
-        for source_rel, dest_rel, desc in dotfiles:
-            success, yes_to_all = self.create_symlink(source_rel, dest_rel, yes_to_all=yes_to_all)
-            if success:
-                success_count += 1
-            print()
+        results = self.link_entries([(source_rel, dest_rel) for source_rel, dest_rel, desc in dotfiles], force=force)
+        success_count = sum(1 for r in results if r.success)
 
         self.print_info(f"\n✓ Successfully linked {success_count}/{len(dotfiles)} dotfiles", "success")
         if self.backup_dir.exists():
             self.print_info(f"  Backups saved to: {self.backup_dir.relative_to(self.home_path)}", "info")
+        return results
 
     def interactive_mode(self):
         """Run interactive selection mode"""
@@ -375,15 +4528,26 @@ class DotfilesManager:
         self.print_info(f"Repository: {self.repo_path}", "info")
         self.print_info(f"Home: {self.home_path}\n", "info")
 
+        view = TableView()
+        model = StatusModel(self.status_engine, self.repo_path)
+        model.rescan()
+        force_render = True
+
         # Main loop - keep prompting until user quits or completes an action
         while True:
-            # List all dotfiles
-            data = self.list_dotfiles()
+            # Statuses come from the model; link results update it in place
+            data = model.rows()
+            view.render(self, data, force=force_render)
+            force_render = False
 
             print()
             self.print_info("Select dotfiles to link:", "info")
             self.print_info("  • Enter numbers separated by spaces (e.g., '1 3 5')", "info")
             self.print_info("  • Enter 'all' to link everything", "info")
+            if view.is_paged(data):
+                self.print_info("  • 'n'/'p' next/previous page, '/text' filter by path, "
+                                "'s <status>' filter by status, '/' clears, 'r' redraws", "info")
+            self.print_info("  • Enter 'rescan' to re-check every entry on disk", "info")
             self.print_info("  • Enter 'q' or 'quit' to exit\n", "info")
 
             try:
@@ -403,11 +4567,27 @@ class DotfilesManager:
                 self.print_info("No input provided. Please try again.\n", "warning")
                 continue
 
+            # Full refresh, for changes made outside this session
+            if selection == 'rescan':
+                started = time.perf_counter()
+                count = model.rescan()
+                self.print_info(f"Rescanned {count} entries in {(time.perf_counter() - started) * 1000:.1f} ms\n", "info")
+                continue
+
+            # Handle paging and filtering
+            try:
+                if view.handle(selection):
+                    force_render = True
+                    continue
+            except ValueError as e:
+                self.print_info(f"{e}\n", "error")
+                continue
+
             # Handle 'all' selection
             if selection == 'all':
                 try:
                     if self.confirm("\nLink all dotfiles?", default=True):
-                        self.link_all()
+                        model.update(self.link_all())
                         print()
                         # Ask if user wants to continue
                         if not self.confirm("Manage more dotfiles?", default=False):
@@ -435,7 +4615,7 @@ class DotfilesManager:
 
                 try:
                     if self.confirm(f"\nLink {len(selections)} selected dotfile(s)?", default=True):
-                        self.link_selected(selections)
+                        model.update(self.link_selected(selections))
                         print()
                         # Ask if user wants to continue
                         if not self.confirm("Manage more dotfiles?", default=False):
@@ -451,8 +4631,136 @@ class DotfilesManager:
             except ValueError:
                 self.print_info("Invalid input. Please enter numbers separated by spaces, 'all', or 'q' to quit.\n", "error")
 
+def read_home_roots(values):
+    """Expand --home values into a list of target roots
+
+    Each value may be a single path, a comma-separated list of paths, or
+    @FILE naming a file with one root per line (blank lines and # comments
+    are ignored). Duplicates are dropped, keeping the first occurrence.
+    """
+    roots = []
+    for value in values:
+        if value.startswith("@"):
+            try:
+                with open(os.path.expanduser(value[1:])) as f:
+                    lines = f.read().splitlines()
+            except OSError as e:
+                print(f"Error: Cannot read home list {value[1:]}: {e.strerror}")
+                sys.exit(1)
+            candidates = [line.split("#", 1)[0].strip() for line in lines]
+        else:
+            candidates = value.split(",")
+        for candidate in candidates:
+            if candidate.strip():
+                roots.append(os.path.abspath(os.path.expanduser(candidate.strip())))
+    return list(dict.fromkeys(roots))
+
+def _init_home_worker(dotfiles, settings):
+    """Process pool initializer: share the already expanded manifest"""
+    global DOTFILES, MANIFEST_SETTINGS
+    DOTFILES = dotfiles
+    MANIFEST_SETTINGS = settings
+
+def _apply_home(home, force, jobs):
+    """Apply the manifest to one root inside a worker process
+
+    Returns:
+        Summary dict for the root, with 'home', 'error' and the failed entries
+    """
+    started = time.perf_counter()
+    if not os.path.isdir(home):
+        return {'event': 'home', 'home': home, 'error': "not a directory", 'failures': [],
+                'elapsed_ms': 0.0}
+
+    # No terminal in a worker: drive the engine directly and keep only what
+    # the parent reports
+    engine = Dotfiles(jobs=jobs, home_path=home)
+    summary = {}
+    failures = []
+    try:
+        for event in engine.apply(LinkPolicy(replace=force)):
+            if isinstance(event, LinkEvent) and event.error is not None:
+                failures.append({'dest': event.dest, 'error': str(event.error)})
+            elif isinstance(event, SummaryEvent):
+                summary = event.to_record()
+        error = None
+    except Exception as e:
+        summary = {}
+        error = str(e)
+
+    summary.update({
+        'event': 'home',
+        'home': home,
+        'error': error,
+        'failures': failures,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+    })
+    return summary
+
+def apply_homes(homes, force=False, processes=None, jobs=1, output_format="table"):
+    """Apply the manifest to many target roots using a process pool
+
+    The manifest is loaded and expanded once in this process and handed to
+    every worker. Each root gets its own journal and backup store, exactly as
+    if `--apply` had been run with HOME pointing at it.
+
+    Returns:
+        List of per-root summary dicts, in the order the roots were given
+    """
+    started = time.perf_counter()
+    dotfiles = get_dotfiles()
+    processes = max(1, min(processes or os.cpu_count() or 1, len(homes)))
+    futures_mod = lazy_import("concurrent.futures")
+
+    def report(summary):
+        if output_format == "ndjson":
+            sys.stdout.write(lazy_import("json").dumps(summary, ensure_ascii=False, separators=(',', ':')) + "\n")
+            sys.stdout.flush()
+        elif summary['error']:
+            print(f"✗ {summary['home']}: {summary['error']}")
+        else:
+            mark = "✗" if summary['failed'] else ("⚠" if summary['skipped'] else "✓")
+            print(f"{mark} {summary['home']}: {summary['linked']} linked, {summary['unchanged']} unchanged, "
+                  f"{summary['skipped']} skipped, {summary['failed']} failed ({summary['elapsed_ms']:.1f} ms)")
+            for failure in summary['failures']:
+                print(f"    {failure['dest']}: {failure['error']}")
+
+    if output_format != "ndjson":
+        print(f"Applying {len(dotfiles)} dotfiles to {len(homes)} roots using {processes} process(es)...")
+
+    summaries = [None] * len(homes)
+    with futures_mod.ProcessPoolExecutor(max_workers=processes, initializer=_init_home_worker,
+                                         initargs=(dotfiles, MANIFEST_SETTINGS)) as pool:
+        futures = {pool.submit(_apply_home, home, force, jobs): pos for pos, home in enumerate(homes)}
+        for future in futures_mod.as_completed(futures):
+            pos = futures[future]
+            try:
+                summaries[pos] = future.result()
+            except Exception as e:
+                summaries[pos] = {'event': 'home', 'home': homes[pos], 'error': str(e), 'failures': [],
+                                  'elapsed_ms': 0.0}
+            report(summaries[pos])
+
+    elapsed = time.perf_counter() - started
+    failed = sum(1 for summary in summaries if summary['error'] or summary.get('failed'))
+    totals = {
+        'event': 'total',
+        'homes': len(homes),
+        'failed_homes': failed,
+        'linked': sum(summary.get('linked', 0) for summary in summaries),
+        'skipped': sum(summary.get('skipped', 0) for summary in summaries),
+        'elapsed_ms': round(elapsed * 1000, 3),
+    }
+    if output_format == "ndjson":
+        report(totals)
+    else:
+        print(f"\nDone: {len(homes) - failed}/{len(homes)} roots without failures, "
+              f"{totals['linked']} entries linked, {totals['skipped']} skipped, in {elapsed:.2f} s")
+    return summaries
+
 def install_dependencies():
     """Install Python dependencies (PyYAML and Rich) in a local virtual environment"""
+    subprocess = lazy_import("subprocess")
     print("Installing dependencies...")
     print()
 
@@ -512,6 +4820,7 @@ def install_dependencies():
 
 def install_with_pip_user():
     """Fallback: Install dependencies using pip --user"""
+    subprocess = lazy_import("subprocess")
     try:
         # Try pip3 first, then pip
         pip_cmd = None
@@ -549,22 +4858,85 @@ def install_with_pip_user():
         print(f"✗ Error installing dependencies: {e}")
         return False
 
+def get_option(args, *names, default=None):
+    """Return the value following the first of the given option names, if present"""
+    for name in names:
+        if name in args:
+            idx = args.index(name)
+            if idx + 1 < len(args):
+                return args[idx + 1]
+            print(f"Error: {name} requires a value")
+            sys.exit(1)
+    return default
+
+def get_options(args, *names):
+    """Return the values following every occurrence of the given option names"""
+    values = []
+    for idx, arg in enumerate(args):
+        if arg in names:
+            if idx + 1 >= len(args):
+                print(f"Error: {arg} requires a value")
+                sys.exit(1)
+            values.append(args[idx + 1])
+    return values
+
 def main(args):
     """Main entry point"""
 
+    # Report import versus work time when the process exits
+    if "--startup-profile" in args:
+        lazy_import("atexit").register(print_startup_profile)
+
+    # Record phase timings and write a Chrome trace when the process exits
+    trace_path = get_option(args, "--trace")
+    if trace_path is not None:
+        global TRACER
+        TRACER = Tracer(trace_path)
+        lazy_import("atexit").register(lambda: (TRACER.write(), TRACER.print_summary()))
+
     # Handle help first
     if "--help" in args or "-h" in args:
         print("Usage: python3 dotfiles.py [options]")
         print()
         print("Options:")
         print("  -l, --link         Interactive mode to create symlinks")
+        print("  --status           Show the status of every dotfile and exit")
+        print("  --apply            Link only entries that changed since the last apply")
+        print("  --format FORMAT    Output for --status/--apply: table (default) or ndjson,")
+        print("                     one JSON record per entry streamed as it is evaluated")
+        print("  --watch            Watch destinations and manifest.yaml (inotify, Linux) and")
+        print("                     relink entries as soon as they drift")
+        print("  -y, --yes          With --apply/--watch, back up and replace existing files without asking")
+        print("  --restore          Remove links and put back the newest backup of each entry")
+        print("  --unlink           Remove links without restoring anything")
+        print("  --entry DEST       Limit --restore/--unlink to one destination (repeatable)")
+        print("  -j, --jobs N       Number of dotfiles to link in parallel (default: %d)" % DEFAULT_JOBS)
+        print("  --home PATH        Target root instead of ~. Repeat it, separate paths with")
+        print("                     commas or pass @FILE (one root per line) to apply to many")
+        print("                     roots at once in a process pool")
+        print("  --processes N      Worker processes for several --home roots (default: CPU count)")
         print("  --install-deps     Install Python dependencies (PyYAML and Rich)")
+        print("  --list-backups     List backups kept in ~/.dotfiles-backup")
+        print("  --gc-backups       Evict backups beyond the retention policy in manifest.yaml")
+        print("  --tasks            Run the setup tasks from manifest.yaml (after linking with")
+        print("                     --apply), skipping tasks whose inputs are unchanged")
+        print("  --task NAME        Run only this task and the ones it needs (repeatable)")
+        print("  --rerun            With --tasks/--task, run tasks even if nothing changed")
+        print("  -n, --dry-run      With --gc-backups or --tasks, only report what would happen")
+        print("  --rebuild-cache    Re-parse manifest.yaml and rewrite the compiled manifest cache")
+        print("  --startup-profile  Report time spent in imports versus real work on exit")
+        print("  --trace FILE       Write a Chrome trace of manifest loading, status checks,")
+        print("                     backups and linking to FILE, and print per-phase totals")
         print("  -h, --help         Show this help message")
         print()
         print("Without options, runs in interactive mode by default.")
         print()
+        print("For login hooks and provisioning loops, 'python3 -m dotfiles' (run from the")
+        print("repo or with it on PYTHONPATH) reuses cached bytecode and starts faster.")
+        print()
         print("Dependencies:")
-        print("  PyYAML - Required to read manifest.yaml configuration")
+        print("  PyYAML - Optional; manifest.yaml is read with a built-in parser for the")
+        print("           subset of YAML it uses when PyYAML is not installed")
         print("  Rich   - Optional for enhanced TUI with colors and tables")
         return
 
@@ -572,19 +4944,18 @@ def main(args):
     if "--install-deps" in args or "--install" in args:
         return install_dependencies()
 
-    # Check if dependencies are available and offer to install them (only in interactive mode)
-    missing_deps = []
-    if not HAS_YAML:
-        missing_deps.append("PyYAML (required)")
-    if not HAS_RICH:
-        missing_deps.append("Rich (optional)")
-
-    if missing_deps and (not args or len(args) == 1 or "--link" in args or "-l" in args):
-        print(f"Note: Missing dependencies: {', '.join(missing_deps)}")
-        if not HAS_YAML:
-            print("  • PyYAML is required to read the manifest.yaml configuration file")
-        if not HAS_RICH:
-            print("  • Rich provides colorful output, tables, and better prompts (optional)")
+    # Handle manifest cache rebuild
+    if "--rebuild-cache" in args:
+        dotfiles = get_dotfiles(rebuild_cache=True)
+        print(f"Rebuilt manifest cache with {len(dotfiles)} entries: {MANIFEST_CACHE_FILE.name}")
+        return
+
+    # Check if Rich is available and offer to install it (only in interactive
+    # mode, so scripted commands never load Rich just to check). PyYAML is not
+    # needed: manifest.yaml is read with the built-in parser when it is missing
+    if (not args or len(args) == 1 or "--link" in args or "-l" in args) and not has_rich():
+        print("Note: Missing dependencies: Rich (optional)")
+        print("  • Rich provides colorful output, tables, and better prompts (optional)")
         print()
 
         # Ask if user wants to install them
@@ -594,30 +4965,107 @@ def main(args):
                 if install_dependencies():
                     print("Run the script again to continue.")
                     return
-                else:
-                    if not HAS_YAML:
-                        print("Error: PyYAML is required. Cannot continue without it.")
-                        sys.exit(1)
-                    print("Continuing in basic mode...")
-                    print()
+                print("Continuing in basic mode...")
+                print()
             else:
-                if not HAS_YAML:
-                    print("Error: PyYAML is required. Install with: python3 dotfiles.py --install-deps")
-                    sys.exit(1)
                 print("Continuing in basic mode...")
                 print("(You can install dependencies later with: python3 dotfiles.py --install-deps)")
                 print()
         except EOFError:
             # Handle piped input or non-interactive mode
             print()
-            if not HAS_YAML:
-                print("Error: PyYAML is required. Install with: python3 dotfiles.py --install-deps")
-                sys.exit(1)
             print("Running in non-interactive mode...")
             print("(Install dependencies with: python3 dotfiles.py --install-deps)")
             print()
 
-    manager = DotfilesManager()
+    jobs = get_option(args, "--jobs", "-j")
+    if jobs is not None:
+        try:
+            jobs = int(jobs)
+        except ValueError:
+            print(f"Error: --jobs expects a number, got: {jobs}")
+            sys.exit(1)
+
+    output_format = get_option(args, "--format", default="table")
+    if output_format not in ("table", "ndjson"):
+        print(f"Error: --format must be 'table' or 'ndjson', got: {output_format}")
+        sys.exit(1)
+
+    homes = read_home_roots(get_options(args, "--home"))
+    if len(homes) > 1:
+        # Bulk deployment: only --apply makes sense across many roots
+        if "--apply" not in args:
+            print("Error: several --home roots can only be used with --apply")
+            sys.exit(1)
+        for flag in ("--status", "--watch", "--tasks", "--task", "--list-backups",
+                     "--restore", "--unlink", "--entry", "--gc-backups", "--dry-run", "-n"):
+            if flag in args:
+                print(f"Error: {flag} takes a single --home")
+                sys.exit(1)
+        processes = get_option(args, "--processes")
+        try:
+            processes = int(processes) if processes is not None else None
+        except ValueError:
+            print(f"Error: --processes expects a number, got: {processes}")
+            sys.exit(1)
+        summaries = apply_homes(homes, force="--yes" in args or "-y" in args, processes=processes,
+                                jobs=jobs or 1, output_format=output_format)
+        if any(summary['error'] or summary.get('failed') for summary in summaries):
+            sys.exit(1)
+        return
+
+    manager = DotfilesManager(jobs=jobs, home_path=homes[0] if homes else None)
+    manager.output_format = output_format
+
+    # Handle backup listing
+    if "--list-backups" in args:
+        manager.list_backups()
+        return
+
+    # Status listing without the interactive prompt
+    if "--status" in args:
+        if output_format == "ndjson":
+            manager.stream_status()
+        else:
+            manager.list_dotfiles()
+        return
+
+    # Incremental, non-interactive apply
+    if "--apply" in args:
+        yes = "--yes" in args or "-y" in args
+        if not yes and (output_format == "ndjson" or not sys.stdin.isatty()):
+            # Nobody to ask (or stdout is reserved for records); leave conflicting files alone
+            manager.non_interactive = True
+        manager.apply(force=yes)
+        if "--tasks" not in args and "--task" not in args:
+            return
+
+    # Setup tasks, after linking when combined with --apply
+    if "--tasks" in args or "--task" in args:
+        results = manager.run_tasks(get_options(args, "--task"), rerun="--rerun" in args,
+                                    dry_run="--dry-run" in args or "-n" in args)
+        if any(event.state in ('failed', 'blocked') for event in results):
+            sys.exit(1)
+        return
+
+    # Undo links, optionally restoring the files they replaced
+    if "--restore" in args or "--unlink" in args:
+        results = manager.rollback(get_options(args, "--entry"), restore="--restore" in args)
+        if any(r['error'] is not None for r in results):
+            sys.exit(1)
+        return
+
+    # Apply the backup retention policy
+    if "--gc-backups" in args:
+        manager.gc_backups(dry_run="--dry-run" in args or "-n" in args)
+        return
+
+    # Daemon that repairs link drift as it happens
+    if "--watch" in args:
+        # Never prompt from a daemon; replaced files are only overwritten with --yes
+        manager.non_interactive = True
+        manager.watch(force="--yes" in args or "-y" in args)
+        return
 
     # Parse arguments
     if "--link" in args or "-l" in args:
@@ -632,3 +5080,7 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         print("\n\nInterrupted by user")
         sys.exit(1)
+    except BrokenPipeError:
+        # Streamed output was piped into something that stopped reading (e.g. head)
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
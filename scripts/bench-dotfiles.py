@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# bench-dotfiles.py
+#   Benchmarks the hot paths of dotfiles.py (manifest loading and parsing,
+#   listing, linking, applying through the TUI and the library layer, backups,
+#   restores, rollbacks and template rendering) against synthetic
+#   repositories with 10 to 50,000 entries, deep directory trees and
+#   pre-existing conflicting files, all inside a temporary fake home.
+#   Results are written as JSON so runs from different commits can be
+#   compared.
+#
+# Usage
+#   python3 scripts/bench-dotfiles.py [--sizes 10,100,1000] [--depth 4]
+#       [--conflicts 0.25] [--repeat 3] [--output results.json]
+#   python3 scripts/bench-dotfiles.py --compare before.json after.json
+#
+# License
+#   MIT
+
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import platform
+import tempfile
+import subprocess
+import contextlib
+import importlib.util
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+
+def load_dotfiles_module():
+    """Import dotfiles.py from the repository root as a module"""
+    spec = importlib.util.spec_from_file_location("dotfiles", REPO_DIR / "dotfiles.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["dotfiles"] = module
+    spec.loader.exec_module(module)
+    return module
+
+def entry_path(idx, depth):
+    """Relative path of synthetic entry idx, nested depth directories deep"""
+    parts = [f"d{(idx >> (3 * level)) % 8}" for level in range(depth)]
+    return "/".join(parts + [f"entry{idx}"])
+
+def write_manifest(root, entries, template=False):
+    """Write manifest.yaml for entries, rendering every file entry as a template if asked"""
+    lines = ["dotfiles:"]
+    for idx, (rel, is_dir) in enumerate(entries):
+        lines.append(f"  - source: {rel}")
+        lines.append(f"    dest: {rel}")
+        lines.append(f"    description: Synthetic entry {idx}")
+        if template and not is_dir:
+            lines.append("    mode: template")
+    if template:
+        lines.extend(["variables:", "  font: DejaVu Sans Mono", "  size: 10"])
+    (root / "manifest.yaml").write_text("\n".join(lines) + "\n")
+
+def generate_repo(root, size, depth, dir_ratio=0.2, seed=0):
+    """Create a synthetic repo with size entries and its manifest.yaml
+
+    Returns:
+        List of (relative path, is_dir) tuples
+    """
+    rng = random.Random(seed)
+    entries = []
+    for idx in range(size):
+        rel = entry_path(idx, depth)
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        is_dir = rng.random() < dir_ratio
+        if is_dir:
+            # Small config directories with a nested level, like .config/i3
+            (path / "sub").mkdir(parents=True, exist_ok=True)
+            for n in range(3):
+                (path / f"file{n}.conf").write_text(f"{rel} {n}\n" * 20)
+            (path / "sub" / "nested.conf").write_text(f"{rel} nested\n")
+        else:
+            path.write_text(f"# {rel}\n" * 40 + "font = {{ font }} {{ size }}\n")
+        entries.append((rel, is_dir))
+
+    write_manifest(root, entries)
+    return entries
+
+def generate_home(home, repo, entries, conflicts, seed=1):
+    """Populate a fresh fake home, with a fraction of destinations already taken"""
+    if home.exists():
+        shutil.rmtree(home)
+    home.mkdir(parents=True)
+    rng = random.Random(seed)
+    for rel, is_dir in entries:
+        if rng.random() >= conflicts:
+            continue
+        dest = home / rel
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        if is_dir:
+            shutil.copytree(repo / rel, dest)
+        else:
+            dest.write_text("locally edited copy\n")
+
+def timed(func, repeat, setup=None):
+    """Run func repeat times and return the fastest wall-clock time in seconds"""
+    best = None
+    for _ in range(repeat):
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            if setup is not None:
+                setup()
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_size(dotfiles, workdir, size, depth, conflicts, repeat, jobs):
+    """Benchmark every path for one manifest size and return result records"""
+    repo = workdir / f"repo-{size}"
+    home = workdir / f"home-{size}"
+    repo.mkdir()
+    entries = generate_repo(repo, size, depth)
+
+    # Point the module at the synthetic manifest
+    dotfiles.MANIFEST_FILE = repo / "manifest.yaml"
+    dotfiles.MANIFEST_CACHE_FILE = repo / ".manifest.cache"
+    dotfiles.MANIFEST_INDEX_FILE = repo / ".manifest.index"
+    dotfiles.DOTFILES = None
+
+    def manager():
+        return dotfiles.DotfilesManager(jobs=jobs, repo_path=repo, home_path=home)
+
+    def fresh_home():
+        generate_home(home, repo, entries, conflicts)
+
+    results = {}
+
+    results["load_manifest_parse"] = timed(
+        lambda: dotfiles.load_dotfiles_manifest(rebuild_cache=True), repeat)
+    results["load_manifest_cached"] = timed(
+        lambda: dotfiles.load_dotfiles_manifest(), repeat)
+
+    # The built-in parser against PyYAML on the same text
+    text = (repo / "manifest.yaml").read_text()
+    results["parse_builtin"] = timed(lambda: dotfiles.parse_yaml_subset(text), repeat)
+    try:
+        import yaml
+    except ImportError:
+        yaml = None
+    if yaml is not None:
+        results["parse_pyyaml"] = timed(lambda: yaml.safe_load(text), repeat)
+        if getattr(yaml, "CSafeLoader", None) is not None:
+            results["parse_pyyaml_libyaml"] = timed(lambda: yaml.load(text, Loader=yaml.CSafeLoader), repeat)
+    manifest = dotfiles.get_dotfiles(rebuild_cache=True)
+
+    fresh_home()
+    results["list_dotfiles"] = timed(lambda: manager().list_dotfiles(), repeat)
+
+    def create_each():
+        m = manager()
+        for source_rel, dest_rel, desc in manifest:
+            m.create_symlink(source_rel, dest_rel, force=True)
+    results["create_symlink_serial"] = timed(create_each, repeat, setup=fresh_home)
+
+    results["link_all"] = timed(lambda: manager().link_all(force=True), repeat, setup=fresh_home)
+
+    # A first apply through the TUI, then the same events consumed straight
+    # from the library layer with nothing printed
+    results["apply"] = timed(lambda: manager().apply(force=True), repeat, setup=fresh_home)
+
+    def apply_library():
+        engine = dotfiles.Dotfiles(jobs=jobs, repo_path=repo, home_path=home)
+        for event in engine.apply(dotfiles.LinkPolicy(replace=True)):
+            pass
+    results["apply_library"] = timed(apply_library, repeat, setup=fresh_home)
+
+    results["apply_noop"] = timed(lambda: manager().apply(force=True), repeat,
+                                  setup=lambda: manager().apply(force=True))
+
+    def backup_conflicts():
+        engine = manager().engine
+        for rel, is_dir in entries:
+            path = home / rel
+            if path.exists() and not path.is_symlink():
+                engine.backup_file(path)
+
+    def reset_backups():
+        fresh_home()
+
+    results["backup_file"] = timed(backup_conflicts, repeat, setup=reset_backups)
+
+    # Restores go to a scratch directory so every repeat starts from nothing
+    restore_root = workdir / f"restore-{size}"
+
+    def clear_restores():
+        if restore_root.exists():
+            shutil.rmtree(restore_root)
+        restore_root.mkdir()
+
+    def restore_all():
+        store = manager().backups
+        for n, backup in enumerate(store.list_backups()):
+            store.restore(backup['id'], restore_root / str(n))
+
+    results["restore"] = timed(restore_all, repeat, setup=clear_restores)
+
+    def linked_home():
+        fresh_home()
+        manager().link_all(force=True)
+
+    results["rollback"] = timed(lambda: manager().rollback(), repeat, setup=linked_home)
+
+    # The same entries rendered from templates: a first apply, then one with nothing to do
+    write_manifest(repo, entries, template=True)
+    dotfiles.DOTFILES = None
+    dotfiles.get_dotfiles(rebuild_cache=True)
+    results["apply_render"] = timed(lambda: manager().apply(force=True), repeat, setup=fresh_home)
+    results["apply_noop_templates"] = timed(lambda: manager().apply(force=True), repeat,
+                                            setup=lambda: manager().apply(force=True))
+
+    shutil.rmtree(repo)
+    shutil.rmtree(home, ignore_errors=True)
+    shutil.rmtree(restore_root, ignore_errors=True)
+
+    return [
+        {
+            "size": size,
+            "phase": phase,
+            "seconds": seconds,
+            "us_per_entry": seconds / size * 1e6,
+        }
+        for phase, seconds in results.items()
+    ]
+
+def git_commit():
+    """Current commit of the repo, if git is available"""
+    try:
+        result = subprocess.run(["git", "-C", str(REPO_DIR), "rev-parse", "--short", "HEAD"],
+                                capture_output=True, text=True, timeout=5)
+        return result.stdout.strip() or None
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+def compare(before_path, after_path):
+    """Print per-phase speedups between two result files"""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    old = {(r["size"], r["phase"]): r["seconds"] for r in before["results"]}
+    print(f"{'size':>7}  {'phase':24} {'before':>12} {'after':>12} {'speedup':>8}")
+    for record in after["results"]:
+        key = (record["size"], record["phase"])
+        if key not in old:
+            continue
+        ratio = old[key] / record["seconds"] if record["seconds"] else float("inf")
+        print(f"{record['size']:>7}  {record['phase']:24} {old[key] * 1000:10.2f}ms "
+              f"{record['seconds'] * 1000:10.2f}ms {ratio:7.2f}x")
+
+def main(args):
+    """Main entry point"""
+    if "--help" in args or "-h" in args:
+        print("Usage: python3 scripts/bench-dotfiles.py [options]")
+        print()
+        print("Options:")
+        print("  --sizes N,N,...     Manifest sizes to benchmark (default: %s)" % ",".join(map(str, DEFAULT_SIZES)))
+        print("  --depth N           Directory depth of each entry (default: 4)")
+        print("  --conflicts F       Fraction of destinations that already exist (default: 0.25)")
+        print("  --repeat N          Runs per measurement, the fastest is kept (default: 3)")
+        print("  --jobs N            Worker threads for linking (default: dotfiles.py default)")
+        print("  --output FILE       Write JSON results to FILE instead of stdout")
+        print("  --compare OLD NEW   Compare two result files")
+        return
+
+    if "--compare" in args:
+        idx = args.index("--compare")
+        return compare(args[idx + 1], args[idx + 2])
+
+    def option(name, default):
+        if name in args:
+            return args[args.index(name) + 1]
+        return default
+
+    sizes = [int(n) for n in option("--sizes", ",".join(map(str, DEFAULT_SIZES))).split(",")]
+    depth = int(option("--depth", 4))
+    conflicts = float(option("--conflicts", 0.25))
+    repeat = int(option("--repeat", 3))
+    jobs = option("--jobs", None)
+    jobs = int(jobs) if jobs else None
+    output = option("--output", None)
+
+    dotfiles = load_dotfiles_module()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="dotfiles-bench-") as tmp:
+        workdir = Path(tmp)
+        for size in sizes:
+            print(f"Benchmarking {size} entries...", file=sys.stderr)
+            results.extend(bench_size(dotfiles, workdir, size, depth, conflicts, repeat, jobs))
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "depth": depth,
+            "conflicts": conflicts,
+            "repeat": repeat,
+            "jobs": jobs or dotfiles.DEFAULT_JOBS,
+        },
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if output:
+        Path(output).write_text(text + "\n")
+        print(f"Wrote {output}", file=sys.stderr)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
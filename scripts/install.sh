@@ -2,9 +2,9 @@
 
 # AppImage Launcher
 chmod +x $HOME/.dotfiles/scripts/appimage-launcher.sh
-ln -s $HOME/.dotfiles/scripts/appimage-launcher.sh /usr/bin/appimage-launcher
+ln -sf $HOME/.dotfiles/scripts/appimage-launcher.sh /usr/bin/appimage-launcher
 
 # Screen Layout Selector
 chmod +x $HOME/.dotfiles/scripts/screen-layout-selector.sh
-ln -s $HOME/.dotfiles/scripts/screen-layout-selector.sh /usr/bin/screen-layout-selector
+ln -sf $HOME/.dotfiles/scripts/screen-layout-selector.sh /usr/bin/screen-layout-selector
 
@@ -1,14 +1,57 @@
 # Konstantin Zaremski
 #   September 11, 2023
-# 
+#
 # ThinkPadHotspot.py
 #   This program manages the hostapd hotspot service to rebroadcast the internet connection
 #   from the system through the built-in ASUS Wi-Fi adapter.
+#
+#   Bring-up is built as a plan of stages. Commands inside a stage do not depend on each
+#   other and run concurrently, all firewall rules go in as one iptables-restore
+#   transaction, and smb is restarted as soon as the access point interface is actually up
+#   instead of after a fixed delay. Every command goes through an executor, so the same
+#   plan can run against a fake backend (--fake) to measure bring-up latency without root.
+#
+#   The plan is a diff: the current ruleset, addresses and forwarding setting are read once
+#   and only what is missing gets applied, so toggling the hotspot never piles up duplicate
+#   rules. What --enable added is recorded in STATE_FILE and --disable removes exactly that.
+#
+#   --monitor samples interface counters, conntrack usage and dnsmasq leases at a fixed
+#   interval and shows rates as a refreshing view or an NDJSON stream.
 
 # Import dependencies
+import abc
+import os
 import sys
-import subprocess
+import json
 import time
+import tempfile
+import threading
+import ipaddress
+import subprocess
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+# Interfaces and addressing, find the interface names with `ip link`
+AP_INTERFACE = "wlp0s26u1u4"
+WAN_INTERFACE = "wlp3s0"
+AP_ADDRESS = "192.168.10.10/24"
+
+# How long to wait for the access point interface to come up before restarting smb
+READY_TIMEOUT = 10.0
+READY_INTERVAL = 0.05
+
+# What --enable changed, for --disable to undo (lives in /run so it goes away on reboot,
+# together with the rules it describes)
+STATE_FILE = "/run/thinkpad-hotspot.json"
+
+# Monitor defaults, the proc root can point at fixture files instead
+PROC_ROOT = "/proc"
+LEASES_FILE = "/var/lib/misc/dnsmasq.leases"
+MONITOR_INTERVAL = 1.0
+MONITOR_WINDOW = 60
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+MONITOR_USAGE = ("Usage: thinkpad-hotspot.py --monitor [--interval SECONDS] [--count SAMPLES] "
+                 "[--format text|ndjson] [--proc-root DIR] [--leases FILE]")
 
 # Menu Method
 def menuInput(prompt, items):
@@ -20,57 +63,726 @@ def menuInput(prompt, items):
 
     print("")
 
+# Command executors
+class Executor(abc.ABC):
+    """Runs commands for a plan and records how long each one took"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.log = []
+        self.lock = threading.Lock()
+
+    def run(self, argv, input=None):
+        """Run one command, returning a subprocess.CompletedProcess"""
+        start = time.perf_counter()
+        result = self.execute(argv, input)
+        end = time.perf_counter()
+        with self.lock:
+            self.log.append((start - self.started, end - start, argv, result.returncode))
+        return result
+
+    @abc.abstractmethod
+    def execute(self, argv, input):
+        """Run argv with input on stdin, returning a subprocess.CompletedProcess"""
+
+    def close(self):
+        pass
+
+class SubprocessExecutor(Executor):
+    """Runs commands for real, without a shell"""
+
+    def execute(self, argv, input):
+        try:
+            return subprocess.run(argv, input=input, capture_output=True, text=True)
+        except OSError as e:
+            return subprocess.CompletedProcess(argv, 127, "", str(e))
+
+class FakeExecutor(Executor):
+    """Simulates the commands a plan runs, for timing bring-up without root
+
+    Each command sleeps for a latency looked up by its program name (or the
+    program and first argument, e.g. "systemctl start"). The state the
+    commands read and change (interface flags and addresses, forwarding,
+    the iptables ruleset, whether hostapd runs) is simulated as well and
+    kept in worldFile between runs, so repeated --fake toggles behave like
+    repeated real ones. The link only reports UP once hostapd has started
+    and CARRIER_DELAY has passed.
+    """
+
+    LATENCY = {
+        "nmcli": 0.08,
+        "ip": 0.005,
+        "sysctl": 0.005,
+        "iptables-save": 0.01,
+        "iptables-restore": 0.03,
+        "systemctl start": 0.25,
+        "systemctl restart": 0.4,
+        "systemctl stop": 0.15,
+    }
+    CARRIER_DELAY = 0.3
+
+    def __init__(self, worldFile=None, latency=None):
+        super().__init__()
+        self.latency = dict(self.LATENCY, **(latency or {}))
+        self.worldFile = worldFile
+        self.world = {"linkUp": False, "addresses": [], "forwarding": "0", "hostapd": False,
+                      "tables": {"nat": {"POSTROUTING": []}, "filter": {"INPUT": [], "FORWARD": []}}}
+        if worldFile and os.path.exists(worldFile):
+            with open(worldFile) as f:
+                self.world = json.load(f)
+        self.carrierAt = None
+
+    def delay(self, argv):
+        if len(argv) > 1 and f"{argv[0]} {argv[1]}" in self.latency:
+            return self.latency[f"{argv[0]} {argv[1]}"]
+        return self.latency.get(argv[0], 0.0)
+
+    def execute(self, argv, input):
+        time.sleep(self.delay(argv))
+        world = self.world
+        with self.lock:
+            if argv[:3] == ["ip", "link", "set"]:
+                world["linkUp"] = "up" in argv
+            elif argv[:3] == ["ip", "addr", "add"] and argv[3] not in world["addresses"]:
+                world["addresses"].append(argv[3])
+            elif argv[:3] == ["ip", "addr", "del"] and argv[3] in world["addresses"]:
+                world["addresses"].remove(argv[3])
+            elif argv[:3] == ["ip", "-j", "addr"]:
+                return subprocess.CompletedProcess(argv, 0, json.dumps([self.interfaceState()]), "")
+            elif argv[:2] == ["sysctl", "-n"]:
+                return subprocess.CompletedProcess(argv, 0, world["forwarding"] + "\n", "")
+            elif argv[:2] == ["sysctl", "-w"]:
+                world["forwarding"] = argv[2].split("=", 1)[1]
+            elif argv[0] == "iptables-save":
+                return subprocess.CompletedProcess(argv, 0, self.saveRules(), "")
+            elif argv[0] == "iptables-restore":
+                return self.restoreRules(argv, input)
+            elif argv[:2] == ["systemctl", "start"] and "hostapd.service" in argv:
+                if not world["hostapd"]:
+                    world["hostapd"] = True
+                    self.carrierAt = time.perf_counter() + self.CARRIER_DELAY
+            elif argv[:2] == ["systemctl", "stop"] and "hostapd.service" in argv:
+                world["hostapd"] = False
+        return subprocess.CompletedProcess(argv, 0, "", "")
+
+    def interfaceState(self):
+        """The interface as `ip -j addr show` would describe it"""
+        world = self.world
+        carrier = world["hostapd"] and (self.carrierAt is None or time.perf_counter() >= self.carrierAt)
+        flags = ["BROADCAST", "MULTICAST"] + (["UP"] if world["linkUp"] else [])
+        if world["linkUp"] and carrier:
+            flags.append("LOWER_UP")
+        return {
+            "ifname": AP_INTERFACE,
+            "flags": flags,
+            "operstate": "UP" if world["linkUp"] and carrier else "DOWN",
+            "addr_info": [{"family": "inet", "local": a.split("/")[0], "prefixlen": int(a.split("/")[1])}
+                          for a in world["addresses"]],
+        }
+
+    def saveRules(self):
+        lines = []
+        for table, chains in self.world["tables"].items():
+            lines.append(f"*{table}")
+            lines.extend(f":{chain} ACCEPT [0:0]" for chain in chains)
+            for chain, rules in chains.items():
+                lines.extend(f"-A {chain} {spec}" for spec in rules)
+            lines.append("COMMIT")
+        return "\n".join(lines) + "\n"
+
+    def restoreRules(self, argv, text):
+        # Work on a copy so a failing transaction changes nothing, like the real one
+        tables = json.loads(json.dumps(self.world["tables"]))
+        table = None
+        for line in text.splitlines():
+            if line.startswith("*"):
+                table = tables.setdefault(line[1:], {})
+            elif line[:3] in ("-A ", "-I ", "-D "):
+                op, chain, spec = line.split(" ", 2)
+                rules = table.setdefault(chain, [])
+                if op == "-A":
+                    rules.append(spec)
+                elif op == "-I":
+                    rules.insert(0, spec)
+                elif spec in rules:
+                    rules.remove(spec)
+                else:
+                    return subprocess.CompletedProcess(argv, 1, "", f"iptables-restore: {line}: Bad rule")
+        self.world["tables"] = tables
+        return subprocess.CompletedProcess(argv, 0, "", "")
+
+    def close(self):
+        if self.worldFile:
+            writeJson(self.worldFile, self.world)
+
+def writeJson(path, data):
+    """Write a JSON file atomically"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".hotspot-")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+# Current state
+def desiredRules():
+    """(table, chain, spec, insert) for every rule the hotspot needs
+
+    Specs are written the way iptables-save prints them, so they can be
+    compared against the saved ruleset as plain strings.
+    """
+    clients = ipaddress.ip_interface(AP_ADDRESS).network
+    return [
+        # NAT forwarding
+        ("nat", "POSTROUTING", f"-o {WAN_INTERFACE} -j MASQUERADE", False),
+        ("filter", "FORWARD", "-m conntrack --ctstate RELATED,ESTABLISHED -j ACCEPT", False),
+        ("filter", "FORWARD", f"-i {AP_INTERFACE} -o {WAN_INTERFACE} -j ACCEPT", False),
+        # DHCP and DNS from hotspot clients, ahead of anything else in INPUT
+        ("filter", "INPUT", f"-i {AP_INTERFACE} -p udp -m udp --dport 67 -j ACCEPT", True),
+        ("filter", "INPUT", f"-s {clients} -p udp -m udp --dport 53 -j ACCEPT", True),
+        ("filter", "INPUT", f"-s {clients} -p tcp -m tcp --dport 53 -j ACCEPT", True),
+    ]
+
+def parseRuleset(text):
+    """Count the rules in iptables-save output by (table, chain, spec)"""
+    counts = {}
+    table = None
+    for line in text.splitlines():
+        if line.startswith("*"):
+            table = line[1:].strip()
+        elif line.startswith("-A ") and table:
+            parts = line.split(None, 2)
+            key = (table, parts[1], " ".join(parts[2].split()) if len(parts) > 2 else "")
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+def readState(executor):
+    """Read the ruleset, the interface and forwarding once, concurrently
+
+    Returns:
+        Dict with rules (counts by (table, chain, spec)), linkUp, addresses
+        (as "address/prefix") and forwarding ("0" or "1")
+    """
+    commands = [
+        ["iptables-save"],
+        ["ip", "-j", "addr", "show", "dev", AP_INTERFACE],
+        ["sysctl", "-n", "net.ipv4.ip_forward"],
+    ]
+    with ThreadPoolExecutor(max_workers=len(commands)) as pool:
+        rules, link, forwarding = pool.map(executor.run, commands)
+
+    for result in (rules, forwarding):
+        if result.returncode != 0:
+            print(f"*** Failed: {' '.join(result.args)}: {result.stderr.strip()}")
+            sys.exit(1)
+
+    try:
+        info = json.loads(link.stdout)[0] if link.returncode == 0 else {}
+    except (ValueError, IndexError):
+        info = {}
+    return {
+        "rules": parseRuleset(rules.stdout),
+        "linkUp": "UP" in info.get("flags", []),
+        "addresses": [f"{a['local']}/{a['prefixlen']}" for a in info.get("addr_info", [])
+                      if a.get("family") == "inet"],
+        "forwarding": forwarding.stdout.strip(),
+    }
+
+def readRecord(path):
+    """What a previous --enable changed, or an empty record"""
+    try:
+        with open(path) as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        record = {}
+    record.setdefault("rules", [])
+    return record
+
+def ruleTransaction(lines):
+    """iptables-restore input for (table, line) pairs, grouped by table"""
+    tables = {}
+    for table, line in lines:
+        tables.setdefault(table, []).append(line)
+    text = []
+    for table, tableLines in tables.items():
+        text.append(f"*{table}")
+        text.extend(tableLines)
+        text.append("COMMIT")
+    return "\n".join(text) + "\n"
+
+# Plan Method
+def enablePlan(state, record):
+    """Stages of (message, argv, stdin) steps for what is missing, plus the updated record
+
+    Steps within a stage run concurrently. Rules already present are left
+    alone, and extra copies of our rules (left by runs before this script
+    kept a record) are deleted in the same transaction.
+    """
+    record = {"rules": [list(rule) for rule in record["rules"]],
+              "address": record.get("address", False),
+              "link": record.get("link", False),
+              "forwarding": record.get("forwarding")}
+    steps = []
+    skipped = []
+
+    if state["linkUp"]:
+        skipped.append("access point interface")
+    else:
+        steps.append(("Brought up the access point interface", ["ip", "link", "set", "up", "dev", AP_INTERFACE], None))
+        record["link"] = True
+
+    if AP_ADDRESS in state["addresses"]:
+        skipped.append("address")
+    else:
+        steps.append((f"Set static IP for the access point, {AP_ADDRESS.split('/')[0]}",
+                      ["ip", "addr", "add", AP_ADDRESS, "dev", AP_INTERFACE], None))
+        record["address"] = True
+
+    if state["forwarding"] == "1":
+        skipped.append("packet forwarding")
+    else:
+        steps.append(("Enabled packet forwarding", ["sysctl", "-w", "net.ipv4.ip_forward=1"], None))
+        if record["forwarding"] is None:
+            record["forwarding"] = state["forwarding"]
+
+    lines = []
+    added = 0
+    removed = 0
+    for table, chain, spec, insert in desiredRules():
+        count = state["rules"].get((table, chain, spec), 0)
+        if count == 0:
+            lines.append((table, f"{'-I' if insert else '-A'} {chain} {spec}"))
+            record["rules"].append([table, chain, spec])
+            added += 1
+        for _ in range(count - 1):
+            lines.append((table, f"-D {chain} {spec}"))
+            removed += 1
+    if lines:
+        message = f"Added {added} iptables rule(s) for NAT and DHCP/DNS"
+        if removed:
+            message += f", removed {removed} duplicate(s)"
+        steps.append((message, ["iptables-restore", "--noflush"], ruleTransaction(lines)))
+    else:
+        skipped.append("iptables rules")
+
+    if skipped:
+        print(f"Already in place: {', '.join(skipped)}")
+
+    services = [
+        ("Started dnsmasq.service", ["systemctl", "start", "dnsmasq.service"], None),
+        ("Started hostapd.service", ["systemctl", "start", "hostapd.service"], None),
+    ]
+    return [stage for stage in (steps, services) if stage], record
+
+def disablePlan(state, record):
+    """Stages that undo what the recorded --enable runs changed and is still there"""
+    steps = []
+    lines = []
+    for table, chain, spec in record["rules"]:
+        if state["rules"].get((table, chain, spec), 0) > 0:
+            lines.append((table, f"-D {chain} {spec}"))
+            state["rules"][(table, chain, spec)] -= 1
+    if lines:
+        steps.append((f"Removed {len(lines)} iptables rule(s) added by --enable",
+                      ["iptables-restore", "--noflush"], ruleTransaction(lines)))
+
+    if record.get("address") and AP_ADDRESS in state["addresses"]:
+        steps.append(("Removed the access point address",
+                      ["ip", "addr", "del", AP_ADDRESS, "dev", AP_INTERFACE], None))
+    if record.get("forwarding") is not None and record["forwarding"] != state["forwarding"]:
+        steps.append(("Restored packet forwarding setting",
+                      ["sysctl", "-w", f"net.ipv4.ip_forward={record['forwarding']}"], None))
+    if record.get("link") and state["linkUp"]:
+        steps.append(("Brought down the access point interface",
+                      ["ip", "link", "set", "down", "dev", AP_INTERFACE], None))
+
+    # Stop hostapd before pulling the network out from under it
+    services = [("Stopped service hostapd.service", ["systemctl", "stop", "hostapd.service"], None)]
+    return [stage for stage in (services, steps) if stage]
+
+def runStage(executor, stage):
+    """Run the steps of one stage concurrently, returning False if any failed"""
+    if len(stage) == 1:
+        results = [executor.run(stage[0][1], stage[0][2])]
+    else:
+        with ThreadPoolExecutor(max_workers=len(stage)) as pool:
+            results = list(pool.map(lambda step: executor.run(step[1], step[2]), stage))
+
+    ok = True
+    for (message, argv, stdin), result in zip(stage, results):
+        if result.returncode == 0:
+            print(message)
+        else:
+            ok = False
+            print(f"*** Failed: {' '.join(argv)}: {result.stderr.strip()}")
+    return ok
+
+def interfaceReady(executor, interface):
+    """Whether the interface is up with a carrier and has its address"""
+    result = executor.run(["ip", "-j", "addr", "show", "dev", interface])
+    if result.returncode != 0:
+        return False
+    try:
+        info = json.loads(result.stdout)[0]
+    except (ValueError, IndexError):
+        return False
+    address = AP_ADDRESS.split("/")[0]
+    return (info.get("operstate") == "UP"
+            and any(a.get("local") == address for a in info.get("addr_info", [])))
+
+def waitForInterface(executor, interface, timeout=READY_TIMEOUT, interval=READY_INTERVAL):
+    """Poll the interface until it is ready, returning the seconds waited or None"""
+    started = time.perf_counter()
+    while True:
+        if interfaceReady(executor, interface):
+            return time.perf_counter() - started
+        if time.perf_counter() - started >= timeout:
+            return None
+        time.sleep(interval)
+
+def printTimings(executor):
+    """Per-command timeline, for comparing bring-up latency"""
+    try:
+        print("")
+        for start, elapsed, argv, returncode in sorted(executor.log, key=lambda entry: entry[0]):
+            status = "" if returncode == 0 else f"  (exit {returncode})"
+            print(f"  {start * 1000:8.1f} ms  +{elapsed * 1000:7.1f} ms  {' '.join(argv)}{status}")
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # Piped into something that stopped reading (e.g. head); keep the exit quiet
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+# Monitor Method
+class RingBuffer:
+    """Fixed-size buffer of the last samples, allocated once"""
+    __slots__ = ("values", "size", "count", "next")
+
+    def __init__(self, size):
+        self.values = array("d", bytes(8 * size))
+        self.size = size
+        self.count = 0
+        self.next = 0
+
+    def push(self, value):
+        self.values[self.next] = value
+        self.next = (self.next + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def last(self, n=None):
+        """The newest n samples (all by default), oldest first"""
+        n = self.count if n is None else min(n, self.count)
+        start = (self.next - n) % self.size
+        return [self.values[(start + i) % self.size] for i in range(n)]
+
+    def mean(self):
+        return sum(self.last()) / self.count if self.count else 0.0
+
+    def peak(self):
+        return max(self.last()) if self.count else 0.0
+
+class HotspotMonitor:
+    """Samples hotspot counters and keeps rates over the last window samples
+
+    Counter files are opened once and re-read from the start on every
+    sample. The lease file is only parsed again when its mtime changes.
+    """
+
+    def __init__(self, interfaces, procRoot=PROC_ROOT, leasesFile=LEASES_FILE, window=MONITOR_WINDOW):
+        self.interfaces = interfaces
+        self.procRoot = procRoot
+        self.leasesFile = leasesFile
+        self.rates = {name: (RingBuffer(window), RingBuffer(window)) for name in interfaces}
+        self.conntrack = RingBuffer(window)
+        self.counters = {}
+        self.sampledAt = None
+        self.leasesMtime = None
+        self.leases = []
+        self.clients = []
+        self.files = {}
+
+        # nf_conntrack_count is one number; /proc/net/nf_conntrack lists every connection
+        # and is only counted when the count file is missing
+        self.countPath = os.path.join(procRoot, "sys/net/netfilter/nf_conntrack_count")
+        self.maxPath = os.path.join(procRoot, "sys/net/netfilter/nf_conntrack_max")
+        self.tablePath = os.path.join(procRoot, "net/nf_conntrack")
+
+    def read(self, path):
+        """Contents of a counter file, or None when it does not exist"""
+        f = self.files.get(path)
+        try:
+            if f is None:
+                f = self.files[path] = open(path)
+            f.seek(0)
+            return f.read()
+        except OSError:
+            self.files.pop(path, None)
+            return None
+
+    def readCounters(self):
+        """rx and tx byte counters of the monitored interfaces from net/dev"""
+        counters = {}
+        text = self.read(os.path.join(self.procRoot, "net/dev")) or ""
+        for line in text.splitlines()[2:]:
+            name, _, fields = line.partition(":")
+            name = name.strip()
+            if name in self.interfaces:
+                fields = fields.split()
+                counters[name] = (int(fields[0]), int(fields[8]))
+        return counters
+
+    def readConntrack(self):
+        """(connections, limit), either may be None when conntrack is not loaded"""
+        count = self.read(self.countPath)
+        if count is not None:
+            count = int(count)
+        else:
+            table = self.read(self.tablePath)
+            count = table.count("\n") if table is not None else None
+        limit = self.read(self.maxPath)
+        return count, int(limit) if limit is not None else None
+
+    def readClients(self, now):
+        """Active dnsmasq leases as (mac, ip, hostname), re-parsed only when the file changes"""
+        try:
+            mtime = os.stat(self.leasesFile).st_mtime_ns
+        except OSError:
+            self.leasesMtime = None
+            self.clients = []
+            return self.clients
+        if mtime != self.leasesMtime:
+            self.leasesMtime = mtime
+            self.leases = []
+            with open(self.leasesFile) as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) >= 4:
+                        self.leases.append((int(fields[0]), fields[1], fields[2], fields[3]))
+        # An expiry of 0 means the lease never expires
+        self.clients = [(mac, ip, host) for expiry, mac, ip, host in self.leases if expiry == 0 or expiry > now]
+        return self.clients
+
+    def sample(self):
+        """Take one sample and return it as a record"""
+        now = time.monotonic()
+        counters = self.readCounters()
+        elapsed = now - self.sampledAt if self.sampledAt is not None else None
+        interfaces = {}
+        for name in self.interfaces:
+            if name not in counters:
+                interfaces[name] = None
+                continue
+            rx, tx = counters[name]
+            rxRate = txRate = 0.0
+            previous = self.counters.get(name)
+            if previous is not None and elapsed:
+                # A counter that went backwards was reset (interface re-created), count from zero
+                rxRate = max(rx - previous[0], 0) / elapsed
+                txRate = max(tx - previous[1], 0) / elapsed
+            if previous is not None:
+                self.rates[name][0].push(rxRate)
+                self.rates[name][1].push(txRate)
+            interfaces[name] = {"rx_bytes": rx, "tx_bytes": tx, "rx_bps": rxRate, "tx_bps": txRate}
+        self.counters = counters
+        self.sampledAt = now
+
+        connections, limit = self.readConntrack()
+        if connections is not None:
+            self.conntrack.push(connections)
+        clients = self.readClients(time.time())
+        return {
+            "time": time.time(),
+            "interfaces": interfaces,
+            "conntrack": connections,
+            "conntrack_max": limit,
+            "clients": [{"mac": mac, "ip": ip, "hostname": host} for mac, ip, host in clients],
+        }
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+def formatRate(value):
+    """Bytes per second in the largest unit that keeps it readable"""
+    for unit in ("B/s", "kB/s", "MB/s"):
+        if value < 1000:
+            return f"{value:6.1f} {unit}"
+        value /= 1000
+    return f"{value:6.1f} GB/s"
+
+def sparkline(values):
+    """One block character per sample, scaled to the largest"""
+    top = max(values) if values else 0
+    if top <= 0:
+        return SPARK_CHARS[0] * len(values)
+    return "".join(SPARK_CHARS[min(int(v / top * len(SPARK_CHARS)), len(SPARK_CHARS) - 1)] for v in values)
+
+def renderSample(monitor, record):
+    """Lines of the refreshing view for one sample"""
+    lines = [time.strftime("%H:%M:%S", time.localtime(record["time"])) + "  hotspot monitor"]
+    for name in monitor.interfaces:
+        if record["interfaces"][name] is None:
+            lines.append(f"  {name:12} not present")
+            continue
+        rx, tx = monitor.rates[name]
+        for label, buffer in (("rx", rx), ("tx", tx)):
+            now = buffer.last(1)[0] if buffer.count else 0.0
+            lines.append(f"  {name if label == 'rx' else '':12} {label} {formatRate(now)}  "
+                         f"avg {formatRate(buffer.mean())}  peak {formatRate(buffer.peak())}  {sparkline(buffer.last(20))}")
+    if record["conntrack"] is None:
+        lines.append("  conntrack    not loaded")
+    else:
+        usage = f" / {record['conntrack_max']} ({record['conntrack'] / record['conntrack_max']:.0%})" if record["conntrack_max"] else ""
+        lines.append(f"  conntrack    {record['conntrack']}{usage}  peak {monitor.conntrack.peak():.0f}")
+    clients = record["clients"]
+    names = ", ".join(client["hostname"] if client["hostname"] != "*" else client["ip"] for client in clients[:4])
+    more = f" +{len(clients) - 4}" if len(clients) > 4 else ""
+    lines.append(f"  clients      {len(clients)}" + (f"  {names}{more}" if clients else ""))
+    return lines
+
+def monitor(args):
+    """Sample until interrupted (or --count samples), as a view or NDJSON"""
+    interval = positiveOption(args, "--interval", MONITOR_INTERVAL, float, "a number of seconds")
+    count = positiveOption(args, "--count", None, int, "a whole number of samples")
+    ndjson = getOption(args, "--format", "text") == "ndjson"
+    hotspot = HotspotMonitor([AP_INTERFACE, WAN_INTERFACE],
+                             procRoot=getOption(args, "--proc-root", PROC_ROOT),
+                             leasesFile=getOption(args, "--leases", LEASES_FILE))
+    refresh = not ndjson and sys.stdout.isatty()
+    drawn = 0
+    taken = 0
+    nextAt = time.monotonic()
+    try:
+        while count is None or taken < count:
+            record = hotspot.sample()
+            taken += 1
+            if ndjson:
+                sys.stdout.write(json.dumps(record) + "\n")
+            else:
+                lines = renderSample(hotspot, record)
+                if refresh and drawn:
+                    # Move back up over the previous view and draw over it
+                    sys.stdout.write(f"\033[{drawn}F")
+                sys.stdout.write("".join(line + "\033[K\n" if refresh else line + "\n" for line in lines))
+                drawn = len(lines)
+            sys.stdout.flush()
+            if count is not None and taken >= count:
+                break
+            # Sleep to the next tick so the interval does not drift
+            nextAt += interval
+            time.sleep(max(nextAt - time.monotonic(), 0))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        hotspot.close()
+
+def getOption(args, name, default):
+    """Value following name in args, or default"""
+    if name in args and args.index(name) + 1 < len(args):
+        return args[args.index(name) + 1]
+    return default
+
+def positiveOption(args, name, default, convert, expected):
+    """Value following name converted and checked to be above zero, exits on anything else"""
+    value = getOption(args, name, None)
+    if value is None:
+        if name in args:
+            print(f"*** {name} needs a value")
+            print(MONITOR_USAGE)
+            sys.exit(1)
+        return default
+    try:
+        converted = convert(value)
+    except ValueError:
+        converted = None
+    # NaN and infinity are floats too, but not something to sleep for
+    if converted is None or not 0 < converted < float("inf"):
+        print(f"*** {name} must be {expected} greater than zero, got {value!r}")
+        print(MONITOR_USAGE)
+        sys.exit(1)
+    return converted
+
+# Enable Method
+def enable(executor, statePath, showTimings=False):
+    """Bring the hotspot up stage by stage, recording what was changed in statePath"""
+    started = time.perf_counter()
+    stages, record = enablePlan(readState(executor), readRecord(statePath))
+    for stage in stages:
+        try:
+            ok = runStage(executor, stage)
+        finally:
+            if stage[0][1][0] != "systemctl":
+                # Record what was changed before anything else can fail, even
+                # when reporting the stage did (e.g. a closed output pipe)
+                writeJson(statePath, record)
+        if not ok:
+            print("*** Bring-up stopped, the hotspot is not online")
+            if showTimings:
+                printTimings(executor)
+            sys.exit(1)
+
+    # Reload Samba (so that it binds to the new interface) once the interface is up
+    waited = waitForInterface(executor, AP_INTERFACE)
+    if waited is None:
+        print(f"*** {AP_INTERFACE} did not come up within {READY_TIMEOUT:.0f}s, restarting smb anyway")
+    runStage(executor, [("Restarted and bound smb.service", ["systemctl", "restart", "smb.service"], None)])
+    print(f"*** The hotspot is now online! ({(time.perf_counter() - started) * 1000:.0f} ms)")
+
+# Disable Method
+def disable(executor, statePath):
+    """Undo what the recorded --enable runs changed, forgetting the record once done"""
+    if not os.path.exists(statePath):
+        print(f"No record of an --enable run in {statePath}, leaving the network configuration alone")
+    ok = all([runStage(executor, stage) for stage in disablePlan(readState(executor), readRecord(statePath))])
+    if ok and os.path.exists(statePath):
+        os.remove(statePath)
+    print("*** The hotspot is now offline!")
+
 # Main Method
 def main(args):
-    # Make sure that we are running as root
-    userID = int(subprocess.run("id -u", shell=True, capture_output=True).stdout)
-    if userID != 0:
+    # Monitoring only reads counters, it needs neither root nor NetworkManager changes
+    if "--monitor" in args:
+        return monitor(args)
+
+    # Make sure that we are running as root (the fake backend needs no privileges)
+    fake = "--fake" in args
+    if not fake and os.geteuid() != 0:
         return print("*** Run this script as root or with sudo!")
 
-    # Make the wireless interface unmanaged
-    subprocess.run("nmcli dev set wlp0s26u1u4 managed no", shell=True, capture_output=True)
-    print("Set ASUS WiFi adapter as an unmanaged interface by NetworkManager")
-
-    # Take action based on the command line arguments
-    if "--enable" in args:
-        # Start the DNS service
-        subprocess.run("systemctl start dnsmasq.service", shell=True, capture_output=True)
-        # Set a static IP for this computer as the access point
-        subprocess.run("ip link set up dev wlp0s26u1u4", shell=True, capture_output=True)
-        subprocess.run("ip addr add 192.168.10.10/24 dev wlp0s26u1u4", shell=True, capture_output=True)
-        print("Set static IP for the access point, 192.168.10.10")
-        # Enable Packet Forwarding
-        subprocess.run("sysctl net.ipv4.ip_forward=1", shell=True, capture_output=True)
-        print("Enabled packet forwarding")
-        # Enable NAT w. IPTABLES
-        subprocess.run("iptables -t nat -A POSTROUTING -o wlp3s0 -j MASQUERADE", shell=True, capture_output=True)
-        subprocess.run("iptables -A FORWARD -m conntrack --ctstate RELATED,ESTABLISHED -j ACCEPT", shell=True, capture_output=True)
-        subprocess.run("iptables -A FORWARD -i wlp0s26u1u4 -o wlp3s0 -j ACCEPT", shell=True, capture_output=True)
-        print("Enabled NAT w. iptables")
-        # Allow DHCP incoming connections
-        subprocess.run("iptables -I INPUT -p udp --dport 67 -i wlp0s26u1u4 -j ACCEPT", shell=True, capture_output=True)
-        subprocess.run("iptables -I INPUT -p udp --dport 53 -s 192.168.10.10/24 -j ACCEPT", shell=True, capture_output=True)
-        subprocess.run("iptables -I INPUT -p tcp --dport 53 -s 192.168.10.10/24 -j ACCEPT", shell=True, capture_output=True)
-        print("Enabled connections to the local DHCP server on IP 192.168.10.10")
-        # Start hostapd
-        subprocess.run("systemctl start hostapd.service", shell=True, capture_output=True)
-        print("Started hostapd.service")
-        # Reload Samba (so that it binds to the new interface)
-        time.sleep(2)
-        subprocess.run("systemctl restart smb.service", shell=True, capture_output=True)
-        print("Restarted and bound smb.service")
-        print("*** The hotspot is now online!")
-    elif "--disable" in args:
-        # Stop HOSTAPDD
-        subprocess.run("systemctl stop hostapd.service", shell=True, capture_output=True)
-        print("Stopped service hostapd.service")
-        print("*** The hotspot is now offline!")
+    statePath = STATE_FILE
+    if fake:
+        # The simulated world and its record persist in the temp dir between --fake runs
+        statePath = os.path.join(tempfile.gettempdir(), "thinkpad-hotspot-fake.json")
+        executor = FakeExecutor(os.path.join(tempfile.gettempdir(), "thinkpad-hotspot-fake-world.json"))
     else:
-        print("Neither --enable or --disable was supplied in the command line arguments, doing nothing.")
+        executor = SubprocessExecutor()
+    showTimings = "--timings" in args or fake
+
+    # Closed on every way out, so the fake backend always saves its world
+    try:
+        # Make the wireless interface unmanaged
+        executor.run(["nmcli", "dev", "set", AP_INTERFACE, "managed", "no"])
+        print("Set ASUS WiFi adapter as an unmanaged interface by NetworkManager")
+
+        # Take action based on the command line arguments
+        if "--enable" in args:
+            enable(executor, statePath, showTimings)
+        elif "--disable" in args:
+            disable(executor, statePath)
+        else:
+            print("Neither --enable, --disable or --monitor was supplied in the command line arguments, doing nothing.")
+            return
+
+        if showTimings:
+            printTimings(executor)
+    finally:
+        executor.close()
 
 if __name__ == "__main__":
     # Get the arguments from the command line
     arguments = sys.argv
     arguments.pop(0)
-    main(arguments)
-
+    try:
+        main(arguments)
+    except BrokenPipeError:
+        # Output was piped into something that stopped reading (e.g. head)
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
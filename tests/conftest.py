@@ -0,0 +1,17 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO))
+
+
+@pytest.fixture(scope="session")
+def hotspot():
+    """scripts/thinkpad-hotspot.py loaded as a module"""
+    spec = importlib.util.spec_from_file_location("thinkpad_hotspot", REPO / "scripts" / "thinkpad-hotspot.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+import dotfiles
+
+ENTRIES = [
+    (".vimrc", ".vimrc", "Vim configuration"),
+    (".config/i3", ".config/i3", "i3 window manager"),
+]
+
+
+@pytest.fixture
+def manifest(monkeypatch):
+    """A small manifest of real repo entries, shared with the worker processes"""
+    monkeypatch.setattr(dotfiles, "DOTFILES", list(ENTRIES))
+    monkeypatch.setattr(dotfiles, "MANIFEST_SETTINGS", {})
+
+
+def test_read_home_roots(tmp_path):
+    listing = tmp_path / "homes.txt"
+    listing.write_text(f"{tmp_path}/b  # second\n\n{tmp_path}/c\n")
+    roots = dotfiles.read_home_roots([f"{tmp_path}/a,{tmp_path}/b", f"@{listing}"])
+    assert roots == [f"{tmp_path}/a", f"{tmp_path}/b", f"{tmp_path}/c"]
+
+
+def test_apply_homes(manifest, tmp_path, capsys):
+    fresh = tmp_path / "fresh"
+    taken = tmp_path / "taken"
+    broken = tmp_path / "broken"
+    fresh.mkdir()
+    taken.mkdir()
+    (taken / ".vimrc").write_text("set number\n")
+    broken.write_text("a file, not a home\n")
+
+    summaries = dotfiles.apply_homes([str(fresh), str(taken), str(broken)], processes=2)
+
+    assert [summary['home'] for summary in summaries] == [str(fresh), str(taken), str(broken)]
+    for source_rel, dest_rel, desc in ENTRIES:
+        assert os.readlink(fresh / dest_rel) == str(dotfiles.SCRIPT_DIR / source_rel)
+    assert summaries[0]['error'] is None
+    assert (summaries[0]['linked'], summaries[0]['skipped'], summaries[0]['failed']) == (2, 0, 0)
+
+    # Without --yes the existing file is left alone and only the other entry is linked
+    assert (taken / ".vimrc").read_text() == "set number\n"
+    assert os.readlink(taken / ".config/i3") == str(dotfiles.SCRIPT_DIR / ".config/i3")
+    assert (summaries[1]['linked'], summaries[1]['skipped']) == (1, 1)
+
+    assert summaries[2]['error'] == "not a directory"
+    out = capsys.readouterr().out
+    assert f"✗ {broken}: not a directory" in out
+    assert "Done: 2/3 roots without failures, 3 entries linked, 1 skipped" in out
+
+
+def test_apply_homes_force(manifest, tmp_path):
+    home = tmp_path / "home"
+    home.mkdir()
+    (home / ".vimrc").write_text("set number\n")
+
+    summaries = dotfiles.apply_homes([str(home), str(tmp_path / "missing")], force=True,
+                                     processes=2, output_format="ndjson")
+
+    assert os.readlink(home / ".vimrc") == str(dotfiles.SCRIPT_DIR / ".vimrc")
+    assert summaries[0]['linked'] == 2
+    assert list((home / ".dotfiles-backup" / "trees").glob(".vimrc.backup.*.json"))
+    assert summaries[1]['error'] == "not a directory"
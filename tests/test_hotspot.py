@@ -0,0 +1,171 @@
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+MASQUERADE = "-o wlp3s0 -j MASQUERADE"
+UNRELATED = "-p tcp -m tcp --dport 22 -j ACCEPT"
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return tmp_path / "record.json", tmp_path / "world.json"
+
+
+def executor(hotspot, world, cls=None):
+    """A FakeExecutor on the world file without latency, as each --fake run creates one"""
+    cls = cls or hotspot.FakeExecutor
+    fake = cls(str(world), latency={name: 0.0 for name in hotspot.FakeExecutor.LATENCY})
+    fake.CARRIER_DELAY = 0
+    return fake
+
+
+def run(hotspot, action, statePath, world, cls=None):
+    fake = executor(hotspot, world, cls)
+    try:
+        action(fake, str(statePath))
+    finally:
+        fake.close()
+    return [entry[2] for entry in fake.log]
+
+
+def load(path):
+    return json.loads(path.read_text())
+
+
+def test_enable_twice_changes_nothing(hotspot, paths):
+    statePath, world = paths
+    run(hotspot, hotspot.enable, statePath, world)
+    first, record = load(world), load(statePath)
+    assert first["hostapd"] and first["linkUp"] and first["forwarding"] == "1"
+    assert first["addresses"] == [hotspot.AP_ADDRESS]
+    assert len(record["rules"]) == len(hotspot.desiredRules())
+
+    commands = run(hotspot, hotspot.enable, statePath, world)
+    assert load(world) == first
+    assert load(statePath) == record
+    assert not [argv for argv in commands if argv[0] == "iptables-restore" or argv[:3] == ["ip", "addr", "add"]
+                or argv[:2] == ["sysctl", "-w"]]
+
+
+def test_disable_removes_what_was_recorded(hotspot, paths):
+    statePath, world = paths
+    # One of our rules and an unrelated one were there before, with forwarding on
+    initial = executor(hotspot, world)
+    initial.world["forwarding"] = "1"
+    initial.world["tables"]["nat"]["POSTROUTING"].append(MASQUERADE)
+    initial.world["tables"]["filter"]["INPUT"].append(UNRELATED)
+    initial.close()
+    before = load(world)
+
+    run(hotspot, hotspot.enable, statePath, world)
+    run(hotspot, hotspot.enable, statePath, world)
+    record = load(statePath)
+    assert ["nat", "POSTROUTING", MASQUERADE] not in record["rules"]
+    assert len(record["rules"]) == len(hotspot.desiredRules()) - 1
+    assert record["forwarding"] is None
+
+    run(hotspot, hotspot.disable, statePath, world)
+    after = load(world)
+    assert after["tables"] == before["tables"]
+    assert after["forwarding"] == "1"
+    assert after["addresses"] == [] and not after["linkUp"] and not after["hostapd"]
+    assert not statePath.exists()
+
+
+def test_failed_stage_stops_and_records(hotspot, paths, capsys):
+    statePath, world = paths
+
+    class FailingSysctl(hotspot.FakeExecutor):
+        def execute(self, argv, input):
+            if argv[:2] == ["sysctl", "-w"]:
+                return hotspot.subprocess.CompletedProcess(argv, 1, "", "sysctl: permission denied")
+            return super().execute(argv, input)
+
+    fake = executor(hotspot, world, FailingSysctl)
+    with pytest.raises(SystemExit) as exit:
+        try:
+            hotspot.enable(fake, str(statePath))
+        finally:
+            fake.close()
+    assert exit.value.code == 1
+    assert not [entry for entry in fake.log if entry[2][0] == "systemctl"]
+    assert "Bring-up stopped" in capsys.readouterr().out
+
+    # The rest of the stage went through and is recorded, the services were never started
+    current, record = load(world), load(statePath)
+    assert not current["hostapd"]
+    assert record["address"] and record["link"] and record["forwarding"] == "0"
+    assert len(record["rules"]) == len(hotspot.desiredRules())
+    assert sum(len(rules) for chains in current["tables"].values() for rules in chains.values()) == len(record["rules"])
+
+    commands = run(hotspot, hotspot.disable, statePath, world)
+    assert ["systemctl", "stop", "hostapd.service"] in commands
+    after = load(world)
+    assert after["addresses"] == [] and not after["linkUp"]
+    assert all(not rules for chains in after["tables"].values() for rules in chains.values())
+
+
+def test_monitor_ndjson(hotspot, capsys):
+    hotspot.monitor(["--monitor", "--count", "2", "--interval", "0.01", "--format", "ndjson",
+                     "--proc-root", str(FIXTURES / "proc"), "--leases", str(FIXTURES / "dnsmasq.leases")])
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert len(records) == 2
+    for record in records:
+        assert record["interfaces"][hotspot.WAN_INTERFACE]["rx_bytes"] == 9184221
+        assert record["interfaces"][hotspot.AP_INTERFACE]["tx_bytes"] == 4194304
+        assert (record["conntrack"], record["conntrack_max"]) == (142, 262144)
+        # The lease that expired in 1970 is gone, the one that never expires stays
+        assert record["clients"] == [
+            {"mac": "3c:22:fb:1a:2b:3c", "ip": "192.168.10.101", "hostname": "macbook"},
+            {"mac": "a4:83:e7:4d:5e:6f", "ip": "192.168.10.102", "hostname": "*"},
+        ]
+    # Counters did not move between the samples
+    assert records[1]["interfaces"][hotspot.AP_INTERFACE]["rx_bps"] == 0.0
+
+
+def test_monitor_rates(hotspot, tmp_path, monkeypatch):
+    proc = tmp_path / "proc"
+    shutil.copytree(FIXTURES / "proc", proc)
+    dev = proc / "net" / "dev"
+    text = dev.read_text()
+    clock = iter([100.0, 102.0, 103.0])
+    monkeypatch.setattr(hotspot.time, "monotonic", lambda: next(clock))
+    monitor = hotspot.HotspotMonitor([hotspot.AP_INTERFACE, "wwan0"], procRoot=str(proc),
+                                     leasesFile=str(tmp_path / "missing.leases"), window=4)
+    try:
+        first = monitor.sample()
+        assert first["interfaces"]["wwan0"] is None
+        assert first["interfaces"][hotspot.AP_INTERFACE]["rx_bps"] == 0.0
+        assert monitor.rates[hotspot.AP_INTERFACE][0].count == 0
+
+        # 1 MB in and 3 MB out over the two seconds between samples
+        dev.write_text(text.replace("1048576", "3048576").replace("4194304", "10194304"))
+        second = monitor.sample()["interfaces"][hotspot.AP_INTERFACE]
+        assert (second["rx_bps"], second["tx_bps"]) == (1000000.0, 3000000.0)
+
+        # A counter going backwards is a reset, not a negative rate
+        dev.write_text(text.replace("1048576", "1000"))
+        third = monitor.sample()["interfaces"][hotspot.AP_INTERFACE]
+        assert third["rx_bps"] == 0.0
+        assert monitor.rates[hotspot.AP_INTERFACE][0].last() == [1000000.0, 0.0]
+        assert monitor.rates[hotspot.AP_INTERFACE][1].peak() == 3000000.0
+    finally:
+        monitor.close()
+
+
+@pytest.mark.parametrize("option", [
+    ["--interval", "0"], ["--interval", "-1"], ["--interval", "fast"], ["--interval", "nan"],
+    ["--count", "0"], ["--count", "-3"], ["--count", "1.5"], ["--count"],
+])
+def test_monitor_rejects_bad_options(hotspot, capsys, option):
+    with pytest.raises(SystemExit) as exit:
+        hotspot.monitor(["--monitor", "--format", "ndjson"] + option)
+    assert exit.value.code == 1
+    out = capsys.readouterr().out
+    assert out.startswith(f"*** {option[0]}")
+    assert hotspot.MONITOR_USAGE in out
@@ -0,0 +1,68 @@
+import os
+
+import dotfiles
+
+
+class VanishingEntry:
+    """A DirEntry whose file disappears between the scandir and the stat"""
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.name = entry.name
+        self.path = entry.path
+
+    def __getattr__(self, name):
+        return getattr(self.entry, name)
+
+    def stat(self, follow_symlinks=True):
+        raise FileNotFoundError(self.path)
+
+
+class Scandir:
+    def __init__(self, entries):
+        self.entries = entries
+
+    def __enter__(self):
+        return iter(self.entries)
+
+    def __exit__(self, *exc):
+        return False
+
+
+def test_tree_diff(tmp_path):
+    source, dest = tmp_path / "source", tmp_path / "dest"
+    (source / "sub").mkdir(parents=True)
+    (source / "same").write_text("a\n")
+    (source / "changed").write_text("a\n")
+    (source / "sub" / "new").write_text("b\n")
+    dest.mkdir()
+    (dest / "same").write_text("a\n")
+    (dest / "changed").write_text("c\n")
+
+    diff = dotfiles.TreeLinker(dotfiles.ContentComparer()).diff(str(source), str(dest))
+    assert diff.links == ["sub"]
+    assert diff.identical == ["same"]
+    assert diff.conflicts == [("changed", dotfiles.KIND_FILE)]
+    assert diff.state() == dotfiles.STATUS_EXISTS
+
+
+def test_tree_diff_file_vanishes(tmp_path, monkeypatch):
+    source, dest = tmp_path / "source", tmp_path / "dest"
+    source.mkdir()
+    dest.mkdir()
+    (source / "gone").write_text("a\n")
+    (dest / "gone").write_text("a\n")
+
+    scandir = os.scandir
+
+    def vanishing(path):
+        with scandir(path) as it:
+            entries = list(it)
+        if path == str(dest):
+            entries = [VanishingEntry(entry) for entry in entries]
+        return Scandir(entries)
+
+    monkeypatch.setattr(dotfiles.os, "scandir", vanishing)
+    diff = dotfiles.TreeLinker(dotfiles.ContentComparer()).diff(str(source), str(dest))
+    assert diff.conflicts == [("gone", dotfiles.KIND_OTHER)]
+    assert diff.folds == [] and diff.identical == []